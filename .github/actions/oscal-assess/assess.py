@@ -1,35 +1,51 @@
 #!/usr/bin/env python3
+# Jinja2, and the modules only some runs need (sharding, the results store,
+# schema validation), are imported where they are used to keep startup short.
+# cli.py is the entry point and configures logging.
 
+import argparse
 from datetime import datetime, timezone
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from itertools import chain
 import logging
-from os import environ, getenv, path, PathLike
+from os import environ, getenv, path, PathLike, replace, unlink
 from pathlib import Path
-import subprocess
-from sys import exit
-from typing import Dict, List, NamedTuple, Union
-from uuid import uuid4
-from yaml import safe_dump, safe_load
+from sys import argv, exit
+from tempfile import NamedTemporaryFile
+from time import perf_counter, thread_time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from uuid import UUID, uuid4, uuid5
 
+from loader import load_document
 from content import ApTask, extract_ap_tasks, extract_import_ssp, extract_reviewed_controls
+from incremental import RESULTS_CACHE_FILE, ResultCache
+from checks import CHECK_METHODS, CheckOptions, CheckResult, Target, get_check_method, http_pool, parse_targets
+from metrics import TaskMetrics, write_metrics
+from schedule import build_task_graph, dependency_groups, run_scheduled, task_priorities
+from writer import AR_RESULT_TITLE, AR_RESULT_UUID, ArWriter, format_for_path, yaml_scalar
 
-logging.basicConfig()
-logger = logging.getLogger('oscal_assess')
-
-DEBUG_LOGGING = int(getenv('RUNNER_DEBUG', 0))
+if TYPE_CHECKING:
+    from jinja2 import Environment
 
-if DEBUG_LOGGING == 1: 
-    logger.setLevel(logging.DEBUG)
-else:
-    logger.setLevel(logging.INFO)
+logger = logging.getLogger('oscal_assess')
 
 SCRIPT_DIR = path.dirname(path.realpath(__file__))
 TEMPLATES_DIR = f"{SCRIPT_DIR}/templates"
 ASSESSMENT_RESULT_TEMPLATE = f"{TEMPLATES_DIR}/assessment_result.yaml.j2"
+DEFAULT_WORKERS = 1
+PYTHON_RUNNERS = ('subprocess', 'in-process')
 
 class ApTaskResult(NamedTuple):
     task: ApTask
     result: bool
+    # 'hit' if carried forward from a previous run, 'miss' if run in
+    # incremental mode, None otherwise.
+    cache: Optional[str] = None
+    # When the result was collected, if not at assessment results creation.
+    collected: Optional[str] = None
+    # Name of the target the task ran against, None without explicit targets.
+    target: Optional[str] = None
+    # Timing and resource usage of the check, None if it was not run.
+    metrics: Optional[TaskMetrics] = None
 
 class AssessmentWorkflowContext(NamedTuple):
     relevant_evidence_href: str
@@ -41,7 +57,34 @@ class AssessmentWorkflowContext(NamedTuple):
     ssp: dict
     ssp_path: Union[str, bytes, Path, PathLike]
     tasks_results: List[ApTaskResult]
-    ar_renderer: Environment
+    # None when results are streamed, which does not render the template.
+    ar_renderer: Optional['Environment']
+    workers: int = DEFAULT_WORKERS
+    task_timeout: Optional[float] = None
+    stream_results: bool = False
+    cache_dir: Optional[Path] = None
+    incremental: bool = False
+    target_fingerprint: Optional[str] = None
+    python_runner: str = 'subprocess'
+    # Deployments to run every task against, each gets its own result in the
+    # assessment results. Empty for a single run against the implied target.
+    targets: Tuple[Target, ...] = ()
+    # File to export per-task timing and resource usage to, if any.
+    metrics_path: Optional[Path] = None
+    # Validate the assessment results against the OSCAL schema, with schemas
+    # from schema_dir if given and downloaded into cache_dir otherwise.
+    validate_results: bool = False
+    schema_dir: Optional[Path] = None
+    # Run only the tasks of shard shard_index of shard_count, partitioned
+    # by the task durations in shard_durations_path if given.
+    shard_index: int = 0
+    shard_count: int = 1
+    shard_durations_path: Optional[Path] = None
+    # SQLite store to append this run's results to, for trends and diffs,
+    # and whose history puts the tasks most likely to fail first.
+    results_store_path: Optional[Path] = None
+    # Start no more tasks once one fails, writing the results so far.
+    fail_fast: bool = False
 
 def create_context() -> AssessmentWorkflowContext:
     """Create execution context for runtime requirements of workflow.
@@ -53,29 +96,42 @@ def create_context() -> AssessmentWorkflowContext:
         ar_path = Path(getenv('INPUT_ASSESSMENT_RESULTS_PATH', 'nopath')) if Path(getenv('INPUT_ASSESSMENT_RESULTS_PATH', 'nopath')).parent.exists() else None
         ar_template_path =  Path(ASSESSMENT_RESULT_TEMPLATE) if (Path(ASSESSMENT_RESULT_TEMPLATE).exists()) else None
         ar_template_file = ar_template_path.name
+        workers = int(getenv('INPUT_WORKERS') or DEFAULT_WORKERS)
+        task_timeout = float(getenv('INPUT_TASK_TIMEOUT') or 0) or None
+        stream_results = getenv('INPUT_STREAM_RESULTS', 'false').lower() == 'true'
+        cache_dir = Path(getenv('INPUT_CACHE_PATH')).expanduser() if getenv('INPUT_CACHE_PATH') else None
+        incremental = getenv('INPUT_INCREMENTAL', 'false').lower() == 'true'
+        target_fingerprint = getenv('INPUT_TARGET_FINGERPRINT') or None
+        python_runner = getenv('INPUT_PYTHON_RUNNER') or 'subprocess'
+        targets = tuple(parse_targets(getenv('INPUT_TARGETS', '')))
+        metrics_path = Path(getenv('INPUT_METRICS_PATH')) if getenv('INPUT_METRICS_PATH') else None
+        validate_results = getenv('INPUT_VALIDATE_RESULTS', 'false').lower() == 'true'
+        schema_dir = Path(getenv('INPUT_SCHEMA_PATH')) if getenv('INPUT_SCHEMA_PATH') else None
+        shard_index = int(getenv('INPUT_SHARD_INDEX') or 0)
+        shard_count = int(getenv('INPUT_SHARD_COUNT') or 1)
+        shard_durations_path = Path(getenv('INPUT_SHARD_DURATIONS_PATH')) if getenv('INPUT_SHARD_DURATIONS_PATH') else None
+        results_store_path = Path(getenv('INPUT_RESULTS_STORE_PATH')).expanduser() if getenv('INPUT_RESULTS_STORE_PATH') else None
+        fail_fast = getenv('INPUT_FAIL_FAST', 'false').lower() == 'true'
 
         if not ap_path: raise RuntimeError('Assessment plan path invalid')
         if not ar_path: raise RuntimeError('Assessment result output path invalid')
         if not ar_template_path: raise RuntimeError('Path for assessment template file invalid')
+        if workers < 1: raise RuntimeError('Worker count must be at least 1')
+        if incremental and not cache_dir: raise RuntimeError('Incremental assessment requires a cache path')
+        if python_runner not in PYTHON_RUNNERS: raise RuntimeError(f"Python runner must be one of {PYTHON_RUNNERS}")
+        if not 0 <= shard_index < shard_count: raise RuntimeError(f"Shard index must be from 0 to one less than the shard count {shard_count}")
 
-        ap = load_yaml(ap_path)
+        ap = load_yaml(ap_path, cache_dir)
         ssp_file = extract_import_ssp(ap)
         ssp_path = Path(f"{ap_path.parent}/{ssp_file}") if Path(f"{ap_path.parent}/{ssp_file}").exists() else None
 
         if not ssp_path: raise RuntimeError('Invalid path for SSP file referenced in assessment plan path invalid')
 
-        ssp = load_yaml(ssp_path)
-
-        ar_renderer = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
-
-        # By default, Jinja2 does not have a filter to convert Python objects
-        # from Python to YAML, only JSON, we have to create our own filter.
-        # https://github.com/kapicorp/kapitan/issues/27
-        # https://github.com/kapicorp/kapitan/pull/32
-        def jinja2_yaml_filter(obj):
-            return safe_dump(obj, default_flow_style=False)
+        ssp = load_yaml(ssp_path, cache_dir)
 
-        ar_renderer.filters['to_yaml'] = jinja2_yaml_filter
+        # The template only renders YAML, JSON results are always streamed.
+        stream_results = stream_results or format_for_path(ar_path) == 'json'
+        ar_renderer = create_ar_renderer(cache_dir) if not stream_results else None
 
         context = AssessmentWorkflowContext(
             relevant_evidence_href,
@@ -83,7 +139,23 @@ def create_context() -> AssessmentWorkflowContext:
             ar_path, ar_template_path, ar_template_file,
             ssp, ssp_path, 
             tasks_results=[], 
-            ar_renderer=ar_renderer
+            ar_renderer=ar_renderer,
+            workers=workers,
+            task_timeout=task_timeout,
+            stream_results=stream_results,
+            cache_dir=cache_dir,
+            incremental=incremental,
+            target_fingerprint=target_fingerprint,
+            python_runner=python_runner,
+            targets=targets,
+            metrics_path=metrics_path,
+            validate_results=validate_results,
+            schema_dir=schema_dir,
+            shard_index=shard_index,
+            shard_count=shard_count,
+            shard_durations_path=shard_durations_path,
+            results_store_path=results_store_path,
+            fail_fast=fail_fast
         )
 
         logger.debug(f"Context: {context}")
@@ -93,101 +165,365 @@ def create_context() -> AssessmentWorkflowContext:
         logger.error('Context builder failed')
         raise err
 
-def load_yaml(path: Union[str, bytes, Path, PathLike]):
-    """Load an OSCAL Assessment Plan YAML file.
+def create_ar_renderer(cache_dir: Optional[Path] = None) -> 'Environment':
+    """Create the Jinja2 environment for the OSCAL Assessment Result template.
+    With cache_dir, the compiled template is cached there and only compiled
+    again when the template changes.
+    """
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+    from yaml import safe_dump
+
+    bytecode_cache = None
+    if cache_dir:
+        Path(cache_dir).joinpath('templates').mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(str(Path(cache_dir).joinpath('templates')))
+    ar_renderer = Environment(loader=FileSystemLoader(TEMPLATES_DIR), bytecode_cache=bytecode_cache)
+
+    # By default, Jinja2 does not have a filter to convert Python objects
+    # from Python to YAML, only JSON, we have to create our own filter.
+    # https://github.com/kapicorp/kapitan/issues/27
+    # https://github.com/kapicorp/kapitan/pull/32
+    def jinja2_yaml_filter(obj):
+        return safe_dump(obj, default_flow_style=False)
+
+    ar_renderer.filters['to_yaml'] = jinja2_yaml_filter
+    ar_renderer.filters['to_yaml_scalar'] = yaml_scalar
+    return ar_renderer
+
+def load_yaml(path: Union[str, bytes, Path, PathLike], cache_dir: Optional[Path] = None):
+    """Load an OSCAL YAML (or JSON) file, from the parsed document cache in
+    cache_dir if it has been loaded before with the same content.
     """
     try:
-        return safe_load(open(path, 'r'))
+        return load_document(path, cache_dir)
 
     except Exception as err:
-        logger.error('Cannot load AP YAML file')
+        logger.error(f"Cannot load OSCAL file {path}")
         raise err
 
-def process_ap(context):
+def process_ap(context, on_result: Optional[Callable[[ApTaskResult], None]] = None, results_cache: Optional[ResultCache] = None):
     """Process the OSCAL Assessment Plan to retrieve tasks, execute them, and
     return results to be inserted into OSCAL Assessment Results doc template.
+    Tasks run once the tasks they depend on have passed, those most likely to
+    fail first, as schedule describes. If given, on_result is called with
+    each task result in plan order as soon as it and all the tasks before it
+    have completed. Unchanged results are carried forward from results_cache
+    if given, or from the cache file in incremental mode.
     """
-    # Extract automation tasks from the assessment plan.
+    # Extract automation tasks from the assessment plan, once for all targets.
     tasks = extract_ap_tasks(context.ap, context.ssp)
+    durations = None
+    if context.shard_durations_path:
+        from shard import load_task_durations
+        durations = load_task_durations(context.shard_durations_path)
+    if context.shard_count > 1:
+        from shard import shard_tasks
+        plan_tasks_count = len(tasks)
+        groups = dependency_groups(tasks, build_task_graph(tasks))
+        tasks = shard_tasks(tasks, context.shard_index, context.shard_count, durations, groups)
+        logger.info(f"Shard {context.shard_index + 1} of {context.shard_count} runs {len(tasks)} of {plan_tasks_count} tasks")
     tasks_count = len(tasks)
-    logger.debug(f"Processed {context.ap_path} and found {tasks_count} tasks to run")
-
-    for idx, t in enumerate(tasks):
+    targets = context.targets or (None,)
+    logger.debug(f"Processed {context.ap_path} and found {tasks_count} tasks to run against {len(targets)} target(s) with {context.workers} worker(s)")
+
+    graph = build_task_graph(tasks)
+    history = None
+    if context.results_store_path and Path(context.results_store_path).exists():
+        from store import ResultStore
+        with ResultStore(context.results_store_path) as store:
+            history = store.task_history()
+        logger.debug(f"Prioritizing tasks by the history of {sum(1 for t in tasks if t.uuid in history)} of them")
+    priorities = task_priorities(tasks, graph, history, durations)
+
+    if results_cache is None and context.incremental:
+        results_cache = ResultCache(context.cache_dir.joinpath(RESULTS_CACHE_FILE), context.target_fingerprint)
+
+    def run_indexed_task(target: Optional[Target], idx: int, t: ApTask):
+        target_name = target.name if target else None
+        task_label = f"{idx+1}/{tasks_count}" + (f" against {target_name}" if target else '')
         try:
-            logger.debug(f"Running task {idx+1}/{tasks_count}")
-            task_result = run_task(t)
-            context.tasks_results.append(ApTaskResult(t,task_result if type(task_result) == bool else False))
+            cache_key = results_cache.key(t, target) if results_cache else None
+            # Shared setup is run every time, the checks after it rely on it.
+            cached = results_cache.get(cache_key) if cache_key and idx not in graph.fixtures else None
+            if cached:
+                logger.debug(f"Task {task_label} is unchanged, carrying forward result from {cached.collected}")
+                return ApTaskResult(t, cached.result, cache='hit', collected=cached.collected, target=target_name)
+
+            logger.debug(f"Running task {task_label}")
+            task_result, task_metrics = run_task_with_metrics(t, context.task_timeout, context.python_runner, target)
+            task_result = task_result if type(task_result) == bool else False
+            logger.debug(f"Task {task_label} took {task_metrics.wall_time:.3f}s")
+
+            if results_cache:
+                collected = datetime.now(timezone.utc).isoformat()
+                if cache_key:
+                    results_cache.put(cache_key, task_result, collected)
+                return ApTaskResult(t, task_result, cache='miss', collected=collected, target=target_name, metrics=task_metrics)
+
+            return ApTaskResult(t, task_result, target=target_name, metrics=task_metrics)
 
         except Exception as err:
             logger.exception(err)
-            logger.error(f"Running task {idx+1} failed, continuing to next task if any")
-            continue
-
-def run_task(task: ApTask):
-    """Execute an OSCAL Assessment Plan task with a ar-check-method as defined
-    in the relevant property as one of type 'system-shell-return-code' and
-    return a boolean that reflects whether the actual POSIX shell return code
-    matches the expected return code value as defined in the value of the prop
-    'ar-check-result' for that task.
+            logger.error(f"Running task {task_label} failed, reporting it as failed and continuing to next task if any")
+            return ApTaskResult(t, False, target=target_name)
+
+    def blocked_task(target: Optional[Target], idx: int, t: ApTask):
+        target_name = target.name if target else None
+        logger.warning(f"Task '{t.title}' is not run" + (f" against {target_name}" if target else '') + ', a task it depends on failed')
+        return ApTaskResult(t, False, target=target_name)
+
+    def collect(node: int, tr: ApTaskResult):
+        context.tasks_results.append(tr)
+        if on_result:
+            on_result(tr)
+
+    # Every target gets its own copy of the task graph, and all of them share
+    # one pool. Tasks may finish in any order, but results are collected
+    # target by target in plan order so the assessment results stay stable.
+    runs = [(target, idx, t) for target in targets for idx, t in enumerate(tasks)]
+    prerequisites = [
+        tuple(target_idx * tasks_count + p for p in graph.prerequisites[idx])
+        for target_idx in range(len(targets)) for idx in range(tasks_count)
+    ]
+    skipped = run_scheduled(
+        prerequisites, priorities * len(targets),
+        run=lambda node: run_indexed_task(*runs[node]),
+        passed=lambda tr: tr.result,
+        blocked=lambda node: blocked_task(*runs[node]),
+        workers=context.workers,
+        fail_fast=context.fail_fast,
+        on_result=collect
+    )
+    if skipped:
+        logger.warning(f"Stopped after a task failed, {skipped} of {len(runs)} task run(s) were not started")
+
+    # Pages fetched by http-content checks are only reused within one run.
+    http_pool.close()
+
+    if results_cache:
+        hits = sum(1 for tr in context.tasks_results if tr.cache == 'hit')
+        logger.info(f"Carried forward {hits} of {len(runs)} task result(s) from the previous run")
+        results_cache.save()
+
+def run_task(task: ApTask, timeout: Optional[float] = None, python_runner: str = 'subprocess', target: Optional[Target] = None):
+    """Execute a task as run_task_with_metrics does and return only whether
+    it passed.
+    """
+    return run_task_with_metrics(task, timeout, python_runner, target)[0]
+
+def run_task_with_metrics(task: ApTask, timeout: Optional[float] = None, python_runner: str = 'subprocess', target: Optional[Target] = None) -> Tuple[bool, TaskMetrics]:
+    """Execute an OSCAL Assessment Plan task with the ar-check-method named in
+    the relevant property, one of those registered in checks.CHECK_METHODS,
+    and return a boolean that reflects whether the task passed. For the
+    default 'system-shell-return-code' that is whether the actual POSIX shell
+    return code matches the expected return code value as defined in the
+    value of the prop 'ar-check-result' for that task. A task still running
+    after timeout seconds is killed and reported as failed. If given, the
+    check is run against target instead of the deployment it implies.
+
+    Along with the result, return the wall time of the check and, for checks
+    that run a process, its CPU time, peak RSS and exit code. Checks that run
+    in this process are charged the CPU time of the calling thread.
     """
     try:
         logger.debug(f"Trying to run task '{task.title}' with uuid {task.uuid}")
         ar_check_method = task.props.get('ar-check-method', '')
-        ar_check_result = int(task.props.get('ar-check-result'))
+        check_method = get_check_method(ar_check_method)
 
-        if ar_check_method != 'system-shell-return-code':
-            logger.warning(f"Task ar-check-method is unsupported '{ar_check_method}', not 'system-shell-return-code'")
-            return False
+        if not check_method:
+            logger.warning(f"Task ar-check-method is unsupported '{ar_check_method}', not one of {sorted(CHECK_METHODS)}")
+            return False, TaskMetrics(0.0)
 
-        env = environ.copy()
-        for raw_param, value in task.params.items():
-            param = 'SSP_PARAM_' + raw_param.upper().replace('-', '_')
-            env[param] = value
+        wall_start, cpu_start = perf_counter(), thread_time()
+        check_result = check_method(task, CheckOptions(timeout, python_runner, target))
+        wall_time, cpu_time = perf_counter() - wall_start, thread_time() - cpu_start
 
-        task_res_path = Path(task.resource.file)
-        return_code = subprocess.call(task_res_path, env=env)
-        return return_code == ar_check_result
+        if isinstance(check_result, CheckResult):
+            usage = check_result.usage
+            check_result = check_result.passed
+            if usage:
+                return check_result, TaskMetrics(wall_time, usage.cpu_time, usage.max_rss, usage.exit_code)
+
+        return check_result, TaskMetrics(wall_time, cpu_time)
 
     except Exception as err:
         logger.error(f"Running task with uuid {task.uuid} failed")
         raise err
 
+BLOSSOM_NS = 'https://www.nist.gov/itl/csd/ssag/blossom'
+RELEVANT_EVIDENCE_DESCRIPTION = 'This observation is the result of automated testing in a run of a GitHub Actions workflow. For detailed information, please review the run status and detailed logging from its configuration, step inputs, and step outputs.'
+
+def stable_uuid(name: str) -> str:
+    """Generate a uuid that is the same for the same name in every run, so
+    results of different runs can be compared by uuid.
+    """
+    return str(uuid5(UUID(AR_RESULT_UUID), name))
+
+def task_result_observation_uuid(tr: ApTaskResult) -> str:
+    """Generate the uuid of the observation of a task result, the same for
+    the same task and target in every run.
+    """
+    return stable_uuid(f"observation/{tr.target or ''}/{tr.task.uuid}")
+
+def task_result_to_observation(tr: ApTaskResult, relevant_evidence_href: str, current_timestamp: str) -> dict:
+    """Generate the observation for a single task result, with a uuid stable
+    across runs for the same task and target.
+    """
+    task = tr.task
+    method = task.associated_activity_props.get('method')
+    observation_uuid = task_result_observation_uuid(tr)
+    props = [
+        {
+            'name': 'assessment-plan-task-uuid',
+            'ns': BLOSSOM_NS,
+            'value': task.uuid
+        },
+        {
+            'name': 'assessment-plan-task-result',
+            'ns': BLOSSOM_NS,
+            'value': 'success' if tr.result else 'failed'
+        }
+    ]
+
+    if tr.target:
+        props.append({
+            'name': 'assessment-plan-task-target',
+            'ns': BLOSSOM_NS,
+            'value': tr.target
+        })
+
+    if tr.cache:
+        # Lets auditors tell a result carried forward from a previous run,
+        # collected at that run's time, from one collected in this run.
+        props.append({
+            'name': 'assessment-plan-task-cache',
+            'ns': BLOSSOM_NS,
+            'value': tr.cache
+        })
+
+    if tr.metrics:
+        props.extend(task_metrics_to_props(tr.metrics))
+
+    return {
+        'uuid': observation_uuid,
+        'methods': [method],
+        'title': task.title if task.title else f"OSCAL Assessment Workflow Observation {observation_uuid}",
+        'description': task.description if task.description else 'No description provided',
+        'props': props,
+        'relevant-evidence': [
+            {
+                'href': relevant_evidence_href,
+                'description': RELEVANT_EVIDENCE_DESCRIPTION
+            }
+        ],
+        'collected': tr.collected or current_timestamp
+    }
+
+def task_metrics_to_props(metrics: TaskMetrics) -> List[dict]:
+    """Generate the observation props recording how long a task check took
+    and what it used, times in seconds and memory in bytes.
+    """
+    values = {
+        'assessment-plan-task-wall-time': f"{metrics.wall_time:.6f}",
+        'assessment-plan-task-cpu-time': f"{metrics.cpu_time:.6f}" if metrics.cpu_time is not None else None,
+        'assessment-plan-task-max-rss': str(metrics.max_rss) if metrics.max_rss is not None else None,
+        'assessment-plan-task-exit-code': str(metrics.exit_code) if metrics.exit_code is not None else None
+    }
+    return [{'name': name, 'ns': BLOSSOM_NS, 'value': value} for name, value in values.items() if value is not None]
+
+def task_to_finding(task: ApTask, observation_uuid: str) -> dict:
+    """Generate the finding for a task whose observation failed, with a uuid
+    stable across runs for the same observation.
+    """
+    objectives_count = len(task.associated_control_objective_selections)
+    target_id = task.associated_control_objective_selections[0]
+
+    if objectives_count > 1:
+        logger.warn(f"Findings target one objective control selection, not multiple, selecting only {target_id}")
+
+    finding_uuid = stable_uuid(f"finding/{observation_uuid}")
+    return {
+        'uuid': finding_uuid,
+        'title': f"Finding from Observation {observation_uuid}",
+        'description': task.description,
+        'target': {
+            'type': 'objective-id',
+            'target-id': target_id,
+            'title': task.title,
+            'status': {
+                'state': 'not-satisfied',
+                'reason': 'failed'
+            }
+        },
+        'related-observations': [
+            {'observation-uuid': observation_uuid}
+        ]
+    }
+
+def task_result_to_observation_and_findings(tr: ApTaskResult, relevant_evidence_href: str, current_timestamp: str):
+    """Generate the observation for a single task result and, if the task
+    failed, its finding, without a round trip through the observation props.
+    """
+    observation = task_result_to_observation(tr, relevant_evidence_href, current_timestamp)
+    findings = []
+
+    if not tr.result:
+        try:
+            findings.append(task_to_finding(tr.task, observation['uuid']))
+
+        except Exception as err:
+            logger.error(f"Error in processing an observation, moving to next if found")
+            logger.exception(err)
+
+    return observation, findings
+
+def tasks_results_to_observations_and_findings(tasks_results: List[ApTaskResult], relevant_evidence_href: str, current_timestamp: str):
+    """Generate the observations and findings dictionaries to be inserted in
+    the Assessment Results template in a single pass over the task results.
+    """
+    raw_observations = {'observations': []}
+    raw_findings = {'findings': []}
+
+    for tr in tasks_results:
+        observation, findings = task_result_to_observation_and_findings(tr, relevant_evidence_href, current_timestamp)
+        raw_observations['observations'].append(observation)
+        raw_findings['findings'].extend(findings)
+
+    logger.debug(f"{len(raw_observations['observations'])} observation(s) and {len(raw_findings['findings'])} finding(s) processed")
+    return raw_observations, raw_findings
+
+def tasks_results_to_findings(tasks_results: Iterable[ApTaskResult]) -> Iterator[dict]:
+    """Generate the finding of each failed task result in turn, one at a
+    time rather than as a list.
+    """
+    for tr in tasks_results:
+        if tr.result:
+            continue
+        try:
+            yield task_to_finding(tr.task, task_result_observation_uuid(tr))
+
+        except Exception as err:
+            logger.error(f"Error in processing an observation, moving to next if found")
+            logger.exception(err)
+
+def non_empty(items: Iterable) -> Optional[Iterator]:
+    """Return an iterator over items, or None if there are none, without
+    generating more than the first of them.
+    """
+    items = iter(items)
+    for first in items:
+        return chain((first,), items)
+    return None
+
 def tasks_results_to_observations(tasks_results: List[ApTaskResult], relevant_evidence_href: str, current_timestamp: str) -> dict:
     """Cross reference an Assessment Plan's activities, its tasks, their
     results and generate a dictionary of observation to be inserted in the
     Assessment Results template.
     """
-    raw_data = {'observations': []}
-
-    for tr in tasks_results:
-        task = tr.task
-        method = task.associated_activity_props.get('method')
-        observation_uuid = str(uuid4())
-        raw_data['observations'].append({
-            'uuid': observation_uuid,
-            'methods': [method],
-            'title': task.title if task.title else f"OSCAL Assessment Workflow Observation {observation_uuid}",
-            'description': task.description if task.description else 'No description provided',
-            'props': [
-                {
-                    'name': 'assessment-plan-task-uuid',
-                    'ns': 'https://www.nist.gov/itl/csd/ssag/blossom',
-                    'value': task.uuid
-                },
-                {
-                    'name': 'assessment-plan-task-result',
-                    'ns': 'https://www.nist.gov/itl/csd/ssag/blossom',
-                    'value': 'success' if tr.result else 'failed'
-                }
-            ],
-            'relevant-evidence': [
-                {
-                    'href': relevant_evidence_href,
-                    'description': 'This observation is the result of automated testing in a run of a GitHub Actions workflow. For detailed information, please review the run status and detailed logging from its configuration, step inputs, and step outputs.'
-                }
-            ],
-            'collected': current_timestamp
-        })
+    raw_data = {'observations': [
+        task_result_to_observation(tr, relevant_evidence_href, current_timestamp)
+        for tr in tasks_results
+    ]}
 
     logger.debug(f"{len(raw_data.get('observations', {}))} observation(s) processed")
     return raw_data
@@ -195,10 +531,21 @@ def tasks_results_to_observations(tasks_results: List[ApTaskResult], relevant_ev
 def observations_to_findings(tasks_results: List[ApTaskResult], observations: List[dict]) -> dict:
     raw_data = {'findings': []}
 
+    # Index tasks once, the first task result for a uuid wins.
+    tasks_by_uuid = {}
+    for tr in tasks_results:
+        if tr.task:
+            tasks_by_uuid.setdefault(tr.task.uuid, tr.task)
+
     for o in observations:
         try:
-            task_uuid = [prop for prop in o.get('props') if prop.get('name') == 'assessment-plan-task-uuid' and prop.get('ns') == 'https://www.nist.gov/itl/csd/ssag/blossom'][0].get('value')
-            task_result = [prop for prop in o.get('props') if prop.get('name') == 'assessment-plan-task-result' and prop.get('ns') == 'https://www.nist.gov/itl/csd/ssag/blossom'][0].get('value')
+            props = {
+                prop.get('name'): prop.get('value')
+                for prop in reversed(o.get('props') or [])
+                if prop.get('ns') == BLOSSOM_NS
+            }
+            task_uuid = props.get('assessment-plan-task-uuid')
+            task_result = props.get('assessment-plan-task-result')
 
             if not task_uuid or not task_result:
                 logger.warn(f"Observation missed required assessment-plan-task-uuid and/or assesssment-plan-task-result props, skipping")
@@ -208,32 +555,7 @@ def observations_to_findings(tasks_results: List[ApTaskResult], observations: Li
                 logger.debug(f"Task result for {task_uuid} for observation did not return 'failed' result, skipping")
                 continue
 
-            task = [tr.task for tr in tasks_results if tr.task and tr.task.uuid == task_uuid][0]
-
-            objectives_count = len(task.associated_control_objective_selections)
-            target_id = task.associated_control_objective_selections[0]
-
-            if objectives_count > 1:
-                logger.warn(f"Findings target one objective control selection, not multiple, selecting only {target_id}")
-            
-            finding_uuid = str(uuid4())
-            raw_data['findings'].append({
-                'uuid': finding_uuid,
-                'title': f"Finding from Observation {o.get('uuid', 'ENOUUID')}",
-                'description': task.description,
-                'target': {
-                    'type': 'objective-id',
-                    'target-id': target_id,
-                    'title': task.title,
-                    'status': {
-                        'state': 'not-satisfied',
-                        'reason': 'failed'
-                    }
-                },
-                'related-observations': [
-                    {'observation-uuid': o.get('uuid', 'ENOUUID')}
-                ]
-            })
+            raw_data['findings'].append(task_to_finding(tasks_by_uuid[task_uuid], o.get('uuid', 'ENOUUID')))
 
         except Exception as err:
             logger.error(f"Error in processing an observation, moving to next if found")
@@ -242,6 +564,24 @@ def observations_to_findings(tasks_results: List[ApTaskResult], observations: Li
     logger.debug(f"{len(raw_data.get('findings', {}))} finding(s) processed from {len(observations)} observation(s).")
     return raw_data
 
+class ArResult(NamedTuple):
+    uuid: str
+    title: str
+    target: Optional[str]
+
+def ar_results(context: AssessmentWorkflowContext) -> List[ArResult]:
+    """List the results of the OSCAL Assessment Result, one per target, or
+    the single default result if there are no explicit targets.
+    """
+    if not context.targets:
+        return [ArResult(AR_RESULT_UUID, AR_RESULT_TITLE, None)]
+
+    return [
+        # Stable per target, so results can be compared across runs.
+        ArResult(stable_uuid(t.name), f"{AR_RESULT_TITLE} ({t.name})", t.name)
+        for t in context.targets
+    ]
+
 def create_ar(context: AssessmentWorkflowContext):
     """Generate an OSCAL Assessment Result YAML file based upon the result of
     automated assessment tests.
@@ -249,33 +589,138 @@ def create_ar(context: AssessmentWorkflowContext):
     try:
         current_timestamp = datetime.now(timezone.utc).isoformat()
         ap_reviewed_controls = extract_reviewed_controls(context.ap)
-        ar_observations = tasks_results_to_observations(context.tasks_results, context.relevant_evidence_href, current_timestamp)
-        ar_findings = observations_to_findings(context.tasks_results, ar_observations.get('observations', {}))
-
-        with open(context.ar_path, 'w') as fh:
-            template = context.ar_renderer.get_template(context.ar_template_file)
-            ar = template.render({
-                'ar_uuid': uuid4(),
-                'ar_metadata_title': 'OSCAL Workflow Automated Assessment Results',
-                'ar_metadata_last_modified_timestamp': current_timestamp,
-                'ar_import_ap_href': f"./{context.ap_path.name}",
-                'ap_reviewed_controls': ap_reviewed_controls,
-                'ar_results_start_timestamp': current_timestamp,
-                'ar_results_start_timestamp': current_timestamp,
-                'ar_observations': ar_observations,
-                # In OSCAL AR instances, we cannot have an empty findings: []
-                # so we must trigger the template to insert a findings var at
-                # at all for schema and constraint validation with oscal-cli.
-                'ar_findings': ar_findings if len(ar_findings.get('findings')) > 0 else None
+
+        results = []
+        for ar_result in ar_results(context):
+            tasks_results = [tr for tr in context.tasks_results if tr.target == ar_result.target] if context.targets else context.tasks_results
+            results.append({
+                'uuid': ar_result.uuid,
+                'title': ar_result.title,
+                # Observations and findings are only generated as the template
+                # writes them out, so they never all exist at once. In OSCAL
+                # AR instances, we cannot have an empty observations or
+                # findings: [] so we must trigger the template to not insert
+                # them at all for schema and constraint validation with oscal-cli.
+                'observations': non_empty(
+                    task_result_to_observation(tr, context.relevant_evidence_href, current_timestamp) for tr in tasks_results
+                ),
+                'findings': non_empty(tasks_results_to_findings(tasks_results))
             })
+
+        template = context.ar_renderer.get_template(context.ar_template_file)
+        ar_stream = template.stream({
+            'ar_uuid': uuid4(),
+            'ar_metadata_title': 'OSCAL Workflow Automated Assessment Results',
+            'ar_metadata_last_modified_timestamp': current_timestamp,
+            'ar_import_ap_href': f"./{context.ap_path.name}",
+            'ap_reviewed_controls': ap_reviewed_controls,
+            'ar_results_start_timestamp': current_timestamp,
+            'ar_results': results
+        })
+
+        # Rendered to a file next to the results and renamed over them once
+        # valid, so a template bug never leaves an invalid file.
+        ar_path = Path(context.ar_path)
+        with NamedTemporaryFile('w', dir=ar_path.parent, suffix=ar_path.suffix, delete=False) as fh:
             logger.debug(f"Writing rendered assessment result to {context.ar_path}")
-            fh.write(ar)
-            logger.info(f"Completed assessment per plan, wrote results to file")
+            ar_stream.dump(fh)
+        try:
+            if context.validate_results:
+                check_ar_valid(load_document(fh.name), context)
+            replace(fh.name, ar_path)
+        except BaseException:
+            unlink(fh.name)
+            raise
+        logger.info(f"Completed assessment per plan, wrote results to file")
 
     except Exception as err:
         logger.error(f"Rending assessment result with {context.ar_template_path} failed")
         raise err
 
+def check_ar_valid(ar: dict, context: AssessmentWorkflowContext):
+    """Validate an OSCAL Assessment Result against the OSCAL schema and raise
+    if it is not valid.
+    """
+    from validate import SchemaUnavailableError, validate_document
+
+    try:
+        errors = validate_document(ar, context.cache_dir, context.schema_dir)
+    except SchemaUnavailableError as err:
+        logger.error(str(err))
+        raise RuntimeError('Assessment result could not be validated') from None
+    for error in errors:
+        logger.error(f"Assessment result is not valid OSCAL: {error}")
+    if errors:
+        raise RuntimeError('Assessment result failed OSCAL schema validation')
+    logger.debug('Assessment result is valid OSCAL')
+
+def stream_ar(context: AssessmentWorkflowContext, results_cache: Optional[ResultCache] = None):
+    """Process the OSCAL Assessment Plan like process_ap, but write each
+    observation and finding to the OSCAL Assessment Result file as its task
+    completes instead of rendering the whole document from the template.
+    """
+    try:
+        current_timestamp = datetime.now(timezone.utc).isoformat()
+        ar_format = format_for_path(context.ar_path)
+
+        # Streamed to a file next to the results and renamed over them once
+        # complete and valid, so a crash or an invalid result never leaves a
+        # partial file at the published path.
+        ar_path = Path(context.ar_path)
+        fh = NamedTemporaryFile('w', dir=ar_path.parent, suffix=ar_path.suffix, delete=False)
+        try:
+            with fh:
+                writer = ArWriter(fh, ar_format)
+                writer.start(
+                    ar_uuid=uuid4(),
+                    ar_metadata_title='OSCAL Workflow Automated Assessment Results',
+                    ar_metadata_last_modified_timestamp=current_timestamp,
+                    ar_import_ap_href=f"./{context.ap_path.name}"
+                )
+
+                ap_reviewed_controls = extract_reviewed_controls(context.ap)
+                pending_results = ar_results(context)
+
+                def start_next_result():
+                    if writer.results_count:
+                        writer.finish_result()
+                    ar_result = pending_results.pop(0)
+                    writer.start_result(ap_reviewed_controls, current_timestamp, ar_result.uuid, ar_result.title)
+                    return ar_result.target
+
+                # Results arrive target by target, so every result can be written
+                # out in turn, including any target none of whose tasks completed.
+                current_target = start_next_result()
+
+                def write_task_result(tr: ApTaskResult):
+                    nonlocal current_target
+                    while tr.target != current_target:
+                        current_target = start_next_result()
+                    observation, findings = task_result_to_observation_and_findings(tr, context.relevant_evidence_href, current_timestamp)
+                    writer.add_observation(observation)
+                    for f in findings:
+                        writer.add_finding(f)
+
+                logger.debug(f"Streaming {ar_format} assessment result to {context.ar_path}")
+                process_ap(context, on_result=write_task_result, results_cache=results_cache)
+                while pending_results:
+                    start_next_result()
+                writer.finish_result()
+                writer.finish()
+
+            if context.validate_results:
+                # Streamed results only exist in full once written.
+                check_ar_valid(load_document(fh.name), context)
+            replace(fh.name, ar_path)
+        except BaseException:
+            unlink(fh.name)
+            raise
+        logger.info(f"Completed assessment per plan, wrote results to file")
+
+    except Exception as err:
+        logger.error(f"Streaming assessment result to {context.ar_path} failed")
+        raise err
+
 def handler():
     """Main entrypoint for assessment plan processing and assessment result generation.
     """
@@ -283,10 +728,25 @@ def handler():
         logger.info(f'OSCAL Assessment Workflow started')
         logger.debug('Building OSCAL Assessment Workflow context')
         context = create_context()
-        logger.debug('Processing assessment plan and executing automated tasks')
-        process_ap(context)
-        logger.debug('Generating assessment results from template and saving file')
-        create_ar(context)
+        run_start = perf_counter()
+        if context.stream_results:
+            logger.debug('Processing assessment plan, executing automated tasks and streaming results to file')
+            stream_ar(context)
+        else:
+            logger.debug('Processing assessment plan and executing automated tasks')
+            process_ap(context)
+            logger.debug('Generating assessment results from template and saving file')
+            create_ar(context)
+        run_wall_time = perf_counter() - run_start
+        if context.metrics_path:
+            write_metrics(context.metrics_path, context.tasks_results, run_wall_time)
+            logger.info(f"Wrote metrics for {len(context.tasks_results)} task result(s) to {context.metrics_path}")
+        if context.results_store_path:
+            from store import ResultStore, current_commit, results_from_tasks_results
+            commit_sha, ref = current_commit()
+            with ResultStore(context.results_store_path) as store:
+                run_id = store.append_run(results_from_tasks_results(context.tasks_results), run_wall_time, str(context.ap_path), commit_sha, ref)
+            logger.info(f"Stored results as run {run_id} in {context.results_store_path}")
         logger.info(f'OSCAL Assessment Workflow ended')
 
         if not all([tr.result for tr in context.tasks_results]):
@@ -298,6 +758,28 @@ def handler():
     except Exception as err:
         logger.error('Runtime error in handler, exception below')
         logger.exception(err)
+        # Fail the CI run, e.g. when the results fail schema validation.
+        return exit(1)
+
+def main(argv=None):
+    """Entrypoint of the run subcommand, the action's inputs are read from the
+    INPUT_* environment variables, some of which can be given as options.
+    """
+    parser = argparse.ArgumentParser(prog='cli.py run', description='Assess the system per the assessment plan and write the assessment results')
+    parser.add_argument('--plan', help='assessment plan path, INPUT_ASSESSMENT_PLAN_PATH if not given')
+    parser.add_argument('--results', help='assessment results path, INPUT_ASSESSMENT_RESULTS_PATH if not given')
+    parser.add_argument('--workers', type=int, help='tasks to run concurrently, INPUT_WORKERS if not given')
+    args = parser.parse_args(argv)
+
+    if args.plan:
+        environ['INPUT_ASSESSMENT_PLAN_PATH'] = args.plan
+    if args.results:
+        environ['INPUT_ASSESSMENT_RESULTS_PATH'] = args.results
+    if args.workers:
+        environ['INPUT_WORKERS'] = str(args.workers)
+    return handler()
 
 if __name__ == '__main__':
-    handler()
+    # Running this file is the same as cli.py, a run by default.
+    from cli import main as cli_main
+    exit(cli_main(argv[1:] or ['run']))
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+'''
+Benchmark extract_ap_tasks against synthetic assessment plans. Extraction
+indexes the plan once, so time per task should stay flat as plans grow.
+
+    python bench_content.py --tasks 1000 10000
+'''
+import argparse
+from time import perf_counter
+
+from content import extract_ap_tasks
+from synthetic import generate_ap, generate_ssp
+
+def bench_extract_ap_tasks(tasks: int, repeat: int = 3) -> float:
+    ap = generate_ap(tasks)
+    ssp = generate_ssp(tasks)
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        extracted = extract_ap_tasks(ap, ssp)
+        best = min(best, perf_counter() - start)
+
+    assert len(extracted) == tasks
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for tasks in args.tasks:
+        elapsed = bench_extract_ap_tasks(tasks, args.repeat)
+        print(f'extract_ap_tasks tasks={tasks:>7} total={elapsed:8.3f}s per_task={elapsed / tasks * 1e6:8.1f}us')
+
+if __name__ == '__main__':
+    main()
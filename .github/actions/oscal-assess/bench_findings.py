@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+'''
+Benchmark generating observations and findings from task results, both the
+single pass tasks_results_to_observations_and_findings and the compatible
+tasks_results_to_observations + observations_to_findings pair. Both should
+scale linearly with the number of results.
+
+    python bench_findings.py --results 1000 10000 100000
+'''
+import argparse
+from time import perf_counter
+
+from assess import ApTaskResult, observations_to_findings, tasks_results_to_observations, tasks_results_to_observations_and_findings
+from content import extract_ap_tasks
+from synthetic import generate_ap, generate_ssp, synthetic_uuid
+
+TIMESTAMP = '2022-12-01T00:00:00+00:00'
+
+def synthetic_tasks_results(results: int, failed_every: int = 2) -> list:
+    template = extract_ap_tasks(generate_ap(1), generate_ssp(1))[0]
+    return [
+        ApTaskResult(template._replace(uuid=synthetic_uuid('task', r)), r % failed_every != 0)
+        for r in range(results)
+    ]
+
+def bench_single_pass(tasks_results: list) -> float:
+    start = perf_counter()
+    tasks_results_to_observations_and_findings(tasks_results, 'file:///dev/null', TIMESTAMP)
+    return perf_counter() - start
+
+def bench_compatible_pair(tasks_results: list) -> float:
+    start = perf_counter()
+    observations = tasks_results_to_observations(tasks_results, 'file:///dev/null', TIMESTAMP)
+    observations_to_findings(tasks_results, observations['observations'])
+    return perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--results', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    for results in args.results:
+        tasks_results = synthetic_tasks_results(results)
+        for name, bench in (('single_pass', bench_single_pass), ('compatible_pair', bench_compatible_pair)):
+            elapsed = bench(tasks_results)
+            print(f'{name:<16} results={results:>7} total={elapsed:8.3f}s per_result={elapsed / results * 1e6:8.1f}us')
+
+if __name__ == '__main__':
+    main()
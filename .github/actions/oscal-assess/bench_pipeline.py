@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+'''
+End-to-end benchmark of the assessment pipeline against synthetic plans,
+timing each stage at each scale: load_yaml (parsing the plan without the
+document cache), extract_ap_tasks, process_ap with no-op checks,
+tasks_results_to_observations, observations_to_findings and create_ar.
+Each scale runs in a process of its own, and the peak RSS of that process
+after each stage is reported along with its time.
+
+With --history, every stage's time is appended to a JSON lines file and
+compared with the median of its previous runs at the same scale, and with
+--max-regression a stage that got slower by more than that fraction fails
+the benchmark.
+
+    python bench_pipeline.py --tasks 1000 10000 --params 3
+    python bench_pipeline.py --history ~/.cache/oscal-bench/history.jsonl --max-regression 0.5
+'''
+import argparse
+from datetime import datetime, timezone
+import json
+import multiprocessing
+from pathlib import Path
+import resource
+from statistics import median
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from yaml import safe_dump
+
+from assess import ASSESSMENT_RESULT_TEMPLATE, AssessmentWorkflowContext, create_ar, create_ar_renderer, load_yaml, observations_to_findings, process_ap, tasks_results_to_observations
+from checks import register_check_method
+from pyrunner import usage_from_rusage
+from content import extract_ap_tasks
+from synthetic import generate_ap, generate_ssp
+
+NOOP_CHECK_METHOD = 'benchmark-noop'
+TIMESTAMP = '2022-12-01T00:00:00+00:00'
+STAGES = ('load_yaml', 'extract_ap_tasks', 'process_ap', 'tasks_results_to_observations', 'observations_to_findings', 'create_ar')
+# Runs of a stage compared against, and the least change that counts, as
+# the fastest stages vary by more than their time between runs.
+BASELINE_RUNS = 5
+DEFAULT_MIN_SECONDS = 0.005
+
+@register_check_method(NOOP_CHECK_METHOD)
+def noop_check(task, options) -> bool:
+    '''A check that does nothing, so process_ap times only the pipeline.'''
+    return True
+
+class Scale(NamedTuple):
+    tasks: int
+    activities: int
+    resources: int
+    params: int
+
+class StageResult(NamedTuple):
+    stage: str
+    scale: Scale
+    seconds: float
+    # Peak RSS of the benchmark process by the end of the stage, in bytes.
+    max_rss: Optional[int] = None
+
+def best_of(repeat: int, stage: Callable[[], object]) -> Tuple[float, object]:
+    '''Returns the fastest of repeat calls of stage, and what it returned.'''
+    best, value = float('inf'), None
+    for _ in range(repeat):
+        start = perf_counter()
+        value = stage()
+        best = min(best, perf_counter() - start)
+    return best, value
+
+def peak_rss() -> int:
+    return usage_from_rusage(None, resource.getrusage(resource.RUSAGE_SELF)).max_rss
+
+def bench_pipeline(scale: Scale, repeat: int = 3) -> List[StageResult]:
+    '''
+    Returns the time of each stage at scale, and the peak RSS by its end,
+    which includes the stages before it and this process's own.
+    '''
+    ssp = generate_ssp(scale.activities, scale.params)
+    times: Dict[str, float] = {}
+    rss: Dict[str, int] = {}
+
+    def stage(name: str, call: Callable[[], object]):
+        times[name], value = best_of(repeat, call)
+        rss[name] = peak_rss()
+        return value
+
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        ap_path, ssp_path = tmp.joinpath('assessment-plan.yaml'), tmp.joinpath('ssp.yaml')
+        with open(ap_path, 'w') as fh:
+            safe_dump(generate_ap(scale.tasks, scale.activities, scale.resources, check_method=NOOP_CHECK_METHOD), fh, sort_keys=False)
+        with open(ssp_path, 'w') as fh:
+            safe_dump(ssp, fh, sort_keys=False)
+
+        ap = stage('load_yaml', lambda: load_yaml(ap_path))
+        tasks = stage('extract_ap_tasks', lambda: extract_ap_tasks(ap, ssp))
+        assert len(tasks) == scale.tasks
+
+        context = AssessmentWorkflowContext(
+            relevant_evidence_href='file:///dev/null',
+            ap=ap, ap_path=ap_path,
+            ar_path=tmp.joinpath('assessment-results.yaml'),
+            ar_template_path=Path(ASSESSMENT_RESULT_TEMPLATE), ar_template_file=Path(ASSESSMENT_RESULT_TEMPLATE).name,
+            ssp=ssp, ssp_path=ssp_path,
+            tasks_results=[],
+            ar_renderer=create_ar_renderer()
+        )
+
+        def run_tasks():
+            context.tasks_results.clear()
+            process_ap(context)
+
+        stage('process_ap', run_tasks)
+        # Half the tasks failing, for findings to be generated from.
+        context.tasks_results[:] = [tr._replace(result=idx % 2 == 0) for idx, tr in enumerate(context.tasks_results)]
+        tasks_results = context.tasks_results
+
+        observations = stage('tasks_results_to_observations', lambda: tasks_results_to_observations(tasks_results, context.relevant_evidence_href, TIMESTAMP))
+        stage('observations_to_findings', lambda: observations_to_findings(tasks_results, observations['observations']))
+        # Without the observations above, as create_ar does not need them.
+        del observations
+        stage('create_ar', lambda: create_ar(context))
+
+    return [StageResult(name, scale, times[name], rss[name]) for name in STAGES]
+
+def bench_pipeline_in_process(scale: Scale, repeat: int = 3) -> List[StageResult]:
+    '''
+    Returns bench_pipeline(scale, repeat) run in a new process, so that its
+    peak RSS is that of this scale alone.
+    '''
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        return pool.apply(bench_pipeline, (scale, repeat))
+
+def load_history(path: Path) -> List[dict]:
+    if not path.exists():
+        return []
+    with open(path) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+def append_history(path: Path, results: List[StageResult], commit_sha: Optional[str] = None):
+    '''Appends one JSON record per stage result to the history file at path.'''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    started = datetime.now(timezone.utc).isoformat()
+    with open(path, 'a') as fh:
+        for r in results:
+            fh.write(json.dumps({'started': started, 'commit': commit_sha, 'stage': r.stage, **r.scale._asdict(), 'seconds': r.seconds, 'max_rss': r.max_rss}) + '\n')
+
+def baselines(history: List[dict], runs: int = BASELINE_RUNS) -> Dict[Tuple[str, Scale], float]:
+    '''
+    Returns the median seconds of each stage and scale over its latest runs
+    in history.
+    '''
+    times: Dict[Tuple[str, Scale], List[float]] = {}
+    for record in history:
+        scale = Scale(*(record[field] for field in Scale._fields))
+        times.setdefault((record['stage'], scale), []).append(record['seconds'])
+    return {key: median(seconds[-runs:]) for key, seconds in times.items()}
+
+def regressions(results: List[StageResult], baseline: Dict[Tuple[str, Scale], float], max_regression: float,
+        min_seconds: float = DEFAULT_MIN_SECONDS) -> List[StageResult]:
+    '''
+    Returns the results that are more than max_regression, a fraction, and
+    at least min_seconds slower than their baseline.
+    '''
+    return [
+        r for r in results
+        if (r.stage, r.scale) in baseline
+        and r.seconds > baseline[r.stage, r.scale] * (1 + max_regression)
+        and r.seconds - baseline[r.stage, r.scale] >= min_seconds
+    ]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--activities', type=int, help='activities, one control each, one per 10 tasks if not given')
+    parser.add_argument('--resources', type=int, help='check scripts, one per task if not given')
+    parser.add_argument('--params', type=int, default=3, help='SSP set-parameters per control')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--history', help='JSON lines file to compare with and append this run to')
+    parser.add_argument('--max-regression', type=float, help='fail if a stage is slower than its baseline by more than this fraction')
+    parser.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS, help='ignore smaller changes than this')
+    args = parser.parse_args(argv)
+
+    history_path = Path(args.history).expanduser() if args.history else None
+    baseline = baselines(load_history(history_path)) if history_path else {}
+
+    results = []
+    for tasks in args.tasks:
+        scale = Scale(tasks, args.activities or max(1, tasks // 10), args.resources or tasks, args.params)
+        for r in bench_pipeline_in_process(scale, args.repeat):
+            results.append(r)
+            base = baseline.get((r.stage, r.scale))
+            change = f' baseline={base:8.3f}s ({(r.seconds - base) / base:+.0%})' if base else ''
+            print(f'{r.stage:<29} tasks={tasks:>7} total={r.seconds:8.3f}s per_task={r.seconds / tasks * 1e6:8.1f}us max_rss={r.max_rss / 2**20:7.1f}MiB{change}')
+
+    slower = regressions(results, baseline, args.max_regression, args.min_seconds) if args.max_regression is not None else []
+    if history_path:
+        from store import current_commit
+        append_history(history_path, results, current_commit()[0])
+
+    if slower:
+        print(f"Regression in {', '.join(f'{r.stage} at {r.scale.tasks} tasks' for r in slower)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+'''
+Benchmark profile resolution against a synthetic catalog the size of NIST SP
+800-53, cold (resolved and cached) and warm (unchanged inputs, read from the
+cache). The warm path should stay well under a second.
+
+    python bench_resolver.py --controls 1000 --enhancements 1
+'''
+import argparse
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from yaml import safe_dump
+
+from resolver import iter_controls, resolve_profile_file
+from synthetic import generate_catalog, generate_profile
+
+def bench_resolve(controls: int, enhancements: int, repeat: int = 3):
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        tmp.joinpath('catalog.yaml').write_text(safe_dump(generate_catalog(controls, enhancements), sort_keys=False))
+        tmp.joinpath('profile.yaml').write_text(safe_dump(generate_profile('catalog.yaml'), sort_keys=False))
+        cache_dir = tmp.joinpath('cache')
+
+        start = perf_counter()
+        resolved = resolve_profile_file(tmp.joinpath('profile.yaml'), cache_dir)
+        cold = perf_counter() - start
+
+        warm = float('inf')
+        for _ in range(repeat):
+            start = perf_counter()
+            resolve_profile_file(tmp.joinpath('profile.yaml'), cache_dir)
+            warm = min(warm, perf_counter() - start)
+
+    assert sum(1 for _ in iter_controls(resolved['catalog'])) == controls * (1 + enhancements)
+    return cold, warm
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--controls', type=int, nargs='+', default=[1000])
+    parser.add_argument('--enhancements', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for controls in args.controls:
+        cold, warm = bench_resolve(controls, args.enhancements, args.repeat)
+        print(f'resolve_profile_file controls={controls * (1 + args.enhancements):>6} cold={cold:8.3f}s warm={warm:8.3f}s')
+
+if __name__ == '__main__':
+    main()
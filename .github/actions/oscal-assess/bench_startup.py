@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+'''
+Benchmark the startup of the command line entry point: a fresh interpreter
+importing it and handling --help for each subcommand, which is all import
+cost, and the modules that take longest to import for a subcommand. With
+--max-ms, fails if the slowest subcommand's best time is over the budget.
+
+    python bench_startup.py --repeat 10 --max-ms 250
+'''
+import argparse
+from pathlib import Path
+from statistics import median
+import subprocess
+import sys
+from time import perf_counter
+from typing import List, Tuple
+
+from cli import SUBCOMMANDS
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+def bench_command(args: List[str], repeat: int) -> Tuple[float, float]:
+    '''Returns the best and median wall time of running python with args.'''
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run([sys.executable, *args], cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, check=True)
+        times.append(perf_counter() - start)
+    return min(times), median(times)
+
+def slowest_imports(args: List[str], top: int) -> List[Tuple[int, str]]:
+    '''
+    Returns the top modules by cumulative import time, in microseconds, of
+    running python with args, from -X importtime.
+    '''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args], cwd=SCRIPT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # only top-level imports, nested ones are part of their parent's time
+        if not module.startswith('  '):
+            imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subcommands', nargs='+', default=list(SUBCOMMANDS), choices=list(SUBCOMMANDS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='slowest imports to list for the run subcommand')
+    parser.add_argument('--max-ms', type=float, help='fail if any subcommand starts slower than this')
+    args = parser.parse_args()
+
+    baseline, _ = bench_command(['-c', 'pass'], args.repeat)
+    print(f'interpreter          best={baseline * 1000:7.1f}ms')
+    slowest = 0.0
+    for name in args.subcommands:
+        best, typical = bench_command(['cli.py', name, '--help'], args.repeat)
+        slowest = max(slowest, best)
+        print(f'cli.py {name:<13} best={best * 1000:7.1f}ms median={typical * 1000:7.1f}ms')
+
+    print('slowest imports of cli.py run:')
+    for cumulative, module in slowest_imports(['cli.py', 'run', '--help'], args.top):
+        print(f'  {cumulative / 1000:7.1f}ms {module}')
+
+    if args.max_ms is not None and slowest * 1000 > args.max_ms:
+        print(f'Startup of {slowest * 1000:.1f}ms is over the {args.max_ms:.0f}ms budget', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
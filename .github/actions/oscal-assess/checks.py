@@ -0,0 +1,321 @@
+'''
+Registry of ar-check-method implementations. A task's 'ar-check-method' prop
+names the method that decides whether it passes; new methods are added with
+the register_check_method decorator.
+
+Built in methods:
+
+system-shell-return-code
+    Run the task's resource and compare its return code to 'ar-check-result'.
+
+http-content
+    Fetch 'ar-check-url', select an element with the CSS selector in
+    'ar-check-selector' (or the XPath in 'ar-check-xpath', needs lxml) and
+    compare its text to the value of the SSP param named by 'ar-check-param'.
+    Whitespace is collapsed on both sides before comparing. Pages are fetched
+    through a shared keep-alive connection pool, following redirects, and
+    fresh for every check unless 'ar-check-cache' is 'true', in which case
+    checks with that prop share one fetch of a page per run. A relative
+    'ar-check-url' is resolved against the target's url.
+
+Checks run against a target deployment, passed to scripts in the environment
+as ASSESSMENT_TARGET_NAME and ASSESSMENT_TARGET_URL along with any variables
+the target overrides.
+'''
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+import logging
+from os import P_PID, WEXITED, WNOWAIT, environ, killpg, wait4, waitid, waitstatus_to_exitcode
+from pathlib import Path
+from signal import SIGKILL
+import subprocess
+from threading import Lock, Timer
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urljoin, urlsplit
+
+import yaml
+
+from content import ApTask, ssp_params_to_env
+from pyrunner import ProcessUsage, run_python_check, usage_from_rusage
+
+logger = logging.getLogger('oscal_assess')
+
+class Target(NamedTuple):
+    name: str
+    url: Optional[str] = None
+    # extra environment variables for checks run against this target
+    env: Dict[str, str] = {}
+
+def parse_targets(raw: str) -> List[Target]:
+    '''
+    Returns the targets in raw, a YAML (or JSON) list or the path of a file
+    with one. Each item is either a base url or a mapping with a url, an
+    optional name (defaults to the url) and optional env mapping.
+    '''
+    if not raw or not raw.strip():
+        return []
+    if Path(raw.strip()).is_file():
+        raw = Path(raw.strip()).read_text()
+
+    items = yaml.safe_load(raw) or []
+    if not isinstance(items, list):
+        raise ValueError('Targets must be a list of urls or of mappings with url, name and env')
+
+    targets = []
+    for idx, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'url': item}
+        url = item.get('url')
+        name = str(item.get('name') or url or f'target-{idx + 1}')
+        env = {str(k): str(v) for k, v in (item.get('env') or {}).items()}
+        targets.append(Target(name=name, url=url, env=env))
+
+    names = [t.name for t in targets]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Target names must be unique, got {names}")
+
+    return targets
+
+def target_env(target: Optional[Target]) -> Dict[str, str]:
+    '''
+    Returns the environment variables describing target to check scripts.
+    '''
+    if target is None:
+        return {}
+    env = {'ASSESSMENT_TARGET_NAME': target.name}
+    if target.url:
+        env['ASSESSMENT_TARGET_URL'] = target.url
+    env.update(target.env)
+    return env
+
+class CheckOptions(NamedTuple):
+    # seconds before a check is abandoned and fails, None for no limit
+    timeout: Optional[float] = None
+    # 'subprocess' or 'in-process', see pyrunner
+    python_runner: str = 'subprocess'
+    # deployment to check, None for the one implied by the check itself
+    target: Optional[Target] = None
+
+class CheckResult(NamedTuple):
+    passed: bool
+    # usage of the process the check ran, if it ran one
+    usage: Optional[ProcessUsage] = None
+
+# A check method returns either a plain bool or a CheckResult.
+CheckMethod = Callable[[ApTask, CheckOptions], Union[bool, CheckResult]]
+
+CHECK_METHODS: Dict[str, CheckMethod] = {}
+
+def register_check_method(name: str):
+    '''
+    Decorator registering a function (task, options) -> bool or CheckResult
+    as the implementation of the ar-check-method name.
+    '''
+    def register(method: CheckMethod) -> CheckMethod:
+        CHECK_METHODS[name] = method
+        return method
+    return register
+
+def get_check_method(name: str) -> Optional[CheckMethod]:
+    return CHECK_METHODS.get(name)
+
+def run_process(args, env: Dict[str, str], timeout: Optional[float] = None) -> ProcessUsage:
+    '''
+    Runs args and returns its exit code, None if it was killed after running
+    for timeout seconds, and its resource usage. The process is reaped with
+    wait4 rather than through subprocess so its own rusage is available.
+    It runs in a session of its own, and on timeout its whole process group
+    is killed, so children it started do not outlive it.
+    '''
+    process = subprocess.Popen(args, env=env, start_new_session=True)
+    lock = Lock()
+    exited = False
+    timed_out = False
+
+    def kill():
+        nonlocal timed_out
+        with lock:
+            # Once the process has exited its pid may be reused, and it is
+            # not timed out.
+            if exited:
+                return
+            timed_out = True
+            try:
+                killpg(process.pid, SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    timer = Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        # Wait for the exit without reaping, so the pid stays ours until
+        # the timer can no longer kill it.
+        waitid(P_PID, process.pid, WEXITED | WNOWAIT)
+        with lock:
+            exited = True
+        _, status, rusage = wait4(process.pid, 0)
+        process.returncode = waitstatus_to_exitcode(status)
+    finally:
+        if timer:
+            timer.cancel()
+
+    return usage_from_rusage(None if timed_out else process.returncode, rusage)
+
+@register_check_method('system-shell-return-code')
+def check_shell_return_code(task: ApTask, options: CheckOptions) -> CheckResult:
+    ar_check_result = int(task.props.get('ar-check-result'))
+    task_res_path = Path(task.resource.file)
+
+    if options.python_runner == 'in-process' and task_res_path.suffix == '.py':
+        usage = run_python_check(task_res_path, task.params, options.timeout, target_env(options.target))
+    else:
+        env = environ.copy()
+        env.update(target_env(options.target))
+        env.update(ssp_params_to_env(task.params))
+        usage = run_process(task_res_path, env, options.timeout)
+
+    if usage.exit_code is None:
+        logger.error(f"Task with uuid {task.uuid} did not complete within {options.timeout}s and was killed")
+        return CheckResult(False, usage)
+
+    return CheckResult(usage.exit_code == ar_check_result, usage)
+
+# Redirects followed before a fetch fails, and the statuses that are one.
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+class HttpPool:
+    '''
+    Minimal thread-safe HTTP client keeping idle keep-alive connections per
+    host for reuse, and the body of pages fetched with cache, so that many
+    checks against the same application share connections and downloads.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.idle: Dict[Tuple[str, str], List[HTTPConnection]] = {}
+        self.pages: Dict[str, bytes] = {}
+        self.page_locks: Dict[str, Lock] = {}
+
+    def connection(self, scheme: str, netloc: str, timeout: Optional[float]) -> Tuple[HTTPConnection, bool]:
+        with self.lock:
+            idle = self.idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        connection_class = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return connection_class(netloc, timeout=timeout), False
+
+    def release(self, scheme: str, netloc: str, connection: HTTPConnection):
+        with self.lock:
+            self.idle.setdefault((scheme, netloc), []).append(connection)
+
+    def fetch(self, url: str, timeout: Optional[float] = None) -> Tuple[int, Optional[str], bytes]:
+        '''Returns the status, Location header and body of a GET of url.'''
+        parts = urlsplit(url)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+        while True:
+            connection, reused = self.connection(parts.scheme, parts.netloc, timeout)
+            try:
+                connection.request('GET', target)
+                response = connection.getresponse()
+                body = response.read()
+            except (HTTPException, OSError):
+                connection.close()
+                # the server may have dropped an idle connection, retry once fresh
+                if reused:
+                    continue
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(parts.scheme, parts.netloc, connection)
+            return response.status, response.getheader('Location'), body
+
+    def request(self, url: str, timeout: Optional[float] = None) -> bytes:
+        '''
+        Returns the body of url, following up to MAX_REDIRECTS redirects.
+        Raises HTTPException for any other status that is not a success.
+        '''
+        for _ in range(MAX_REDIRECTS + 1):
+            status, location, body = self.fetch(url, timeout)
+            if status in REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            if status >= 300:
+                raise HTTPException(f"GET {url} returned HTTP {status}")
+            return body
+        raise HTTPException(f"GET {url} redirected more than {MAX_REDIRECTS} times")
+
+    def get(self, url: str, timeout: Optional[float] = None, cache: bool = False) -> bytes:
+        '''
+        Returns the body of url. With cache, it is fetched only the first time
+        it is asked for with cache, and concurrent requests for the same url
+        wait for a single fetch.
+        '''
+        if not cache:
+            return self.request(url, timeout)
+
+        with self.lock:
+            page_lock = self.page_locks.setdefault(url, Lock())
+
+        with page_lock:
+            if url not in self.pages:
+                self.pages[url] = self.request(url, timeout)
+            return self.pages[url]
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+            self.pages.clear()
+            self.page_locks.clear()
+
+http_pool = HttpPool()
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.split())
+
+def select_text(page: bytes, selector: Optional[str] = None, xpath: Optional[str] = None) -> Optional[str]:
+    '''
+    Returns the text of the first element of page matching the CSS selector
+    or XPath expression, None if nothing matches.
+    '''
+    if xpath:
+        try:
+            from lxml import html
+        except ImportError:
+            raise RuntimeError('ar-check-xpath requires lxml to be installed')
+        matches = html.fromstring(page).xpath(xpath)
+        if not matches:
+            return None
+        match = matches[0]
+        return match if isinstance(match, str) else match.text_content()
+
+    from bs4 import BeautifulSoup
+    match = BeautifulSoup(page, 'html.parser').select_one(selector)
+    return match.get_text() if match is not None else None
+
+@register_check_method('http-content')
+def check_http_content(task: ApTask, options: CheckOptions) -> bool:
+    url = task.props.get('ar-check-url')
+    selector = task.props.get('ar-check-selector')
+    xpath = task.props.get('ar-check-xpath')
+    param = task.props.get('ar-check-param')
+
+    if not url or not (selector or xpath) or not param:
+        raise ValueError('http-content checks need ar-check-url, ar-check-param and ar-check-selector or ar-check-xpath props')
+    if param not in task.params:
+        raise ValueError(f"SSP param '{param}' is not set for control {task.associated_control}")
+    if options.target and options.target.url:
+        url = urljoin(options.target.url, url)
+
+    cache = task.props.get('ar-check-cache', '').lower() == 'true'
+    actual = select_text(http_pool.get(url, options.timeout, cache), selector, xpath)
+    if actual is None:
+        logger.debug(f"Nothing in {url} matched {selector or xpath}")
+        return False
+
+    return normalize_text(actual) == normalize_text(task.params[param])
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+'''
+Command line entry point of the OSCAL assessment workflow. Each subcommand's
+module, and so its dependencies, is only imported when it runs, which keeps
+startup short for the commands that need little of it.
+
+    python cli.py run            # as the action does, configured by INPUT_* variables
+    python cli.py validate ../../../.oscal/*.yaml
+    python cli.py merge -o assessment-results.yaml shard-*.yaml
+    python cli.py diff --store results.sqlite
+'''
+from importlib import import_module
+import logging
+from os import getenv
+import sys
+
+# name: (module, function, summary), every function takes the remaining
+# arguments and returns the exit code.
+SUBCOMMANDS = {
+    'run': ('assess', 'main', 'assess the system per the assessment plan and write the assessment results'),
+    'validate': ('validate', 'main', 'validate OSCAL documents against the OSCAL JSON schemas'),
+    'merge': ('shard', 'main', 'merge the assessment results of shards of a run'),
+    'record': ('store', 'record_main', 'append the run of an assessment results document to a results store'),
+    'diff': ('store', 'diff_main', 'compare two runs in a results store'),
+    'watch': ('watch', 'main', 'assess again whenever the plan, SSP or a check script changes'),
+}
+
+def usage() -> str:
+    width = max(map(len, SUBCOMMANDS))
+    lines = ['usage: cli.py <subcommand> [options]', '', 'subcommands:']
+    lines.extend(f'  {name:<{width}}  {summary}' for name, (_, _, summary) in SUBCOMMANDS.items())
+    lines.extend(['', "Run 'cli.py <subcommand> --help' for the options of a subcommand."])
+    return '\n'.join(lines)
+
+def configure_logging():
+    logging.basicConfig()
+    level = logging.DEBUG if int(getenv('RUNNER_DEBUG', 0)) == 1 else logging.INFO
+    logging.getLogger('oscal_assess').setLevel(level)
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+    if argv[0] not in SUBCOMMANDS:
+        print(f"cli.py: unknown subcommand '{argv[0]}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    configure_logging()
+    module, function, _ = SUBCOMMANDS[argv[0]]
+    return getattr(import_module(module), function)(argv[1:]) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
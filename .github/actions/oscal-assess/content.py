@@ -1,17 +1,30 @@
 import jmespath
-from typing import Dict, NamedTuple, List
+from typing import Dict, NamedTuple, List, Optional, Tuple
 
 SET_PARAMS_PATH = (
     '"system-security-plan"."control-implementation"."implemented-requirements"[*]'
     '.{id: "control-id", params: "set-parameters"[*].{id: "param-id", values: "values"}}'
 )
 
+# Expressions are compiled once at import time and reused for every plan and
+# task, rather than being rebuilt (and re-parsed) from f-strings per lookup.
+SET_PARAMS_EXPR = jmespath.compile(SET_PARAMS_PATH)
+AP_RESOURCES_EXPR = jmespath.compile('"assessment-plan"."back-matter".resources')
+AP_ACTIVITIES_EXPR = jmespath.compile('"assessment-plan"."local-definitions"."activities"')
+AP_ACTION_TASKS_EXPR = jmespath.compile('"assessment-plan".tasks[?type==\'action\']')
+AP_REVIEWED_CONTROLS_EXPR = jmespath.compile('"assessment-plan"."reviewed-controls"')
+AP_IMPORT_SSP_EXPR = jmespath.compile('"assessment-plan"."import-ssp"."href"')
+TASK_COMMAND_HREF_EXPR = jmespath.compile("links[?rel=='command'].href")
+# The following are evaluated against a single activity from the index.
+ACTIVITY_CONTROL_EXPR = jmespath.compile('"related-controls"."control-selections"[*]."include-controls"[0]."control-id" | [0]')
+ACTIVITY_OBJECTIVES_EXPR = jmespath.compile('"related-controls"."control-objective-selections"[*]."include-objectives"[0]."objective-id"')
+
 def extract_ssp_params(input_ssp: dict) -> Dict[str, Dict[str, str]]:
     '''
     Returns a nested dict of control_id -> (param_id -> values)
     Note that the values are flattened and joined with a '; '
     '''
-    raw = jmespath.search(SET_PARAMS_PATH, input_ssp)
+    raw = SET_PARAMS_EXPR.search(input_ssp) or []
     return {
         impl_control['id']: {
             # 'values' is a list, for our purposes, just flatten it to a single string
@@ -19,6 +32,49 @@ def extract_ssp_params(input_ssp: dict) -> Dict[str, Dict[str, str]]:
         } for impl_control in raw
     }
 
+def ssp_params_to_env(params: Dict[str, str]) -> Dict[str, str]:
+    '''
+    Returns the environment variables a task's SSP params are passed in, as
+    SSP_PARAM_<PARAM_ID> with the param id upper cased and - replaced by _.
+    '''
+    return {
+        'SSP_PARAM_' + raw_param.upper().replace('-', '_'): value
+        for raw_param, value in params.items()
+    }
+
+class ApIndex(NamedTuple):
+    '''
+    Lookup tables over an assessment plan (and optionally its SSP), built in a
+    single pass so per-task extraction does not re-scan the whole document.
+    '''
+    # uuid -> back-matter resource
+    resources: Dict[str, List[dict]]
+    # uuid -> local-definitions activity
+    activities: Dict[str, dict]
+    # control_id -> (param_id -> values)
+    ssp_params: Dict[str, Dict[str, str]]
+
+def index_ap(input_ap: dict, input_ssp: Optional[dict] = None) -> ApIndex:
+    '''
+    Returns an ApIndex of the plan's resources and activities keyed by uuid,
+    and of the SSP set-parameters keyed by control id if an SSP is given.
+    Resources are kept as lists so duplicate uuids are still reported.
+    '''
+    resources = {}
+    for resource in AP_RESOURCES_EXPR.search(input_ap) or []:
+        resources.setdefault(resource.get('uuid'), []).append(resource)
+
+    activities = {}
+    for activity in AP_ACTIVITIES_EXPR.search(input_ap) or []:
+        # the first activity wins, as with the previous filter-and-take-first queries
+        activities.setdefault(activity.get('uuid'), activity)
+
+    return ApIndex(
+        resources=resources,
+        activities=activities,
+        ssp_params=extract_ssp_params(input_ssp) if input_ssp is not None else {}
+    )
+
 class ApTaskResource(NamedTuple):
     uuid: str
     title: str
@@ -26,11 +82,9 @@ class ApTaskResource(NamedTuple):
     file: str
     hash: str
 
-def extract_ap_resource(input_ap: dict, uuid: str) -> ApTaskResource:
-    # TODO: probably sanitize this in a real world scenario?
-    raw_resource = jmespath.search(f'''
-        "assessment-plan"."back-matter".resources[?uuid==\'{uuid}\']
-    ''', input_ap)
+def extract_ap_resource(input_ap: dict, uuid: str, index: Optional[ApIndex] = None) -> ApTaskResource:
+    index = index or index_ap(input_ap)
+    raw_resource = index.resources.get(uuid, [])
 
     if len(raw_resource) != 1:
         raise Exception(f'Resource with uuid "{uuid}" expected, but {len(raw_resource)} were found')
@@ -67,10 +121,12 @@ class ApTask(NamedTuple):
     # name -> value
     associated_activity_props: Dict[str, str]
     props: Dict[str, str]
+    # uuids of the tasks that must pass before this one runs
+    dependencies: Tuple[str, ...] = ()
 
 def extract_ap_task_link_uuid(input_ap_task: dict) -> str:
     # grab the resource link for the task
-        href = jmespath.search("links[?rel=='command'].href", input_ap_task)
+        href = TASK_COMMAND_HREF_EXPR.search(input_ap_task) or []
         if len(href) != 1:
             raise Exception('Task (uuid={}) should only have one command link, got {}'
                     .format(input_ap_task['uuid'], len(href)))
@@ -81,54 +137,77 @@ def extract_ap_task_link_uuid(input_ap_task: dict) -> str:
         return href[1:]
 
 def extract_reviewed_controls(input_ap: dict) -> dict:
-    return jmespath.search(f'"assessment-plan"."reviewed-controls"', input_ap)
-
-def extract_associated_control(input_ap: dict, uuid: str) -> str:
-    return jmespath.search(f'"assessment-plan"."local-definitions"."activities"[?uuid==\'{uuid}\']."related-controls"."control-selections"[*]."include-controls"[0]."control-id" | [] | [0]', input_ap)
-
-def extract_associated_control_objective_selections(input_ap: dict, uuid: str) -> List[str]:
-    return jmespath.search(f'"assessment-plan"."local-definitions"."activities"[?uuid==\'{uuid}\']."related-controls"."control-objective-selections"[*]."include-objectives"[0]."objective-id" | []', input_ap)
-
-def extracted_associated_activity_props(input_ap: dict, uuid: str) -> List[dict]:
-    return jmespath.search(f'"assessment-plan"."local-definitions"."activities"[?uuid==\'{uuid}\']."props" | []', input_ap)
-
-def extract_ap_tasks(input_ap: dict, input_ssp: dict) -> List[ApTask]:
-    raw_tasks = jmespath.search('"assessment-plan".tasks[?type==\'action\']', input_ap)
-
-    ssp_params = extract_ssp_params(input_ssp)
+    return AP_REVIEWED_CONTROLS_EXPR.search(input_ap)
+
+def extract_associated_control(input_ap: dict, uuid: str, index: Optional[ApIndex] = None) -> str:
+    index = index or index_ap(input_ap)
+    activity = index.activities.get(uuid)
+    return ACTIVITY_CONTROL_EXPR.search(activity) if activity else None
+
+def extract_associated_control_objective_selections(input_ap: dict, uuid: str, index: Optional[ApIndex] = None) -> List[str]:
+    index = index or index_ap(input_ap)
+    activity = index.activities.get(uuid)
+    return (ACTIVITY_OBJECTIVES_EXPR.search(activity) or []) if activity else []
+
+def extracted_associated_activity_props(input_ap: dict, uuid: str, index: Optional[ApIndex] = None) -> List[dict]:
+    index = index or index_ap(input_ap)
+    activity = index.activities.get(uuid)
+    return (activity.get('props') or []) if activity else []
+
+def extract_ap_tasks(input_ap: dict, input_ssp: dict, index: Optional[ApIndex] = None) -> List[ApTask]:
+    raw_tasks = AP_ACTION_TASKS_EXPR.search(input_ap) or []
+
+    # Index the plan and SSP once, every per-task lookup below is then O(1).
+    index = index or index_ap(input_ap, input_ssp)
+    ssp_params = index.ssp_params
+    no_params: Dict[str, str] = {}
+
+    # Tasks of the same resource or activity share what is extracted from it,
+    # as tasks with the same props share one dict, so for large plans only
+    # the ApTask itself is new per task. None of these are changed in place.
+    resources: Dict[str, ApTaskResource] = {}
+    activities: Dict[str, tuple] = {}
+    props_dicts: Dict[tuple, Dict[str, str]] = {}
 
     tasks = []
     for raw_task in raw_tasks:
         link_uuid = extract_ap_task_link_uuid(raw_task)
-        resource = extract_ap_resource(input_ap, link_uuid)
-
-        associated_control = extract_associated_control(input_ap, raw_task['associated-activities'][0]['activity-uuid'])
-        associated_control_objective_selections = extract_associated_control_objective_selections(input_ap, raw_task['associated-activities'][0]['activity-uuid'])
-        params = ssp_params.get(associated_control, {})
-
-        props = {
-            prop['name']: prop['value']
-            for prop in raw_task['props']
-        }
-
-        associated_activity_props = {
-            prop['name']: prop['value']
-            for prop in extracted_associated_activity_props(input_ap, raw_task['associated-activities'][0]['activity-uuid'])
-        }
+        resource = resources.get(link_uuid)
+        if resource is None:
+            resource = resources[link_uuid] = extract_ap_resource(input_ap, link_uuid, index)
+
+        activity_uuid = raw_task['associated-activities'][0]['activity-uuid']
+        activity = activities.get(activity_uuid)
+        if activity is None:
+            activity = activities[activity_uuid] = (
+                extract_associated_control(input_ap, activity_uuid, index),
+                extract_associated_control_objective_selections(input_ap, activity_uuid, index),
+                {
+                    prop['name']: prop['value']
+                    for prop in extracted_associated_activity_props(input_ap, activity_uuid, index)
+                }
+            )
+        associated_control, associated_control_objective_selections, associated_activity_props = activity
+
+        props_items = tuple((prop['name'], prop['value']) for prop in raw_task['props'])
+        props = props_dicts.get(props_items)
+        if props is None:
+            props = props_dicts[props_items] = dict(props_items)
 
         tasks.append(ApTask(
             uuid=raw_task['uuid'],
             title=raw_task['title'],
             description=raw_task['description'],
             resource=resource,
-            params=params,
+            params=ssp_params.get(associated_control, no_params),
             associated_control=associated_control,
             associated_control_objective_selections=associated_control_objective_selections,
             associated_activity_props=associated_activity_props,
-            props=props
+            props=props,
+            dependencies=tuple(d['task-uuid'] for d in raw_task.get('dependencies') or [])
         ))
 
     return tasks
 
 def extract_import_ssp(input_ap: dict) -> str:
-    return jmespath.search(f'"assessment-plan"."import-ssp"."href"', input_ap)
+    return AP_IMPORT_SSP_EXPR.search(input_ap)
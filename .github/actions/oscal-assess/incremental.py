@@ -0,0 +1,140 @@
+'''
+Result cache for incremental re-assessment. A task result is keyed on
+everything that can change its outcome: the task uuid and props, the content
+of its check script, the SSP parameters passed to it, the target it runs
+against and, optionally, a fingerprint of the target application. A task
+whose key is unchanged since a passing run is carried forward instead of run
+again.
+
+Only the script of a script-based check method is hashed. A task whose
+script cannot be read is run every time. Other check methods, such as
+http-content, read the target itself, which the key cannot capture, so their
+results are only carried forward with a target fingerprint.
+
+Failed results are never carried forward, a failing check is always re-run
+so a fix outside of the tracked inputs is picked up.
+
+Without a path the cache is only kept in memory, from one run to the next
+in the same process, as in watch mode.
+'''
+from hashlib import sha256
+import json
+import logging
+from os import replace
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import Dict, NamedTuple, Optional, Union
+
+from checks import Target
+from content import ApTask, ssp_params_to_env
+
+logger = logging.getLogger('oscal_assess')
+
+RESULTS_CACHE_FILE = 'results-cache.json'
+# Bump when the key derivation changes, to invalidate every older entry.
+RESULTS_CACHE_VERSION = 3
+# Check methods whose outcome follows from the task's script.
+SCRIPT_CHECK_METHODS = ('system-shell-return-code',)
+
+class CachedResult(NamedTuple):
+    result: bool
+    collected: str
+
+def file_sha256(path: Union[str, Path]) -> str:
+    digest = sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache:
+    '''
+    Task results from the previous run, loaded from and saved to a JSON file
+    if path is given. Only entries looked up or stored during this run are
+    saved, so entries for removed or changed tasks are dropped, and they are
+    the previous run's for the next run with the same cache. Safe to use from
+    worker threads.
+    '''
+    def __init__(self, path: Optional[Union[str, Path]], target_fingerprint: Optional[str] = None):
+        self.path = Path(path) if path else None
+        self.target_fingerprint = target_fingerprint
+        self.previous: Dict[str, dict] = {}
+        self.current: Dict[str, dict] = {}
+        self.script_hashes: Dict[str, Optional[str]] = {}
+        self.lock = Lock()
+
+        try:
+            if not self.path:
+                return
+            with open(self.path, 'r') as fh:
+                raw = json.load(fh)
+            if raw.get('version') == RESULTS_CACHE_VERSION:
+                self.previous = raw.get('results', {})
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.warning(f"Ignoring unreadable results cache {self.path}: {err}")
+
+    def script_hash(self, file: str) -> Optional[str]:
+        # Many tasks share a script, hash each one once per run.
+        if file not in self.script_hashes:
+            try:
+                self.script_hashes[file] = file_sha256(file)
+            except OSError as err:
+                logger.debug(f"Not carrying forward results of script {file}, it cannot be read: {err}")
+                self.script_hashes[file] = None
+        return self.script_hashes[file]
+
+    def key(self, task: ApTask, target: Optional[Target] = None) -> Optional[str]:
+        '''
+        Returns the cache key of task run against target, None if its result
+        cannot be carried forward.
+        '''
+        script = None
+        if task.props.get('ar-check-method') in SCRIPT_CHECK_METHODS:
+            script = self.script_hash(task.resource.file)
+            if script is None:
+                return None
+        elif not self.target_fingerprint:
+            return None
+
+        return sha256(json.dumps({
+            'task': task.uuid,
+            'props': task.props,
+            'script': script,
+            'params': ssp_params_to_env(task.params),
+            'target': target._asdict() if target else None,
+            'fingerprint': self.target_fingerprint
+        }, sort_keys=True).encode()).hexdigest()
+
+    def clear(self):
+        '''Forgets the previous run's results, so every task is run again.'''
+        with self.lock:
+            self.previous = {}
+            self.script_hashes = {}
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self.lock:
+            entry = self.previous.get(key)
+            if not entry or not entry.get('result'):
+                return None
+            self.current[key] = entry
+            return CachedResult(entry['result'], entry['collected'])
+
+    def put(self, key: str, result: bool, collected: str):
+        with self.lock:
+            if result:
+                self.current[key] = {'result': result, 'collected': collected}
+
+    def save(self):
+        with self.lock:
+            if self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with NamedTemporaryFile('w', dir=self.path.parent, delete=False) as fh:
+                    json.dump({'version': RESULTS_CACHE_VERSION, 'results': self.current}, fh)
+                replace(fh.name, self.path)
+                logger.debug(f"Saved {len(self.current)} carried forward result(s) to {self.path}")
+            # Scripts may have changed by the next run.
+            self.previous, self.current = self.current, {}
+            self.script_hashes = {}
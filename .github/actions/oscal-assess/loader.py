@@ -0,0 +1,116 @@
+'''
+Loading of OSCAL documents in YAML or JSON, with an optional on-disk cache of
+parsed documents keyed by the SHA-256 of their source, so unchanged content
+is not parsed again on the next run.
+
+Cache entries are pickles and are trusted on load, only point cache_dir at a
+directory this workflow alone writes to.
+'''
+from datetime import date, datetime
+from hashlib import sha256
+import json
+import logging
+from os import PathLike, replace
+from pathlib import Path
+import pickle
+import sys
+from tempfile import NamedTemporaryFile
+from typing import Optional, Union
+
+import yaml
+
+try:
+    # libyaml bindings are several times faster, but are optional in PyYAML
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+logger = logging.getLogger('oscal_assess')
+
+# Bump when the shape of parsed documents changes, to ignore older entries.
+CACHE_VERSION = 2
+# Strings up to this long, keys, uuids, prop names and values, repeat across
+# a plan's tasks and are interned, so every repeat is the same object.
+INTERN_MAX_LENGTH = 64
+
+class InterningSafeLoader(SafeLoader):
+    '''
+    SafeLoader that interns short strings. YAML parsers make a new string for
+    every scalar, which for large plans is most of the parsed document.
+    Cache entries keep the sharing, as pickle stores a shared object once.
+    '''
+
+def construct_interned_str(loader, node) -> str:
+    value = loader.construct_scalar(node)
+    return sys.intern(value) if len(value) <= INTERN_MAX_LENGTH else value
+
+InterningSafeLoader.add_constructor('tag:yaml.org,2002:str', construct_interned_str)
+
+def document_format(path: Union[str, bytes, Path, PathLike]) -> str:
+    '''
+    Returns 'json' for a .json file and 'yaml' for anything else.
+    '''
+    return 'json' if Path(path).suffix.lower() == '.json' else 'yaml'
+
+def parse_document(raw: bytes, doc_format: str):
+    if doc_format == 'json':
+        # The JSON decoder already reuses one string per distinct key.
+        return json.loads(raw)
+    return yaml.load(raw, Loader=InterningSafeLoader)
+
+def cache_entry_path(cache_dir: Union[str, Path], digest: str, doc_format: str) -> Path:
+    return Path(cache_dir).joinpath(f'{digest}.{doc_format}.v{CACHE_VERSION}.pickle')
+
+def load_document(path: Union[str, bytes, Path, PathLike], cache_dir: Optional[Union[str, Path]] = None):
+    '''
+    Returns the parsed OSCAL document at path. If cache_dir is given, the
+    parsed document is read from, or else written to, a cache entry there.
+    A cache that cannot be read or written is logged and otherwise ignored.
+    '''
+    doc_format = document_format(path)
+    with open(path, 'rb') as fh:
+        raw = fh.read()
+
+    if not cache_dir:
+        return parse_document(raw, doc_format)
+
+    entry_path = cache_entry_path(cache_dir, sha256(raw).hexdigest(), doc_format)
+    try:
+        with open(entry_path, 'rb') as fh:
+            document = pickle.load(fh)
+        logger.debug(f"Loaded {path} from cache entry {entry_path}")
+        return document
+
+    except FileNotFoundError:
+        pass
+
+    except Exception as err:
+        logger.warning(f"Ignoring unreadable cache entry {entry_path}: {err}")
+
+    document = parse_document(raw, doc_format)
+
+    try:
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so concurrent runs never see a partial entry.
+        with NamedTemporaryFile('wb', dir=entry_path.parent, delete=False) as fh:
+            pickle.dump(document, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(fh.name, entry_path)
+        logger.debug(f"Cached {path} as {entry_path}")
+
+    except Exception as err:
+        logger.warning(f"Cannot write cache entry {entry_path}: {err}")
+
+    return document
+
+def json_compatible(node):
+    '''
+    Returns node with the dates and timestamps YAML parses into objects
+    turned back into the strings JSON documents have.
+    '''
+    if isinstance(node, dict):
+        return {key: json_compatible(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [json_compatible(item) for item in node]
+    if isinstance(node, (datetime, date)):
+        return node.isoformat()
+    return node
@@ -0,0 +1,106 @@
+'''
+Per-task timing and resource usage of an assessment run, and its export as
+a metrics file for dashboards tracking assessment cost over time.
+
+A metrics file ending in .prom is written in the Prometheus text exposition
+format, for node_exporter's textfile collector or a push gateway. Any other
+file gets JSON lines, one record per task result and a final run record.
+'''
+import json
+from os import PathLike, replace
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import IO, Iterable, List, NamedTuple, Optional, Union
+
+PROMETHEUS_PREFIX = 'oscal_assess'
+
+class TaskMetrics(NamedTuple):
+    # seconds from the start to the end of the check, as seen by the runner
+    wall_time: float
+    # user plus system CPU seconds of the check
+    cpu_time: Optional[float] = None
+    # peak resident set size in bytes of the process the check ran, if any
+    max_rss: Optional[int] = None
+    # exit code of the process the check ran, if any and not killed
+    exit_code: Optional[int] = None
+
+class RunMetrics(NamedTuple):
+    wall_time: float
+    tasks: int
+    failed: int
+    carried_forward: int
+
+def metrics_format_for_path(path: Union[str, bytes, Path, PathLike]) -> str:
+    return 'prometheus' if Path(path).suffix.lower() == '.prom' else 'jsonl'
+
+def run_metrics(tasks_results: List, wall_time: float) -> RunMetrics:
+    return RunMetrics(
+        wall_time=wall_time,
+        tasks=len(tasks_results),
+        failed=sum(1 for tr in tasks_results if not tr.result),
+        carried_forward=sum(1 for tr in tasks_results if tr.cache == 'hit')
+    )
+
+def task_record(tr) -> dict:
+    metrics = tr.metrics or TaskMetrics(None)
+    return {
+        'type': 'task',
+        'task': tr.task.uuid,
+        'title': tr.task.title,
+        'control': tr.task.associated_control,
+        'target': tr.target,
+        'result': 'success' if tr.result else 'failed',
+        'cache': tr.cache,
+        **metrics._asdict()
+    }
+
+def write_jsonl(fh: IO[str], tasks_results: List, run: RunMetrics):
+    for tr in tasks_results:
+        fh.write(json.dumps(task_record(tr)) + '\n')
+    fh.write(json.dumps({'type': 'run', **run._asdict()}) + '\n')
+
+def prometheus_labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    pairs = [f'{name}="{escape(value)}"' for name, value in labels.items() if value is not None]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def write_prometheus(fh: IO[str], tasks_results: List, run: RunMetrics):
+    def family(name: str, help_text: str, samples: Iterable):
+        fh.write(f'# HELP {PROMETHEUS_PREFIX}_{name} {help_text}\n')
+        fh.write(f'# TYPE {PROMETHEUS_PREFIX}_{name} gauge\n')
+        for labels, value in samples:
+            if value is not None:
+                fh.write(f'{PROMETHEUS_PREFIX}_{name}{labels} {value}\n')
+
+    labelled = [
+        (prometheus_labels(task=tr.task.uuid, control=tr.task.associated_control, target=tr.target), tr)
+        for tr in tasks_results
+    ]
+    measured = [(labels, tr.metrics) for labels, tr in labelled if tr.metrics]
+
+    family('task_success', 'Whether the task passed (1) or failed (0).', ((l, int(bool(tr.result))) for l, tr in labelled))
+    family('task_wall_time_seconds', 'Wall clock time taken by the task check.', ((l, m.wall_time) for l, m in measured))
+    family('task_cpu_time_seconds', 'User plus system CPU time used by the task check.', ((l, m.cpu_time) for l, m in measured))
+    family('task_max_rss_bytes', 'Peak resident set size of the task check process.', ((l, m.max_rss) for l, m in measured))
+    family('task_exit_code', 'Exit code of the task check process.', ((l, m.exit_code) for l, m in measured))
+    family('run_wall_time_seconds', 'Wall clock time taken by the whole assessment run.', [('', run.wall_time)])
+    family('run_tasks', 'Task results in the assessment run.', [('', run.tasks)])
+    family('run_failed_tasks', 'Failed task results in the assessment run.', [('', run.failed)])
+    family('run_carried_forward_tasks', 'Task results carried forward from a previous run.', [('', run.carried_forward)])
+
+def write_metrics(path: Union[str, Path], tasks_results: List, wall_time: float) -> RunMetrics:
+    '''
+    Writes the metrics of a run's tasks_results to path, in the format its
+    suffix implies, and returns the run totals.
+    '''
+    path = Path(path)
+    run = run_metrics(tasks_results, wall_time)
+    writer = write_prometheus if metrics_format_for_path(path) == 'prometheus' else write_jsonl
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, a collector scraping the file never sees half a run.
+    with NamedTemporaryFile('w', dir=path.parent, delete=False) as fh:
+        writer(fh, tasks_results, run)
+    replace(fh.name, path)
+    return run
@@ -0,0 +1,118 @@
+'''
+Runner for Python check scripts that avoids starting a new interpreter per
+task. Checks are forked from a multiprocessing forkserver that has already
+imported the modules checks commonly use, so each run costs a fork instead of
+an interpreter start plus imports.
+
+A check runs as it would with `python check.py`: as __main__, with its
+directory on sys.path, and its exit code is the process exit code, so an
+uncaught exception (including a failed assert) is 1 and sys.exit(n) is n.
+'''
+import logging
+import multiprocessing
+from os import environ, killpg, path, setsid
+import resource
+import runpy
+from signal import SIGKILL
+import sys
+from threading import Lock
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from content import ssp_params_to_env
+
+logger = logging.getLogger('oscal_assess')
+
+# Imported once by the forkserver, a module that is not installed is skipped.
+DEFAULT_PRELOAD_MODULES = ('bs4', 'textwrap', 'urllib.request', 'html.parser', 'http.client', 'lxml.etree')
+
+class ProcessUsage(NamedTuple):
+    # None if the process was killed after timing out
+    exit_code: Optional[int]
+    # user plus system CPU seconds
+    cpu_time: Optional[float] = None
+    # peak resident set size in bytes
+    max_rss: Optional[int] = None
+
+def usage_from_rusage(exit_code: Optional[int], rusage) -> ProcessUsage:
+    # ru_maxrss is in KiB on Linux but in bytes on macOS
+    max_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return ProcessUsage(exit_code, rusage.ru_utime + rusage.ru_stime, max_rss)
+
+_context = None
+_context_lock = Lock()
+
+def get_context(preload_modules: Iterable[str] = DEFAULT_PRELOAD_MODULES):
+    '''
+    Returns the forkserver multiprocessing context, configured with the
+    modules to preload the first time it is requested.
+    '''
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = multiprocessing.get_context('forkserver')
+            # __main__ too, so forked checks do not each import it again
+            _context.set_forkserver_preload(['__main__', *preload_modules])
+        return _context
+
+def restart_forkserver():
+    '''
+    Stops the forkserver if it is running, so checks are forked from a new
+    one that imports the preloaded modules afresh, e.g. after they changed.
+    '''
+    from multiprocessing import forkserver
+    with _context_lock:
+        # No public API stops it, a new one starts on the next check.
+        forkserver._forkserver._stop()
+
+def exec_check(file: str, params: Dict[str, str], env: Dict[str, str], usage_conn=None):
+    '''
+    Entry point of the forked check process. Params are passed to the check
+    as the SSP_PARAMS global mapping, and for checks that read them from the
+    environment, as SSP_PARAM_* variables of this process only, as is env.
+    The process' own resource usage is sent back through usage_conn.
+    '''
+    # A process group of its own, for a timeout to kill its children too.
+    setsid()
+    environ.update(env)
+    environ.update(ssp_params_to_env(params))
+    sys.argv = [file]
+    sys.path.insert(0, path.dirname(path.abspath(file)))
+    try:
+        runpy.run_path(file, init_globals={'SSP_PARAMS': dict(params)}, run_name='__main__')
+    finally:
+        if usage_conn is not None:
+            usage_conn.send(resource.getrusage(resource.RUSAGE_SELF))
+            usage_conn.close()
+
+def run_python_check(file: str, params: Dict[str, str], timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None) -> ProcessUsage:
+    '''
+    Runs the Python check script at file in a forked worker and returns its
+    exit code, None if it was killed after running for timeout seconds, and
+    its resource usage if it reported it.
+    '''
+    context = get_context()
+    usage_recv, usage_send = context.Pipe(duplex=False)
+    process = context.Process(target=exec_check, args=(str(file), dict(params), dict(env or {}), usage_send), daemon=True)
+    process.start()
+    usage_send.close()
+    process.join(timeout)
+
+    if process.is_alive():
+        # Not reaped until joined, so the group is still the check's, unless
+        # it was killed before it made one.
+        try:
+            killpg(process.pid, SIGKILL)
+        except ProcessLookupError:
+            process.kill()
+        process.join()
+        usage_recv.close()
+        return ProcessUsage(None)
+
+    try:
+        rusage = usage_recv.recv() if usage_recv.poll() else None
+    except EOFError:
+        rusage = None
+    finally:
+        usage_recv.close()
+
+    return usage_from_rusage(process.exitcode, rusage) if rusage else ProcessUsage(process.exitcode)
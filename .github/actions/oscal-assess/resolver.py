@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+'''
+Resolution of an OSCAL profile into a resolved profile catalog, for profiles
+importing catalogs: include-all, include-controls and exclude-controls (with
+with-ids, matching patterns and with-child-controls), as-is and flat merges,
+and modify set-parameters and alters (removes and adds).
+
+Importing another profile and custom merges are not supported, and resolving
+such a profile raises a ValueError.
+
+The resolved catalog is cached under a key derived from the content of the
+profile and of every imported catalog, so an unchanged profile is only
+resolved again once one of its inputs changes.
+
+    python resolver.py ../../../.oscal/profile.yaml ../../../.oscal/resolved-catalog.yaml --cache-dir ~/.cache/oscal-assess
+'''
+import argparse
+from copy import deepcopy
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from hashlib import sha256
+import json
+import logging
+from os import replace
+from pathlib import Path
+import pickle
+import sys
+from tempfile import NamedTemporaryFile
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+from uuid import NAMESPACE_URL, uuid5
+
+from yaml import safe_dump
+
+from loader import document_format, load_document, parse_document
+
+logger = logging.getLogger('oscal_assess')
+
+# Bump when resolution output changes, to invalidate every cached catalog.
+RESOLVER_VERSION = 2
+RESOLUTION_TOOL = 'oscal-assess resolver.py'
+# Fields of a set-parameters entry that are added to, rather than replace,
+# those of the parameter it targets.
+SET_PARAM_APPENDED = ('props', 'links', 'constraints', 'guidelines')
+SET_PARAM_REPLACED = ('class', 'depends-on', 'label', 'usage', 'values', 'select')
+# Lists of a control an alter may remove items from, or add them to.
+ALTER_LISTS = ('params', 'props', 'links', 'parts')
+
+class ImportSource(NamedTuple):
+    href: str
+    # local file the source was read from
+    path: Path
+    sha256: str
+
+class ControlEntry(NamedTuple):
+    control: dict
+    # id of the parent control, None for a control directly in a group or the catalog
+    parent: Optional[str]
+    # ids of the groups the control is in, outermost first
+    groups: Tuple[str, ...]
+
+def profile_root(profile: dict) -> dict:
+    if 'profile' not in profile:
+        raise ValueError('Document is not an OSCAL profile')
+    return profile['profile']
+
+def iter_controls(node: dict, parent: Optional[str] = None, groups: Tuple[str, ...] = ()) -> Iterator[ControlEntry]:
+    '''
+    Yields every control of a catalog or group in document order, each before
+    its child controls.
+    '''
+    for control in node.get('controls', []):
+        yield ControlEntry(control, parent, groups)
+        yield from iter_controls(control, control['id'], groups)
+    for group in node.get('groups', []):
+        yield from iter_controls(group, None, groups + (group.get('id', ''),))
+
+def matches_selection(control_id: str, selections: Iterable[dict]) -> Optional[str]:
+    '''
+    Returns the with-child-controls value ('yes' or 'no') of the first of
+    selections control_id is selected by, None if none select it.
+    '''
+    for selection in selections:
+        ids = selection.get('with-ids', [])
+        patterns = [m.get('pattern', '') for m in selection.get('matching', [])]
+        if control_id in ids or any(fnmatchcase(control_id, p) for p in patterns):
+            return selection.get('with-child-controls', 'no')
+    return None
+
+def select_controls(catalog: dict, import_: dict) -> List[str]:
+    '''
+    Returns the ids of the controls of catalog an import selects, in catalog
+    order.
+    '''
+    entries = list(iter_controls(catalog['catalog']))
+    children: Dict[str, List[str]] = {}
+    for entry in entries:
+        if entry.parent:
+            children.setdefault(entry.parent, []).append(entry.control['id'])
+
+    def with_descendants(control_id: str) -> Iterator[str]:
+        for child in children.get(control_id, []):
+            yield child
+            yield from with_descendants(child)
+
+    def selected_by(selections: List[dict]) -> set:
+        selected = set()
+        for entry in entries:
+            with_children = matches_selection(entry.control['id'], selections)
+            if with_children is None:
+                continue
+            selected.add(entry.control['id'])
+            if with_children == 'yes':
+                selected.update(with_descendants(entry.control['id']))
+        return selected
+
+    if 'include-all' in import_:
+        included = {entry.control['id'] for entry in entries}
+    else:
+        included = selected_by(import_.get('include-controls', []))
+    included -= selected_by(import_.get('exclude-controls', []))
+
+    return [entry.control['id'] for entry in entries if entry.control['id'] in included]
+
+def strip_child_controls(control: dict) -> dict:
+    control = dict(control)
+    control.pop('controls', None)
+    return control
+
+def merge_as_is(node: dict, included: set) -> dict:
+    '''
+    Returns a copy of node (a catalog or a group) keeping the included controls
+    in their original structure. A control that is not included is dropped and
+    its included children take its place, a group left with no controls is
+    dropped.
+    '''
+    def prune_controls(controls: List[dict]) -> List[dict]:
+        pruned = []
+        for control in controls:
+            kept_children = prune_controls(control.get('controls', []))
+            if control['id'] in included:
+                control = strip_child_controls(control)
+                if kept_children:
+                    control['controls'] = kept_children
+                pruned.append(control)
+            else:
+                pruned.extend(kept_children)
+        return pruned
+
+    result = {k: v for k, v in node.items() if k not in ('controls', 'groups')}
+    controls = prune_controls(node.get('controls', []))
+    groups = [g for g in (merge_as_is(group, included) for group in node.get('groups', [])) if g.get('controls') or g.get('groups')]
+    if controls:
+        result['controls'] = controls
+    if groups:
+        result['groups'] = groups
+    return result
+
+def merge_flat(catalog: dict, included: set) -> dict:
+    return {'controls': [strip_child_controls(e.control) for e in iter_controls(catalog) if e.control['id'] in included]}
+
+def iter_params(node: dict) -> Iterator[dict]:
+    yield from node.get('params', [])
+    for key in ('controls', 'groups'):
+        for child in node.get(key, []):
+            yield from iter_params(child)
+
+def set_parameters(node: dict, settings: List[dict]):
+    '''
+    Applies profile set-parameters to the params of node and its descendants.
+    '''
+    params: Dict[str, dict] = {param['id']: param for param in iter_params(node)}
+    for setting in settings:
+        param = params.get(setting['param-id'])
+        if param is None:
+            logger.warning(f"set-parameters targets param {setting['param-id']} which is not in the resolved catalog")
+            continue
+        for key in SET_PARAM_REPLACED:
+            if key in setting:
+                param[key] = deepcopy(setting[key])
+        for key in SET_PARAM_APPENDED:
+            if key in setting:
+                param.setdefault(key, []).extend(deepcopy(setting[key]))
+        if 'values' in setting:
+            param.pop('select', None)
+        if 'select' in setting:
+            param.pop('values', None)
+
+def removal_matches(item: dict, remove: dict) -> bool:
+    checks = {
+        'by-name': item.get('name'),
+        'by-class': item.get('class'),
+        'by-id': item.get('id'),
+        'by-ns': item.get('ns'),
+        # links have no name, but are matched on rel like other items on name
+        'by-item-name': item.get('name', item.get('rel')),
+    }
+    criteria = [key for key in checks if key in remove]
+    return bool(criteria) and all(checks[key] == remove[key] for key in criteria)
+
+def apply_removes(node: dict, remove: dict):
+    for key in ALTER_LISTS:
+        if key not in node:
+            continue
+        kept = [item for item in node[key] if not (isinstance(item, dict) and removal_matches(item, remove))]
+        node[key] = kept
+        if not kept:
+            del node[key]
+    for part in node.get('parts', []):
+        apply_removes(part, remove)
+
+def find_by_id(node: dict, item_id: str) -> Optional[Tuple[dict, str, int]]:
+    '''
+    Returns the (container, list name, index) of the part, param, prop or
+    link with id item_id under node, None if there is none.
+    '''
+    for key in ALTER_LISTS:
+        for idx, item in enumerate(node.get(key, [])):
+            if isinstance(item, dict) and item.get('id') == item_id:
+                return node, key, idx
+    for part in node.get('parts', []):
+        found = find_by_id(part, item_id)
+        if found:
+            return found
+    return None
+
+def apply_adds(control: dict, add: dict):
+    position = add.get('position', 'ending')
+    target = control
+    if add.get('by-id'):
+        found = find_by_id(control, add['by-id'])
+        if not found:
+            logger.warning(f"alter of control {control['id']} adds by-id {add['by-id']} which does not exist")
+            return
+        container, key, idx = found
+        if position in ('before', 'after'):
+            items = deepcopy(add.get(key, []))
+            container[key][idx + (position == 'after'):idx + (position == 'after')] = items
+            return
+        target = container[key][idx]
+    elif position in ('before', 'after'):
+        raise ValueError(f"alter of control {control['id']} adds {position} without a by-id")
+
+    if 'title' in add:
+        target['title'] = add['title']
+    for key in ALTER_LISTS:
+        if key in add:
+            items = deepcopy(add[key])
+            existing = target.setdefault(key, [])
+            target[key] = items + existing if position == 'starting' else existing + items
+
+def apply_alters(node: dict, alters: List[dict]):
+    controls = {entry.control['id']: entry.control for entry in iter_controls(node)}
+    for alter in alters:
+        control = controls.get(alter['control-id'])
+        if control is None:
+            logger.warning(f"alter targets control {alter['control-id']} which is not in the resolved catalog")
+            continue
+        for remove in alter.get('removes', []):
+            apply_removes(control, remove)
+        for add in alter.get('adds', []):
+            apply_adds(control, add)
+
+def referenced_resources(node) -> Iterator[str]:
+    '''
+    Yields the uuid of every back-matter resource that a link of node, or of
+    anything under it, refers to as #uuid.
+    '''
+    if isinstance(node, dict):
+        for link in node.get('links', []):
+            if isinstance(link, dict) and link.get('href', '').startswith('#'):
+                yield link['href'][1:]
+        for value in node.values():
+            yield from referenced_resources(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from referenced_resources(item)
+
+def merge_back_matter(catalogs: List[dict], referenced: set) -> Optional[dict]:
+    '''
+    Returns the back-matter of the resources of catalogs whose uuid is in
+    referenced, the first of those with the same uuid.
+    '''
+    resources = {}
+    for catalog in catalogs:
+        for resource in catalog['catalog'].get('back-matter', {}).get('resources', []):
+            if resource['uuid'] in referenced:
+                resources.setdefault(resource['uuid'], resource)
+    return {'resources': list(resources.values())} if resources else None
+
+def resolve_profile(profile: dict, catalogs: List[dict], key: str = '', source_profile_href: str = './profile.yaml') -> dict:
+    '''
+    Returns the resolved profile catalog of profile, given the catalog each of
+    its imports refers to, in import order. Controls imported more than once
+    are kept the first time. key seeds the uuid of the resolved catalog, so
+    resolving the same inputs gives the same uuid.
+    '''
+    root = profile_root(profile)
+    imports = root.get('imports', [])
+    if len(imports) != len(catalogs):
+        raise ValueError(f"Profile has {len(imports)} import(s) but {len(catalogs)} catalog(s) were given")
+
+    merge = root.get('merge', {})
+    if 'custom' in merge:
+        raise ValueError('Custom merges are not supported')
+
+    resolved: dict = {}
+    seen = set()
+    for import_, catalog in zip(imports, catalogs):
+        if 'catalog' not in catalog:
+            raise ValueError(f"Import {import_['href']} is not a catalog, importing profiles is not supported")
+        selected = set(select_controls(catalog, import_))
+        included, duplicates = selected - seen, selected & seen
+        if duplicates:
+            logger.warning(f"Controls {sorted(duplicates)} are imported more than once, keeping the first")
+        seen |= included
+
+        if merge.get('as-is'):
+            merged = merge_as_is(catalog['catalog'], included)
+            for key_ in ('uuid', 'metadata', 'back-matter'):
+                merged.pop(key_, None)
+        else:
+            merged = merge_flat(catalog['catalog'], included)
+        # Copy only what is kept, so large catalogs are not copied whole, and
+        # through pickle, which is several times faster than deepcopy.
+        merged = pickle.loads(pickle.dumps(merged, protocol=pickle.HIGHEST_PROTOCOL))
+
+        for list_key in ('params', 'controls', 'groups'):
+            if list_key in merged:
+                resolved.setdefault(list_key, []).extend(merged[list_key])
+
+    modify = root.get('modify', {})
+    set_parameters(resolved, modify.get('set-parameters', []))
+    apply_alters(resolved, modify.get('alters', []))
+
+    metadata = deepcopy(root['metadata'])
+    metadata['last-modified'] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    metadata['props'] = [p for p in metadata.get('props', []) if p.get('name') != 'resolution-tool'] + [
+        {'name': 'resolution-tool', 'value': RESOLUTION_TOOL}
+    ]
+    metadata['links'] = [l for l in metadata.get('links', []) if l.get('rel') != 'source-profile'] + [
+        {'href': source_profile_href, 'rel': 'source-profile'}
+    ]
+
+    catalog = {'uuid': str(uuid5(NAMESPACE_URL, f'{root["uuid"]}/resolved/{key}')), 'metadata': metadata}
+    catalog.update(resolved)
+    # Only the resources the kept controls refer to, as oscal-cli does.
+    back_matter = merge_back_matter(catalogs, set(referenced_resources(resolved)))
+    if back_matter:
+        catalog['back-matter'] = back_matter
+    return {'catalog': catalog}
+
+def resolve_href(href: str, profile: dict) -> str:
+    '''
+    Returns the href an import points to, following an internal #uuid
+    reference to the first rlink of a back-matter resource of the profile.
+    '''
+    if not href.startswith('#'):
+        return href
+    for resource in profile_root(profile).get('back-matter', {}).get('resources', []):
+        if resource.get('uuid') == href[1:] and resource.get('rlinks'):
+            return resource['rlinks'][0]['href']
+    raise ValueError(f"Import {href} does not match a back-matter resource with an rlink")
+
+def fetch_source(href: str, profile_dir: Path, cache_dir: Optional[Path], sources: Dict[str, str]) -> Tuple[Path, bytes]:
+    '''
+    Returns the local path and the content of the catalog at href. A remote
+    catalog is downloaded once into cache_dir, so it is only fetched again
+    with an empty cache. sources maps hrefs to local files to use instead.
+    '''
+    if href in sources:
+        path = Path(sources[href])
+        return path, path.read_bytes()
+
+    if urlsplit(href).scheme not in ('http', 'https'):
+        path = profile_dir.joinpath(href)
+        return path, path.read_bytes()
+
+    if cache_dir:
+        path = Path(cache_dir).joinpath('sources', sha256(href.encode()).hexdigest() + Path(urlsplit(href).path).suffix)
+        if path.exists():
+            return path, path.read_bytes()
+
+    logger.info(f"Downloading {href}")
+    with urlopen(href, timeout=60) as response:
+        raw = response.read()
+
+    if not cache_dir:
+        # Named after the url only for its suffix, it is parsed from memory.
+        return Path(urlsplit(href).path), raw
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile('wb', dir=path.parent, delete=False) as fh:
+        fh.write(raw)
+    replace(fh.name, path)
+    return path, raw
+
+def resolution_key(profile_raw: bytes, sources: List[ImportSource]) -> str:
+    digest = sha256(f'v{RESOLVER_VERSION}\n'.encode())
+    digest.update(sha256(profile_raw).hexdigest().encode())
+    for source in sources:
+        digest.update(f'\n{source.href}\n{source.sha256}'.encode())
+    return digest.hexdigest()
+
+def resolve_profile_file(profile_path: Union[str, Path], cache_dir: Optional[Union[str, Path]] = None,
+        sources: Optional[Dict[str, str]] = None, source_profile_href: Optional[str] = None) -> dict:
+    '''
+    Returns the resolved profile catalog of the profile at profile_path. With
+    a cache_dir, it is read from there if neither the profile nor any catalog
+    it imports has changed since it was last resolved, and written there
+    otherwise, along with parsed catalogs and downloaded remote catalogs.
+    '''
+    profile_path = Path(profile_path)
+    cache_dir = Path(cache_dir) if cache_dir else None
+    profile_raw = profile_path.read_bytes()
+    profile = parse_document(profile_raw, document_format(profile_path))
+
+    fetched = []
+    for import_ in profile_root(profile).get('imports', []):
+        href = resolve_href(import_['href'], profile)
+        path, raw = fetch_source(href, profile_path.parent, cache_dir, sources or {})
+        fetched.append((ImportSource(href, path, sha256(raw).hexdigest()), raw))
+
+    key = resolution_key(profile_raw, [source for source, _ in fetched])
+    entry_path = cache_dir.joinpath(f'resolved-{key}.pickle') if cache_dir else None
+
+    if entry_path:
+        try:
+            with open(entry_path, 'rb') as fh:
+                resolved = pickle.load(fh)
+            logger.debug(f"Profile {profile_path} is unchanged, loaded resolved catalog from {entry_path}")
+            return resolved
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.warning(f"Ignoring unreadable cache entry {entry_path}: {err}")
+
+    catalogs = [
+        load_document(source.path, cache_dir) if cache_dir and source.path.exists() else parse_document(raw, document_format(source.path))
+        for source, raw in fetched
+    ]
+    resolved = resolve_profile(profile, catalogs, key, source_profile_href or f'./{profile_path.name}')
+
+    if entry_path:
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile('wb', dir=entry_path.parent, delete=False) as fh:
+                pickle.dump(resolved, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            replace(fh.name, entry_path)
+        except Exception as err:
+            logger.warning(f"Cannot write cache entry {entry_path}: {err}")
+
+    return resolved
+
+def without_metadata(catalog: dict) -> dict:
+    return {k: v for k, v in catalog['catalog'].items() if k not in ('uuid', 'metadata')}
+
+def dump_catalog(catalog: dict, path: Union[str, Path]) -> str:
+    if document_format(path) == 'json':
+        return json.dumps(catalog, indent=2) + '\n'
+    return '---\n' + safe_dump(catalog, sort_keys=False, default_flow_style=False, allow_unicode=True, width=1 << 16)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('profile', help='OSCAL profile to resolve')
+    parser.add_argument('output', help='resolved catalog to write, or to check with --check')
+    parser.add_argument('--cache-dir', help='directory to cache resolved catalogs, parsed and downloaded catalogs in')
+    parser.add_argument('--source', action='append', default=[], metavar='HREF=PATH',
+        help='use the local catalog at PATH for imports of HREF, may be repeated')
+    parser.add_argument('--check', action='store_true',
+        help='only check that output is up to date with the profile, ignoring metadata, and exit 1 if not')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    logger.setLevel(logging.INFO)
+
+    sources = dict(source.split('=', 1) for source in args.source)
+    cache_dir = Path(args.cache_dir).expanduser() if args.cache_dir else None
+    resolved = resolve_profile_file(args.profile, cache_dir, sources)
+
+    output = Path(args.output)
+    current = load_document(output) if output.exists() else None
+    up_to_date = current is not None and without_metadata(current) == without_metadata(resolved)
+
+    if args.check:
+        if not up_to_date:
+            logger.error(f"{output} is out of date with {args.profile}, resolve it again with resolver.py")
+            return 1
+        logger.info(f"{output} is up to date with {args.profile}")
+        return 0
+
+    # Keep the previous file, and its last-modified, when nothing changed.
+    if up_to_date:
+        logger.info(f"{output} is already up to date with {args.profile}")
+        return 0
+
+    output.write_text(dump_catalog(resolved, output))
+    logger.info(f"Wrote resolved catalog for {args.profile} to {output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
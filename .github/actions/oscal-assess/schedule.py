@@ -0,0 +1,215 @@
+'''
+Scheduling of a plan's tasks: a dependency graph from the plan, run in
+order of priority so that the checks most likely to fail run first.
+
+A task needs to have passed before another one runs if the latter lists it
+in its OSCAL dependencies or its depends-on prop (task uuids separated by
+spaces or commas). Shared setup is a task with a provides-fixture prop, e.g.
+'app-running' for a check that waits for the application to be up, which
+tasks with the same name in their requires-fixture prop depend on. It is run
+once per target and never carried forward from a previous run. A task whose
+prerequisite did not pass is not run and fails.
+
+Tasks are prioritized by their likelihood to fail per second they take, from
+the history of previous runs in a results store, so failures surface as
+early as possible. With no history, tasks run in plan order.
+'''
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from heapq import heapify, heappop, heappush
+import logging
+from statistics import median
+from typing import Callable, Dict, FrozenSet, List, Mapping, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+from content import ApTask
+
+logger = logging.getLogger('oscal_assess')
+
+# Checks are assumed to take at least this long, in seconds.
+MIN_DURATION = 0.001
+DEFAULT_DURATION = 1.0
+
+R = TypeVar('R')
+
+class TaskGraph(NamedTuple):
+    # Indexes of the tasks that must pass before each task runs.
+    prerequisites: List[Tuple[int, ...]]
+    # Indexes of the tasks that set up a fixture.
+    fixtures: FrozenSet[int]
+    # Task indexes, every task after its prerequisites.
+    order: List[int]
+
+class TaskHistory(NamedTuple):
+    runs: int
+    failures: int
+    # Mean seconds the task's check took, None if never recorded.
+    wall_time: Optional[float] = None
+
+def prop_names(value: Optional[str]) -> List[str]:
+    return value.replace(',', ' ').split() if value else []
+
+def build_task_graph(tasks: Sequence[ApTask]) -> TaskGraph:
+    '''
+    Returns the dependency graph of tasks. Raises ValueError for a dependency
+    on a task that is not among them, a fixture no task provides or a cycle.
+    '''
+    index = {t.uuid: idx for idx, t in enumerate(tasks)}
+    providers: Dict[str, List[int]] = {}
+    for idx, t in enumerate(tasks):
+        for name in prop_names(t.props.get('provides-fixture')):
+            providers.setdefault(name, []).append(idx)
+
+    prerequisites = []
+    for idx, t in enumerate(tasks):
+        needed = set()
+        for uuid in (*t.dependencies, *prop_names(t.props.get('depends-on'))):
+            if uuid not in index:
+                raise ValueError(f"Task {t.uuid} depends on task {uuid}, which is not in the plan")
+            needed.add(index[uuid])
+        for name in prop_names(t.props.get('requires-fixture')):
+            if name not in providers:
+                raise ValueError(f"Task {t.uuid} requires fixture '{name}', which no task provides")
+            needed.update(providers[name])
+        needed.discard(idx)
+        prerequisites.append(tuple(sorted(needed)))
+
+    # Kahn's algorithm, in plan order where there is a choice.
+    waiting = [len(p) for p in prerequisites]
+    dependents: List[List[int]] = [[] for _ in tasks]
+    for idx, needed in enumerate(prerequisites):
+        for p in needed:
+            dependents[p].append(idx)
+    ready = [idx for idx, count in enumerate(waiting) if not count]
+    heapify(ready)
+    order = []
+    while ready:
+        idx = heappop(ready)
+        order.append(idx)
+        for d in dependents[idx]:
+            waiting[d] -= 1
+            if not waiting[d]:
+                heappush(ready, d)
+    if len(order) < len(tasks):
+        cycle = [tasks[idx].uuid for idx, count in enumerate(waiting) if count]
+        raise ValueError(f"Tasks {cycle} depend on each other")
+
+    fixtures = frozenset(idx for idxs in providers.values() for idx in idxs)
+    return TaskGraph(prerequisites, fixtures, order)
+
+def dependency_groups(tasks: Sequence[ApTask], graph: TaskGraph) -> Dict[str, str]:
+    '''
+    Returns the uuid of the first task of the group each task is in, tasks
+    connected by dependencies being in one group, to keep them together
+    when the plan is split into shards.
+    '''
+    parent = list(range(len(tasks)))
+
+    def root(idx: int) -> int:
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    for idx, needed in enumerate(graph.prerequisites):
+        for p in needed:
+            a, b = root(idx), root(p)
+            parent[max(a, b)] = min(a, b)
+    return {t.uuid: tasks[root(idx)].uuid for idx, t in enumerate(tasks)}
+
+def task_priorities(tasks: Sequence[ApTask], graph: TaskGraph, history: Optional[Mapping[str, TaskHistory]] = None,
+        durations: Optional[Mapping[str, float]] = None) -> List[float]:
+    '''
+    Returns the priority of each task, its likelihood to fail per second it
+    takes. The likelihood is (failures + 1) / (runs + 2) over its history, so
+    a task never run before counts as a coin flip. The duration is the mean
+    of its history, or from durations, seconds per task uuid, or else the
+    median known one. A task is at least as urgent as any task waiting for it.
+    '''
+    history = history or {}
+    durations = {**(durations or {}), **{u: h.wall_time for u, h in history.items() if h.wall_time is not None}}
+    known = [durations[t.uuid] for t in tasks if t.uuid in durations]
+    default = median(known) if known else DEFAULT_DURATION
+
+    priorities = []
+    for t in tasks:
+        h = history.get(t.uuid, TaskHistory(0, 0))
+        likelihood = (h.failures + 1) / (h.runs + 2)
+        priorities.append(likelihood / max(durations.get(t.uuid, default), MIN_DURATION))
+
+    for idx in reversed(graph.order):
+        for p in graph.prerequisites[idx]:
+            priorities[p] = max(priorities[p], priorities[idx])
+    return priorities
+
+PENDING = object()
+
+def run_scheduled(prerequisites: Sequence[Sequence[int]], priorities: Sequence[float], run: Callable[[int], R],
+        passed: Callable[[R], bool], blocked: Callable[[int], R], workers: int, fail_fast: bool = False,
+        on_result: Optional[Callable[[int, R], None]] = None) -> int:
+    '''
+    Runs nodes 0 to n - 1, up to workers at a time, each once its
+    prerequisites have passed, highest priority first and ties in node
+    order. A node one of whose prerequisites did not pass is not run and
+    blocked(node) is its result. on_result is called with each node and its
+    result in node order, as soon as it and every node before it completed.
+    With fail_fast, no node is started once one did not pass. Returns the
+    number of nodes that were neither run nor blocked.
+    '''
+    count = len(prerequisites)
+    dependents: List[List[int]] = [[] for _ in range(count)]
+    waiting = [len(p) for p in prerequisites]
+    for node, needed in enumerate(prerequisites):
+        for p in needed:
+            dependents[p].append(node)
+    ready = [(-priorities[node], node) for node in range(count) if not waiting[node]]
+    heapify(ready)
+    results = [PENDING] * count
+    next_result = 0
+    stopped = False
+
+    def complete(node: int, result):
+        nonlocal stopped
+        results[node] = result
+        # Blocked nodes block their dependents in turn.
+        completed = [(node, passed(result))]
+        while completed:
+            node, ok = completed.pop()
+            stopped = stopped or (fail_fast and not ok)
+            for d in dependents[node]:
+                if results[d] is not PENDING:
+                    continue
+                if not ok:
+                    results[d] = blocked(d)
+                    completed.append((d, False))
+                    continue
+                waiting[d] -= 1
+                if not waiting[d]:
+                    heappush(ready, (-priorities[d], d))
+
+    def report():
+        nonlocal next_result
+        while next_result < count and results[next_result] is not PENDING:
+            if on_result:
+                on_result(next_result, results[next_result])
+            next_result += 1
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while ready and len(running) < workers and not stopped:
+                node = heappop(ready)[1]
+                if results[node] is PENDING:
+                    running[executor.submit(run, node)] = node
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                complete(running.pop(future), future.result())
+            report()
+
+    skipped = 0
+    for node in range(next_result, count):
+        if results[node] is PENDING:
+            skipped += 1
+        elif on_result:
+            on_result(node, results[node])
+    return skipped
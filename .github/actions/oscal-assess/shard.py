@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+'''
+Sharding of an assessment plan's tasks over several runs, e.g. the jobs of a
+CI matrix, and merging of the partial assessment results they write into one.
+
+Every shard computes the same partition from the plan, so no coordination is
+needed: with only the plan to go on, tasks are spread by a hash of their
+uuid. Given the durations of a previous run, from a JSON lines metrics file,
+the longest tasks are placed first, each on the shard with the least work so
+far, which balances shards whose tasks take very different times. All shards
+must be given the same durations file, or none, to agree on the partition.
+
+Each shard writes a complete assessment results document for its tasks. The
+merge combines the observations and findings of results with the same uuid,
+which is stable per target, across shards:
+
+    python cli.py merge -o assessment-results.yaml --plan assessment-plan.yaml shard-*.yaml
+'''
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+from hashlib import sha256
+import json
+import logging
+from os import PathLike, replace
+from pathlib import Path
+from statistics import median
+import sys
+from tempfile import NamedTemporaryFile
+from typing import Dict, List, Optional, Sequence, Union
+from uuid import uuid4
+from yaml import safe_dump
+
+from content import AP_ACTION_TASKS_EXPR, ApTask
+from loader import json_compatible, load_document
+from writer import format_for_path
+
+logger = logging.getLogger('oscal_assess')
+
+BLOSSOM_NS = 'https://www.nist.gov/itl/csd/ssag/blossom'
+
+def task_hash(task_uuid: str) -> int:
+    '''
+    Returns a hash of a task uuid that is the same in every process, unlike
+    hash(), which is randomized per interpreter.
+    '''
+    return int.from_bytes(sha256(task_uuid.encode()).digest()[:8], 'big')
+
+def shard_tasks(tasks: Sequence[ApTask], shard_index: int, shard_count: int,
+        durations: Optional[Dict[str, float]] = None, groups: Optional[Dict[str, str]] = None) -> List[ApTask]:
+    '''
+    Returns the tasks, in plan order, that shard shard_index of shard_count
+    runs. Every task is in exactly one shard. With durations, seconds per task
+    uuid, tasks are balanced by duration, those with no recorded duration
+    counting as the median one. With groups, a group key per task uuid as
+    from schedule.dependency_groups, the tasks of a group are in one shard.
+    '''
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is not in 0..{shard_count - 1}")
+    if shard_count == 1:
+        return list(tasks)
+
+    keys = [groups.get(t.uuid, t.uuid) if groups else t.uuid for t in tasks]
+    known = [durations[t.uuid] for t in tasks if durations and t.uuid in durations]
+    if not known:
+        return [t for t, key in zip(tasks, keys) if task_hash(key) % shard_count == shard_index]
+
+    default = median(known)
+    weights: Dict[str, float] = {}
+    for t, key in zip(tasks, keys):
+        weights[key] = weights.get(key, 0.0) + durations.get(t.uuid, default)
+    # Longest first, ties broken by hash so the order does not follow the plan.
+    order = sorted(weights, key=lambda key: (-weights[key], task_hash(key), key))
+    loads = [0.0] * shard_count
+    selected = set()
+    for key in order:
+        shard = min(range(shard_count), key=lambda s: (loads[s], s))
+        loads[shard] += weights[key]
+        if shard == shard_index:
+            selected.add(key)
+
+    return [t for t, key in zip(tasks, keys) if key in selected]
+
+def load_task_durations(path: Union[str, Path, PathLike]) -> Dict[str, float]:
+    '''
+    Returns the wall time in seconds of each task in a JSON lines metrics
+    file, as written by metrics.write_metrics, summed over targets.
+    '''
+    durations: Dict[str, float] = {}
+    with open(path) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('type') == 'task' and record.get('wall_time') is not None:
+                durations[record['task']] = durations.get(record['task'], 0.0) + record['wall_time']
+    return durations
+
+def observation_task_uuid(observation: dict) -> Optional[str]:
+    for prop in observation.get('props') or []:
+        if prop.get('name') == 'assessment-plan-task-uuid' and prop.get('ns') == BLOSSOM_NS:
+            return prop.get('value')
+    return None
+
+def parse_timestamp(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def merge_ars(ars: Sequence[dict], ap: Optional[dict] = None) -> dict:
+    '''
+    Returns one assessment results document with the observations and
+    findings of the results in ars, partial results of the same plan. Results
+    with the same uuid are merged, taking the earliest start and latest end.
+    With the plan, observations are put in plan order, and a task observed by
+    more than one shard raises ValueError.
+    '''
+    if not ars:
+        raise ValueError('No assessment results to merge')
+
+    documents = [json_compatible(ar)['assessment-results'] for ar in ars]
+    first = documents[0]
+    hrefs = {d['import-ap']['href'] for d in documents}
+    if len(hrefs) > 1:
+        raise ValueError(f"Assessment results import different plans: {sorted(hrefs)}")
+
+    results: Dict[str, dict] = {}
+    for document in documents:
+        for result in document.get('results') or []:
+            merged = results.get(result['uuid'])
+            if merged is None:
+                results[result['uuid']] = merged = {
+                    **{key: value for key, value in result.items() if key not in ('observations', 'findings')},
+                    'observations': [],
+                    'findings': []
+                }
+            else:
+                merged['start'] = min(merged['start'], result['start'], key=parse_timestamp)
+                if 'end' in result:
+                    merged['end'] = max(merged.get('end', result['end']), result['end'], key=parse_timestamp)
+            merged['observations'].extend(result.get('observations') or [])
+            merged['findings'].extend(result.get('findings') or [])
+
+    plan_order = {}
+    if ap:
+        for raw_task in AP_ACTION_TASKS_EXPR.search(ap) or []:
+            plan_order.setdefault(raw_task['uuid'], len(plan_order))
+
+    for merged in results.values():
+        if plan_order:
+            task_uuids = Counter(observation_task_uuid(o) for o in merged['observations'])
+            duplicates = sorted(u for u, count in task_uuids.items() if u and count > 1)
+            if duplicates:
+                raise ValueError(f"Tasks {duplicates} were run by more than one shard in result {merged['uuid']}")
+            missing = [u for u in plan_order if u not in task_uuids]
+            if missing:
+                logger.warning(f"No observation of {len(missing)} task(s) in result {merged['uuid']}: {missing}")
+            merged['observations'].sort(key=lambda o: plan_order.get(observation_task_uuid(o), len(plan_order)))
+            # Findings follow the observations they relate to.
+            position = {o['uuid']: idx for idx, o in enumerate(merged['observations'])}
+            merged['findings'].sort(key=lambda f: position.get(f['related-observations'][0]['observation-uuid'], len(position)))
+        # Empty observations and findings lists are not valid OSCAL.
+        for key in ('observations', 'findings'):
+            if not merged[key]:
+                del merged[key]
+
+    return {
+        'assessment-results': {
+            **first,
+            'uuid': str(uuid4()),
+            'metadata': {**first['metadata'], 'last-modified': datetime.now(timezone.utc).isoformat()},
+            'results': list(results.values())
+        }
+    }
+
+def write_ar(ar: dict, path: Union[str, Path, PathLike]):
+    '''
+    Writes an assessment results document to path, as JSON for a .json path
+    and YAML otherwise.
+    '''
+    path = Path(path)
+    with NamedTemporaryFile('w', dir=path.parent, delete=False) as fh:
+        if format_for_path(path) == 'json':
+            json.dump(ar, fh, indent=2)
+        else:
+            fh.write('---\n')
+            safe_dump(ar, fh, default_flow_style=False, sort_keys=False)
+    replace(fh.name, path)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='cli.py merge', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('partials', nargs='+', help='assessment results of each shard, YAML or JSON')
+    parser.add_argument('-o', '--output', required=True, help='merged assessment results file to write')
+    parser.add_argument('--plan', help='the assessment plan, to order observations as in the plan and check no task ran twice')
+    parser.add_argument('--validate', action='store_true', help='validate the merged results against the OSCAL schema before writing them')
+    parser.add_argument('--cache-dir', help='directory to cache the plan and schemas in')
+    parser.add_argument('--schema-dir', help='directory with oscal_<model>_schema.json files to use instead of downloading them')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    # cli.py sets the level, DEBUG with RUNNER_DEBUG.
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    cache_dir = Path(args.cache_dir).expanduser() if args.cache_dir else None
+
+    try:
+        ar = merge_ars([load_document(p) for p in args.partials], load_document(args.plan, cache_dir) if args.plan else None)
+    except ValueError as err:
+        logger.error(f"Cannot merge assessment results: {err}")
+        return 1
+
+    if args.validate:
+        from validate import SchemaUnavailableError, validate_document
+        try:
+            errors = validate_document(ar, cache_dir, args.schema_dir)
+        except SchemaUnavailableError as err:
+            logger.error(str(err))
+            return 1
+        for error in errors:
+            logger.error(f"Merged assessment result is not valid OSCAL: {error}")
+        if errors:
+            return 1
+
+    write_ar(ar, args.output)
+    observations = sum(len(r.get('observations', [])) for r in ar['assessment-results']['results'])
+    logger.info(f"Merged {observations} observation(s) from {len(args.partials)} partial result(s) into {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
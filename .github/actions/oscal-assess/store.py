@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+'''
+A local store of assessment runs for trends and run-to-run comparison, one
+SQLite file holding one row per run and one per task result of each run,
+indexed by task, control and commit.
+
+Runs are appended by the assessment itself (the results_store_path input),
+or recorded afterwards from an assessment results document, e.g. one merged
+from shards. Comparing two runs only queries the store:
+
+    python cli.py diff --store results.sqlite              # previous against latest run
+    python cli.py diff --store results.sqlite 3f2a1c latest  # run of a commit against latest
+    python cli.py record --store results.sqlite --plan assessment-plan.yaml assessment-results.yaml
+'''
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+from os import PathLike, getenv
+from pathlib import Path
+import sqlite3
+import subprocess
+import sys
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    from schedule import TaskHistory
+
+logger = logging.getLogger('oscal_assess')
+
+BLOSSOM_NS = 'https://www.nist.gov/itl/csd/ssag/blossom'
+# Bump with a migration in ResultStore.migrate when the schema changes.
+STORE_SCHEMA_VERSION = 1
+STORE_SCHEMA = '''
+CREATE TABLE runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    commit_sha TEXT,
+    ref TEXT,
+    plan TEXT,
+    wall_time REAL,
+    tasks INTEGER NOT NULL,
+    failed INTEGER NOT NULL
+);
+CREATE INDEX runs_commit ON runs (commit_sha);
+CREATE TABLE task_results (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    task TEXT NOT NULL,
+    -- empty for a run without explicit targets
+    target TEXT NOT NULL DEFAULT '',
+    control TEXT,
+    title TEXT,
+    passed INTEGER NOT NULL,
+    cache TEXT,
+    wall_time REAL,
+    cpu_time REAL,
+    max_rss INTEGER,
+    exit_code INTEGER,
+    PRIMARY KEY (run_id, task, target)
+) WITHOUT ROWID;
+CREATE INDEX task_results_task ON task_results (task, target, run_id);
+CREATE INDEX task_results_control ON task_results (control, run_id);
+'''
+
+class StoredResult(NamedTuple):
+    task: str
+    target: str
+    control: Optional[str]
+    title: Optional[str]
+    passed: bool
+    cache: Optional[str] = None
+    wall_time: Optional[float] = None
+    cpu_time: Optional[float] = None
+    max_rss: Optional[int] = None
+    exit_code: Optional[int] = None
+
+class Run(NamedTuple):
+    id: int
+    started: str
+    commit_sha: Optional[str]
+    ref: Optional[str]
+    plan: Optional[str]
+    wall_time: Optional[float]
+    tasks: int
+    failed: int
+
+class Change(NamedTuple):
+    task: str
+    target: str
+    control: Optional[str]
+    title: Optional[str]
+    base_wall_time: Optional[float] = None
+    head_wall_time: Optional[float] = None
+
+class RunDiff(NamedTuple):
+    base: Run
+    head: Run
+    # (control, target) pairs, a control fails if any of its tasks does
+    failing_controls: List[Tuple[str, str]]
+    fixed_controls: List[Tuple[str, str]]
+    failing_tasks: List[Change]
+    fixed_tasks: List[Change]
+    added_tasks: List[Change]
+    removed_tasks: List[Change]
+    slower_tasks: List[Change]
+    faster_tasks: List[Change]
+
+def results_from_tasks_results(tasks_results: Iterable) -> List[StoredResult]:
+    '''Returns the rows to store for the ApTaskResults of a run.'''
+    rows = []
+    for tr in tasks_results:
+        metrics = tr.metrics
+        rows.append(StoredResult(
+            tr.task.uuid, tr.target or '', tr.task.associated_control, tr.task.title, bool(tr.result), tr.cache,
+            metrics.wall_time if metrics else None, metrics.cpu_time if metrics else None,
+            metrics.max_rss if metrics else None, metrics.exit_code if metrics else None
+        ))
+    return rows
+
+def results_from_ar(ar: dict, ap: Optional[dict] = None, ssp: Optional[dict] = None) -> List[StoredResult]:
+    '''
+    Returns the rows to store for the observations of an assessment results
+    document, with the controls and titles of the tasks in the plan ap.
+    '''
+    from content import extract_ap_tasks
+
+    tasks = {t.uuid: t for t in extract_ap_tasks(ap, ssp or {})} if ap else {}
+
+    def number(value, kind):
+        return kind(value) if value is not None else None
+
+    rows = []
+    for result in ar['assessment-results'].get('results') or []:
+        for observation in result.get('observations') or []:
+            props = {p['name']: p['value'] for p in observation.get('props') or [] if p.get('ns') == BLOSSOM_NS}
+            task_uuid = props.get('assessment-plan-task-uuid')
+            if not task_uuid:
+                continue
+            task = tasks.get(task_uuid)
+            rows.append(StoredResult(
+                task_uuid, props.get('assessment-plan-task-target', ''),
+                task.associated_control if task else None, task.title if task else observation.get('title'),
+                props.get('assessment-plan-task-result') == 'success', props.get('assessment-plan-task-cache'),
+                number(props.get('assessment-plan-task-wall-time'), float), number(props.get('assessment-plan-task-cpu-time'), float),
+                number(props.get('assessment-plan-task-max-rss'), int), number(props.get('assessment-plan-task-exit-code'), int)
+            ))
+    return rows
+
+def current_commit() -> Tuple[Optional[str], Optional[str]]:
+    '''
+    Returns the commit and ref being assessed, from the GitHub Actions
+    environment or else the git checkout of the working directory.
+    '''
+    if getenv('GITHUB_SHA'):
+        return getenv('GITHUB_SHA'), getenv('GITHUB_REF_NAME')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, timeout=5).stdout.strip()
+        ref = subprocess.run(['git', 'rev-parse', '--abbrev-ref', 'HEAD'], capture_output=True, text=True, check=True, timeout=5).stdout.strip()
+        return commit or None, ref or None
+    except (OSError, subprocess.SubprocessError):
+        return None, None
+
+class ResultStore:
+    '''
+    The runs in a SQLite file, created on first use. Use as a context manager
+    or close it when done.
+    '''
+    def __init__(self, path: Union[str, Path, PathLike]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def migrate(self):
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version == STORE_SCHEMA_VERSION:
+            return
+        if version != 0:
+            raise RuntimeError(f"Results store {self.path} has schema version {version}, expected {STORE_SCHEMA_VERSION}")
+        with self.db:
+            self.db.executescript(STORE_SCHEMA)
+            self.db.execute(f'PRAGMA user_version = {STORE_SCHEMA_VERSION}')
+
+    def append_run(self, results: List[StoredResult], wall_time: Optional[float] = None, plan: Optional[str] = None,
+            commit_sha: Optional[str] = None, ref: Optional[str] = None, started: Optional[str] = None) -> int:
+        '''Appends a run with its task results and returns the run's id.'''
+        started = started or datetime.now(timezone.utc).isoformat()
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (started, commit_sha, ref, plan, wall_time, tasks, failed) VALUES (?, ?, ?, ?, ?, 0, 0)',
+                (started, commit_sha, ref, plan, wall_time)
+            )
+            run_id = cursor.lastrowid
+            # A task run twice against a target, as from overlapping shards,
+            # is stored once, the later result wins.
+            self.db.executemany(
+                'INSERT OR REPLACE INTO task_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((run_id, *r[:4], int(r.passed), *r[5:]) for r in results)
+            )
+            # Counted from the stored rows, so the counts match them.
+            self.db.execute('''
+                UPDATE runs SET
+                    tasks = (SELECT COUNT(*) FROM task_results WHERE run_id = :run_id),
+                    failed = (SELECT COUNT(*) FROM task_results WHERE run_id = :run_id AND NOT passed)
+                WHERE id = :run_id
+            ''', {'run_id': run_id})
+        return run_id
+
+    def runs(self, limit: Optional[int] = None) -> List[Run]:
+        '''Returns the runs, latest first.'''
+        rows = self.db.execute('SELECT * FROM runs ORDER BY id DESC LIMIT ?', (limit if limit else -1,))
+        return [Run(*row) for row in rows]
+
+    def task_history(self, runs: int = 20) -> Dict[str, 'TaskHistory']:
+        '''
+        Returns how often each task ran and failed in the latest runs, over
+        all targets, and its mean wall time. Results carried forward from an
+        earlier run are not counted again.
+        '''
+        from schedule import TaskHistory
+
+        rows = self.db.execute('''
+            SELECT task, COUNT(*), SUM(NOT passed), AVG(wall_time) FROM task_results
+            WHERE run_id IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?) AND (cache IS NULL OR cache != 'hit')
+            GROUP BY task
+        ''', (runs,))
+        return {task: TaskHistory(count, failures, wall_time) for task, count, failures, wall_time in rows}
+
+    def run(self, spec: Union[str, int]) -> Run:
+        '''
+        Returns the run spec names: a run id, 'latest', 'previous' or
+        'latest~N' for the Nth run before the latest, or a commit sha prefix
+        for the latest run of that commit.
+        '''
+        spec = str(spec)
+        offset = None
+        if spec == 'latest':
+            offset = 0
+        elif spec == 'previous':
+            offset = 1
+        elif spec.startswith('latest~') and spec[len('latest~'):].isdigit():
+            offset = int(spec[len('latest~'):])
+
+        if offset is not None:
+            row = self.db.execute('SELECT * FROM runs ORDER BY id DESC LIMIT 1 OFFSET ?', (offset,)).fetchone()
+        else:
+            row = self.db.execute('SELECT * FROM runs WHERE id = ?', (int(spec),)).fetchone() if spec.isdigit() else None
+            if row is None and len(spec) >= 4:
+                row = self.db.execute(
+                    "SELECT * FROM runs WHERE commit_sha LIKE ? || '%' ORDER BY id DESC LIMIT 1", (spec.lower(),)
+                ).fetchone()
+        if row is None:
+            raise LookupError(f"No run '{spec}' in {self.path}")
+        return Run(*row)
+
+    def diff(self, base: Run, head: Run, min_change_ratio: float = 0.5, min_change_seconds: float = 0.1) -> RunDiff:
+        '''
+        Returns the changes from run base to run head. A task is slower or
+        faster if its wall time changed by at least min_change_ratio of the
+        base time and at least min_change_seconds.
+        '''
+        pairs = self.db.execute('''
+            SELECT b.task, b.target, b.control, b.title, b.passed, b.wall_time, h.passed, h.wall_time, h.control, h.title
+            FROM task_results b LEFT JOIN task_results h ON h.run_id = ? AND h.task = b.task AND h.target = b.target
+            WHERE b.run_id = ?
+            UNION ALL
+            SELECT h.task, h.target, NULL, NULL, NULL, NULL, h.passed, h.wall_time, h.control, h.title
+            FROM task_results h
+            WHERE h.run_id = ? AND NOT EXISTS (
+                SELECT 1 FROM task_results b WHERE b.run_id = ? AND b.task = h.task AND b.target = h.target
+            )
+            ORDER BY 1, 2
+        ''', (head.id, base.id, head.id, base.id)).fetchall()
+
+        changes = {key: [] for key in ('failing', 'fixed', 'added', 'removed', 'slower', 'faster')}
+        for task, target, base_control, base_title, base_passed, base_time, head_passed, head_time, head_control, head_title in pairs:
+            change = Change(task, target, head_control or base_control, head_title or base_title, base_time, head_time)
+            if base_passed is None:
+                changes['added'].append(change)
+            elif head_passed is None:
+                changes['removed'].append(change)
+            elif base_passed and not head_passed:
+                changes['failing'].append(change)
+            elif head_passed and not base_passed:
+                changes['fixed'].append(change)
+            if base_time is not None and head_time is not None:
+                delta = head_time - base_time
+                if abs(delta) >= min_change_seconds and abs(delta) >= min_change_ratio * base_time:
+                    changes['slower' if delta > 0 else 'faster'].append(change)
+
+        def control_status(run: Run) -> Dict[Tuple[str, str], bool]:
+            rows = self.db.execute('''
+                SELECT control, target, MIN(passed) FROM task_results
+                WHERE run_id = ? AND control IS NOT NULL GROUP BY control, target
+            ''', (run.id,))
+            return {(control, target): bool(passed) for control, target, passed in rows}
+
+        base_controls, head_controls = control_status(base), control_status(head)
+        return RunDiff(
+            base, head,
+            failing_controls=sorted(k for k, passed in head_controls.items() if not passed and base_controls.get(k, True)),
+            fixed_controls=sorted(k for k, passed in head_controls.items() if passed and base_controls.get(k) is False),
+            failing_tasks=changes['failing'], fixed_tasks=changes['fixed'],
+            added_tasks=changes['added'], removed_tasks=changes['removed'],
+            slower_tasks=changes['slower'], faster_tasks=changes['faster']
+        )
+
+def run_label(run: Run) -> str:
+    commit = f", commit {run.commit_sha[:12]}" if run.commit_sha else ''
+    return f"run {run.id} ({run.started}{commit})"
+
+def format_diff(diff: RunDiff) -> str:
+    def target_suffix(target: str) -> str:
+        return f" against {target}" if target else ''
+
+    def task_line(c: Change) -> str:
+        return f"  {c.control or '?'} {c.title or c.task}{target_suffix(c.target)}"
+
+    def timing_line(c: Change) -> str:
+        percent = f" ({(c.head_wall_time - c.base_wall_time) / c.base_wall_time:+.0%})" if c.base_wall_time else ''
+        return f"{task_line(c)}: {c.base_wall_time:.3f}s -> {c.head_wall_time:.3f}s{percent}"
+
+    lines = [f"Comparing {run_label(diff.base)} to {run_label(diff.head)}"]
+    sections = [
+        ('Newly failing controls', [f"  {control}{target_suffix(target)}" for control, target in diff.failing_controls]),
+        ('Fixed controls', [f"  {control}{target_suffix(target)}" for control, target in diff.fixed_controls]),
+        ('Newly failing tasks', [task_line(c) for c in diff.failing_tasks]),
+        ('Fixed tasks', [task_line(c) for c in diff.fixed_tasks]),
+        ('Added tasks', [task_line(c) for c in diff.added_tasks]),
+        ('Removed tasks', [task_line(c) for c in diff.removed_tasks]),
+        ('Slower tasks', [timing_line(c) for c in diff.slower_tasks]),
+        ('Faster tasks', [timing_line(c) for c in diff.faster_tasks]),
+    ]
+    for title, section in sections:
+        if section:
+            lines.append(f"{title}:")
+            lines.extend(section)
+    if len(lines) == 1:
+        lines.append('No changes')
+    return '\n'.join(lines)
+
+def diff_to_json(diff: RunDiff) -> dict:
+    return {
+        name: value._asdict() if isinstance(value, Run) else [
+            item._asdict() if isinstance(item, Change) else list(item) for item in value
+        ]
+        for name, value in diff._asdict().items()
+    }
+
+def record_main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='cli.py record', description='Append the run an assessment results document records to a results store')
+    parser.add_argument('results', help='assessment results, YAML or JSON')
+    parser.add_argument('--store', required=True, help='SQLite results store, created if missing')
+    parser.add_argument('--plan', help='the assessment plan, to store the control of each task')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    # cli.py sets the level, DEBUG with RUNNER_DEBUG.
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+
+    from content import extract_import_ssp
+    from loader import load_document
+
+    ap = ssp = None
+    if args.plan:
+        ap = load_document(args.plan)
+        ssp = load_document(Path(args.plan).parent.joinpath(extract_import_ssp(ap)))
+    results = results_from_ar(load_document(args.results), ap, ssp)
+    commit_sha, ref = current_commit()
+    with ResultStore(args.store) as store:
+        run_id = store.append_run(results, plan=args.plan, commit_sha=commit_sha, ref=ref)
+    logger.info(f"Recorded {len(results)} task result(s) as run {run_id} in {args.store}")
+    return 0
+
+def diff_main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='cli.py diff', description='Compare two runs in a results store')
+    parser.add_argument('base', nargs='?', default='previous', help="run id, 'latest', 'previous', 'latest~N' or commit sha prefix, 'previous' by default")
+    parser.add_argument('head', nargs='?', default='latest', help="as base, 'latest' by default")
+    parser.add_argument('--store', required=True, help='SQLite results store')
+    parser.add_argument('--list', action='store_true', help='list the latest runs instead')
+    parser.add_argument('--json', action='store_true', help='print the changes as JSON')
+    parser.add_argument('--min-change-ratio', type=float, default=0.5, help='relative wall time change to report, 0.5 by default')
+    parser.add_argument('--min-change-seconds', type=float, default=0.1, help='absolute wall time change to report, 0.1 by default')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit 1 if any control or task newly fails')
+    args = parser.parse_args(argv)
+
+    if not Path(args.store).exists():
+        print(f"No results store at {args.store}", file=sys.stderr)
+        return 1
+
+    with ResultStore(args.store) as store:
+        if args.list:
+            for run in store.runs(limit=20):
+                print(f"{run_label(run)}: {run.failed} of {run.tasks} task(s) failed")
+            return 0
+        try:
+            diff = store.diff(store.run(args.base), store.run(args.head), args.min_change_ratio, args.min_change_seconds)
+        except LookupError as err:
+            print(err, file=sys.stderr)
+            return 1
+
+    print(json.dumps(diff_to_json(diff), indent=2) if args.json else format_diff(diff))
+    return 1 if args.fail_on_regression and (diff.failing_controls or diff.failing_tasks) else 0
@@ -0,0 +1,201 @@
+'''
+Generators for synthetic OSCAL documents, shaped like the documents in
+.oscal/ but at an arbitrary scale, for benchmarks and tests.
+'''
+from typing import Optional
+from uuid import NAMESPACE_URL, uuid5
+
+BLOSSOM_NS = 'https://www.nist.gov/itl/csd/ssag/blossom'
+
+def synthetic_uuid(kind: str, idx: int) -> str:
+    '''
+    Returns a stable uuid for the idx-th generated object of a kind, so that
+    documents generated with the same arguments are identical.
+    '''
+    return str(uuid5(NAMESPACE_URL, f'{BLOSSOM_NS}/synthetic/{kind}/{idx}'))
+
+def synthetic_control_id(idx: int) -> str:
+    return f'ac-{idx + 1}'
+
+def generate_ap(tasks: int, activities: Optional[int] = None, resources: Optional[int] = None,
+        resource_href: str = 'assessments/ac_8.py', check_result: str = '0',
+        check_method: str = 'system-shell-return-code') -> dict:
+    '''
+    Returns an assessment plan with the given number of action tasks. Tasks
+    are spread round-robin over activities (one control each) and resources,
+    which default to one per task.
+    '''
+    activities = activities or tasks
+    resources = resources or tasks
+
+    return {
+        'assessment-plan': {
+            'uuid': synthetic_uuid('assessment-plan', 0),
+            'metadata': {
+                'title': f'Synthetic Assessment Plan with {tasks} tasks',
+                'last-modified': '2022-11-23T09:00:00.000000-04:00',
+                'version': '0.0.1-alpha',
+                'oscal-version': '1.0.4'
+            },
+            'import-ssp': {'href': './ssp.yaml'},
+            'local-definitions': {
+                'activities': [
+                    {
+                        'uuid': synthetic_uuid('activity', a),
+                        'title': f'Synthetic Activity {a}',
+                        'description': 'A description of automated testing.',
+                        'props': [{'name': 'method', 'value': 'TEST'}],
+                        'related-controls': {
+                            'control-selections': [
+                                {'include-controls': [{'control-id': synthetic_control_id(a)}]}
+                            ],
+                            'control-objective-selections': [
+                                {'include-objectives': [{'objective-id': f'{synthetic_control_id(a)}_obj.a.1'}]}
+                            ]
+                        }
+                    } for a in range(activities)
+                ]
+            },
+            'assessment-subjects': [
+                {'type': 'component', 'description': 'Synthetic subject.', 'include-all': {}}
+            ],
+            'reviewed-controls': {
+                'control-selections': [
+                    {'include-controls': [{'control-id': synthetic_control_id(a)} for a in range(activities)]}
+                ]
+            },
+            'tasks': [
+                {
+                    'uuid': synthetic_uuid('task', t),
+                    'title': f'Synthetic Task {t}',
+                    'description': f'Synthetic check number {t}.',
+                    'type': 'action',
+                    'associated-activities': [
+                        {
+                            'activity-uuid': synthetic_uuid('activity', t % activities),
+                            'subjects': [{'type': 'component', 'include-all': {}}]
+                        }
+                    ],
+                    'props': [
+                        {'name': 'ar-check-method', 'ns': BLOSSOM_NS, 'value': check_method},
+                        {'name': 'ar-check-result', 'ns': BLOSSOM_NS, 'value': check_result}
+                    ],
+                    'links': [
+                        {'href': f"#{synthetic_uuid('resource', t % resources)}", 'rel': 'command'}
+                    ]
+                } for t in range(tasks)
+            ],
+            'back-matter': {
+                'resources': [
+                    {
+                        'uuid': synthetic_uuid('resource', r),
+                        'title': f'Synthetic Resource {r}',
+                        'description': 'A synthetic check script.',
+                        'rlinks': [
+                            {
+                                'href': resource_href,
+                                'media-type': 'text/plain',
+                                'hashes': [{'algorithm': 'SHA-256', 'value': f'{r:064x}'}]
+                            }
+                        ]
+                    } for r in range(resources)
+                ]
+            }
+        }
+    }
+
+def generate_ssp(controls: int, params: int = 1) -> dict:
+    '''
+    Returns a system security plan implementing the controls referenced by
+    generate_ap, with the given number of set-parameters per control.
+    '''
+    return {
+        'system-security-plan': {
+            'uuid': synthetic_uuid('system-security-plan', 0),
+            'control-implementation': {
+                'description': 'Synthetic control implementation.',
+                'implemented-requirements': [
+                    {
+                        'uuid': synthetic_uuid('implemented-requirement', c),
+                        'control-id': synthetic_control_id(c),
+                        'set-parameters': [
+                            {
+                                'param-id': f'{synthetic_control_id(c)}_prm_{p + 1}',
+                                'values': [f'Synthetic value {p + 1} for {synthetic_control_id(c)}']
+                            } for p in range(params)
+                        ]
+                    } for c in range(controls)
+                ]
+            }
+        }
+    }
+
+def generate_catalog(controls: int, enhancements: int = 0, params: int = 1) -> dict:
+    '''
+    Returns a catalog of one group with the given number of controls, each
+    with the given number of params and child control enhancements. 1,000
+    controls with enhancements=1 is roughly the size of NIST SP 800-53.
+    '''
+    def control(control_id: str, children: int) -> dict:
+        return {
+            'id': control_id,
+            'class': 'SP800-53',
+            'title': f'Synthetic Control {control_id}',
+            'params': [{'id': f'{control_id}_prm_{p + 1}', 'label': f'Synthetic parameter {p + 1}'} for p in range(params)],
+            'props': [{'name': 'label', 'value': control_id.upper()}],
+            'parts': [
+                {
+                    'id': f'{control_id}_smt',
+                    'name': 'statement',
+                    'prose': f'Synthetic statement for {control_id} with {{{{ insert: param, {control_id}_prm_1 }}}}.'
+                },
+                {'id': f'{control_id}_gdn', 'name': 'guidance', 'prose': f'Synthetic guidance for {control_id}.'}
+            ],
+            **({'controls': [control(f'{control_id}.{e + 1}', 0) for e in range(children)]} if children else {})
+        }
+
+    return {
+        'catalog': {
+            'uuid': synthetic_uuid('catalog', 0),
+            'metadata': {
+                'title': f'Synthetic Catalog with {controls} controls',
+                'last-modified': '2022-11-23T09:00:00.000000-04:00',
+                'version': '0.0.1-alpha',
+                'oscal-version': '1.0.4'
+            },
+            'groups': [
+                {
+                    'id': 'ac',
+                    'class': 'family',
+                    'title': 'Access Control',
+                    'controls': [control(synthetic_control_id(c), enhancements) for c in range(controls)]
+                }
+            ]
+        }
+    }
+
+def generate_profile(catalog_href: str, with_ids: Optional[list] = None) -> dict:
+    '''
+    Returns a profile importing the controls with_ids, or all controls, from
+    the catalog at catalog_href as-is, setting the first param of each.
+    '''
+    selection = {'include-controls': [{'with-ids': with_ids}]} if with_ids is not None else {'include-all': {}}
+    return {
+        'profile': {
+            'uuid': synthetic_uuid('profile', 0),
+            'metadata': {
+                'title': 'Synthetic Profile',
+                'last-modified': '2022-11-23T09:00:00.000000-04:00',
+                'version': '0.0.1-alpha',
+                'oscal-version': '1.0.4'
+            },
+            'imports': [{'href': catalog_href, **selection}],
+            'merge': {'as-is': True},
+            'modify': {
+                'set-parameters': [
+                    {'param-id': f'{control_id}_prm_1', 'values': [f'Profile value for {control_id}']}
+                    for control_id in (with_ids or [])
+                ]
+            }
+        }
+    }
@@ -0,0 +1,392 @@
+import io
+import json
+import os
+from pathlib import Path
+import sys
+from time import perf_counter, sleep
+from uuid import NAMESPACE_URL, uuid5
+
+import pytest
+import yaml
+
+from assess import ApTaskResult, AssessmentWorkflowContext, ar_results, create_ar_renderer, observations_to_findings, process_ap, run_task, run_task_with_metrics, stream_ar, task_result_to_observation_and_findings, tasks_results_to_observations, tasks_results_to_observations_and_findings
+from checks import CHECK_METHODS, Target, register_check_method
+from content import extract_ap_tasks, extract_reviewed_controls
+from loader import load_document
+from metrics import TaskMetrics
+from shard import merge_ars
+from synthetic import generate_ap, generate_ssp
+from test_checks import PageHandler, server
+from writer import ArWriter
+
+ssp = load_document("../../../.oscal/ssp.yaml")
+ap = load_document("../../../.oscal/assessment-plan.yaml")
+
+def make_script(tmp_path: Path, body: str) -> str:
+    script = tmp_path.joinpath('check.sh')
+    script.write_text(f'#!/bin/sh\n{body}\n')
+    script.chmod(0o755)
+    return str(script)
+
+def make_context(ap: dict, ssp: dict, tmp_path: Path, **kwargs) -> AssessmentWorkflowContext:
+    return AssessmentWorkflowContext(
+        relevant_evidence_href='file:///dev/null',
+        ap=ap, ap_path=tmp_path.joinpath('assessment-plan.yaml'),
+        ar_path=tmp_path.joinpath('assessment-results.yaml'), ar_template_path=None, ar_template_file=None,
+        ssp=ssp, ssp_path=tmp_path.joinpath('ssp.yaml'),
+        tasks_results=[],
+        ar_renderer=None,
+        **kwargs
+    )
+
+def test_process_ap_parallel_keeps_plan_order(tmp_path):
+    # tasks finish out of order, results must still follow the plan
+    script = make_script(tmp_path, 'sleep 0.$(($$ % 5))')
+    ap = generate_ap(8, activities=1, resource_href=script)
+    context = make_context(ap, generate_ssp(1), tmp_path, workers=8)
+
+    process_ap(context)
+
+    assert [tr.task.uuid for tr in context.tasks_results] == [t['uuid'] for t in ap['assessment-plan']['tasks']]
+    assert all(tr.result for tr in context.tasks_results)
+
+def test_process_ap_task_timeout(tmp_path):
+    script = make_script(tmp_path, 'sleep 10')
+    context = make_context(generate_ap(2, resource_href=script), generate_ssp(2), tmp_path, workers=2, task_timeout=0.2)
+
+    start = perf_counter()
+    process_ap(context)
+
+    assert perf_counter() - start < 5
+    assert [tr.result for tr in context.tasks_results] == [False, False]
+
+def render_ar_both_ways(results: list, ar_format: str = 'yaml'):
+    """Render each (result uuid, title, tasks results) in results through the
+    template and stream them through ArWriter, returning both documents.
+    """
+    timestamp = '2022-12-01T00:00:00+00:00'
+    header = {
+        'ar_uuid': '1c4ec4b4-3f8e-4c64-9a1e-0a1f6b3b1c58',
+        'ar_metadata_title': 'OSCAL Workflow Automated Assessment Results',
+        'ar_metadata_last_modified_timestamp': timestamp,
+        'ar_import_ap_href': './assessment-plan.yaml'
+    }
+    reviewed_controls = extract_reviewed_controls(ap)
+
+    streamed = io.StringIO()
+    writer = ArWriter(streamed, ar_format)
+    writer.start(**header)
+
+    template_results = []
+    for result_uuid, result_title, tasks_results in results:
+        observations, findings = tasks_results_to_observations_and_findings(tasks_results, 'file:///dev/null', timestamp)
+        template_results.append({
+            'uuid': result_uuid,
+            'title': result_title,
+            'observations': observations['observations'] or None,
+            'findings': findings['findings'] or None
+        })
+
+        writer.start_result(reviewed_controls, timestamp, result_uuid, result_title)
+        for o in observations['observations']:
+            writer.add_observation(o)
+        for f in findings['findings']:
+            writer.add_finding(f)
+        writer.finish_result()
+    writer.finish()
+
+    rendered = create_ar_renderer().get_template('assessment_result.yaml.j2').render({
+        **header,
+        'ap_reviewed_controls': reviewed_controls,
+        'ar_results_start_timestamp': timestamp,
+        'ar_results': template_results
+    })
+
+    return rendered, streamed.getvalue()
+
+@pytest.mark.parametrize('results', [[[]], [[True]], [[True, False, False]], [[True], [], [False, True]]])
+def test_ar_writer_matches_template(results):
+    task = extract_ap_tasks(ap, ssp)[0]
+    rendered, streamed = render_ar_both_ways([
+        (str(uuid5(NAMESPACE_URL, str(idx))), f'Result {idx}', [ApTaskResult(task, r) for r in result])
+        for idx, result in enumerate(results)
+    ])
+
+    assert streamed == rendered
+    assert len(yaml.safe_load(rendered)['assessment-results']['results']) == len(results)
+
+def test_ar_result_title_is_quoted():
+    task = extract_ap_tasks(ap, ssp)[0]
+    titles = ['Results for web: production # main', '*all', '&anchor', '[staging]', "it's \"quoted\""]
+    rendered, streamed = render_ar_both_ways([
+        (str(uuid5(NAMESPACE_URL, title)), title, [ApTaskResult(task, True)]) for title in titles
+    ])
+
+    assert streamed == rendered
+    assert [r['title'] for r in yaml.safe_load(rendered)['assessment-results']['results']] == titles
+
+def test_ar_writer_json():
+    task = extract_ap_tasks(ap, ssp)[0]
+    rendered, streamed = render_ar_both_ways([('c28da807-9964-4532-82be-42ea1887373c', 'Result', [ApTaskResult(task, r) for r in [True, False]])], 'json')
+
+    ar = json.loads(streamed)['assessment-results']
+    result = ar['results'][0]
+
+    assert ar['uuid'] == yaml.safe_load(rendered)['assessment-results']['uuid']
+    assert len(result['observations']) == 2
+    assert len(result['findings']) == 1
+    assert result['findings'][0]['related-observations'][0]['observation-uuid'] == result['observations'][1]['uuid']
+
+def test_stream_ar(tmp_path):
+    script = make_script(tmp_path, 'exit 1')
+    context = make_context(generate_ap(3, resource_href=script), generate_ssp(3), tmp_path, workers=2, stream_results=True)
+    context = context._replace(ar_path=tmp_path.joinpath('assessment-results.json'))
+
+    stream_ar(context)
+
+    result = json.loads(context.ar_path.read_text())['assessment-results']['results'][0]
+    assert len(result['observations']) == 3
+    assert len(result['findings']) == 3
+
+def test_stream_ar_keeps_previous_results_on_error(tmp_path, monkeypatch):
+    script = make_script(tmp_path, 'exit 0')
+    ar_dir = tmp_path.joinpath('results')
+    ar_dir.mkdir()
+    context = make_context(generate_ap(3, resource_href=script), generate_ssp(3), tmp_path, stream_results=True)
+    context = context._replace(ar_path=ar_dir.joinpath('assessment-results.yaml'))
+    context.ar_path.write_text('previous results\n')
+
+    def crash(*args):
+        raise RuntimeError('crashed mid-run')
+
+    monkeypatch.setattr('assess.task_result_to_observation_and_findings', crash)
+    with pytest.raises(RuntimeError):
+        stream_ar(context)
+
+    assert context.ar_path.read_text() == 'previous results\n'
+    assert list(ar_dir.iterdir()) == [context.ar_path]
+
+def test_observations_and_findings_single_pass_matches_pair():
+    task = extract_ap_tasks(ap, ssp)[0]
+    tasks_results = [ApTaskResult(task._replace(uuid=str(idx)), idx % 3 != 0) for idx in range(9)]
+
+    observations, findings = tasks_results_to_observations_and_findings(tasks_results, 'file:///dev/null', '2022-12-01T00:00:00+00:00')
+    legacy_findings = observations_to_findings(tasks_results, observations['observations'])
+
+    strip = lambda items: [{k: v for k, v in i.items() if k != 'uuid'} for i in items]
+    assert len(findings['findings']) == 3
+    assert strip(findings['findings']) == strip(legacy_findings['findings'])
+
+def test_process_ap_reports_errors_as_failures(tmp_path):
+    @register_check_method('test-raises')
+    def raises(task, options):
+        raise RuntimeError('check crashed')
+
+    try:
+        context = make_context(generate_ap(2, check_method='test-raises'), generate_ssp(2), tmp_path)
+        process_ap(context)
+    finally:
+        del CHECK_METHODS['test-raises']
+
+    assert [tr.result for tr in context.tasks_results] == [False, False]
+    findings = observations_to_findings(context.tasks_results, tasks_results_to_observations(context.tasks_results, 'file:///dev/null', '2022-12-01T00:00:00+00:00')['observations'])
+    assert len(findings['findings']) == 2
+
+def test_process_ap_incremental(tmp_path):
+    runs = tmp_path.joinpath('runs')
+    script = make_script(tmp_path, f'echo run >> {runs}')
+    ap = generate_ap(3, resource_href=script)
+
+    def assess(ssp):
+        context = make_context(ap, ssp, tmp_path, cache_dir=tmp_path.joinpath('cache'), incremental=True)
+        process_ap(context)
+        return [tr.cache for tr in context.tasks_results]
+
+    assert assess(generate_ssp(3)) == ['miss'] * 3
+    assert assess(generate_ssp(3)) == ['hit'] * 3
+    assert len(runs.read_text().splitlines()) == 3
+
+    # changed params invalidate every task of their control, here all of them
+    assert assess(generate_ssp(3, params=2)) == ['miss'] * 3
+
+    # changed script content invalidates every task using it
+    Path(script).write_text(Path(script).read_text() + 'exit 1\n')
+    assert assess(generate_ssp(3, params=2)) == ['miss'] * 3
+    # failures are never carried forward
+    assert assess(generate_ssp(3, params=2)) == ['miss'] * 3
+    assert len(runs.read_text().splitlines()) == 12
+
+def test_process_ap_incremental_http_content(tmp_path, server):
+    ap = generate_ap(2, activities=1, resource_href='https://example.com/not-a-local-file', check_method='http-content')
+    for raw_task in ap['assessment-plan']['tasks']:
+        raw_task['props'] += [
+            {'name': 'ar-check-url', 'value': f'{server}/'},
+            {'name': 'ar-check-selector', 'value': 'body div p'},
+            {'name': 'ar-check-param', 'value': 'ac-1_prm_1'}
+        ]
+
+    def assess(**kwargs):
+        context = make_context(ap, generate_ssp(1), tmp_path, cache_dir=tmp_path.joinpath('cache'), incremental=True, **kwargs)
+        process_ap(context)
+        return [(tr.result, tr.cache) for tr in context.tasks_results]
+
+    # the page may have changed since, so without a fingerprint it is checked every time
+    assert assess() == [(True, 'miss')] * 2
+    assert assess() == [(True, 'miss')] * 2
+    assert len(PageHandler.requests) == 4
+
+    assert assess(target_fingerprint='v1') == [(True, 'miss')] * 2
+    assert assess(target_fingerprint='v1') == [(True, 'hit')] * 2
+    assert len(PageHandler.requests) == 6
+
+def test_observation_cache_props():
+    task = extract_ap_tasks(ap, ssp)[0]
+    observations = tasks_results_to_observations([
+        ApTaskResult(task, True),
+        ApTaskResult(task, True, cache='hit', collected='2022-11-01T00:00:00+00:00')
+    ], 'file:///dev/null', '2022-12-01T00:00:00+00:00')['observations']
+
+    assert [p['name'] for p in observations[0]['props']] == ['assessment-plan-task-uuid', 'assessment-plan-task-result']
+    assert observations[0]['collected'] == '2022-12-01T00:00:00+00:00'
+    assert observations[1]['props'][-1]['value'] == 'hit'
+    assert observations[1]['collected'] == '2022-11-01T00:00:00+00:00'
+
+@pytest.mark.parametrize('body,expected', [
+    ('import os\nassert os.environ["SSP_PARAM_AC_1_PRM_1"] == SSP_PARAMS["ac-1_prm_1"]', True),
+    ('assert False', False),
+    ('import sys\nsys.exit(3)', False),
+    ('import sys\nsys.exit(0)', True),
+])
+def test_run_task_in_process(tmp_path, body, expected):
+    script = tmp_path.joinpath('check.py')
+    script.write_text(body)
+    task = extract_ap_tasks(generate_ap(1, resource_href=str(script)), generate_ssp(1))[0]
+
+    assert run_task(task, python_runner='in-process') is expected
+    assert 'SSP_PARAM_AC_1_PRM_1' not in os.environ
+
+def test_run_task_in_process_timeout(tmp_path):
+    script = tmp_path.joinpath('check.py')
+    script.write_text('import time\ntime.sleep(10)')
+    task = extract_ap_tasks(generate_ap(1, resource_href=str(script)), generate_ssp(1))[0]
+
+    assert run_task(task, timeout=0.2, python_runner='in-process') is False
+
+def running(pid: int) -> bool:
+    '''Returns whether pid is a process that has not exited, zombies aside.'''
+    try:
+        return Path(f'/proc/{pid}/stat').read_text().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+@pytest.mark.skipif(not Path('/proc/self/stat').exists(), reason='needs /proc')
+@pytest.mark.parametrize('python_runner', ['subprocess', 'in-process'])
+def test_run_task_timeout_kills_children(tmp_path, python_runner):
+    pid_file = tmp_path.joinpath('child.pid')
+    script = tmp_path.joinpath('check.py')
+    script.write_text(f'''#!{sys.executable}
+import subprocess, time
+child = subprocess.Popen(['sleep', '30'])
+open({str(pid_file)!r}, 'w').write(str(child.pid))
+time.sleep(30)
+''')
+    script.chmod(0o755)
+    task = extract_ap_tasks(generate_ap(1, resource_href=str(script)), generate_ssp(1))[0]
+
+    assert run_task(task, timeout=1, python_runner=python_runner) is False
+    child = int(pid_file.read_text())
+    deadline = perf_counter() + 5
+    while running(child) and perf_counter() < deadline:
+        sleep(0.05)
+    assert not running(child)
+
+def test_process_ap_targets(tmp_path):
+    script = make_script(tmp_path, 'test "$ASSESSMENT_TARGET_URL" = "http://good" && test "$EXTRA" = "1"')
+    ap = generate_ap(3, resource_href=script)
+    targets = (Target('good', 'http://good', {'EXTRA': '1'}), Target('bad', 'http://bad'))
+    context = make_context(ap, generate_ssp(3), tmp_path, workers=4, targets=targets)
+    context = context._replace(ar_path=tmp_path.joinpath('assessment-results.json'))
+
+    stream_ar(context)
+
+    assert [(tr.target, tr.result) for tr in context.tasks_results] == [('good', True)] * 3 + [('bad', False)] * 3
+
+    results = json.loads(context.ar_path.read_text())['assessment-results']['results']
+    assert [r['title'] for r in results] == [r.title for r in ar_results(context)]
+    assert [len(r['observations']) for r in results] == [3, 3]
+    assert ['findings' in r for r in results] == [False, True]
+
+@pytest.mark.parametrize('python_runner', ['subprocess', 'in-process'])
+def test_run_task_with_metrics(tmp_path, python_runner):
+    script = tmp_path.joinpath('check.py')
+    script.write_text('#!/usr/bin/env python3\nimport sys\nblob = bytearray(64 << 20)\nsys.exit(0)')
+    script.chmod(0o755)
+    task = extract_ap_tasks(generate_ap(1, resource_href=str(script)), generate_ssp(1))[0]
+
+    result, metrics = run_task_with_metrics(task, python_runner=python_runner)
+
+    assert result is True
+    assert metrics.wall_time > 0
+    assert metrics.cpu_time >= 0
+    assert metrics.max_rss >= 64 << 20
+    assert metrics.exit_code == 0
+
+def test_run_task_with_metrics_timeout(tmp_path):
+    task = extract_ap_tasks(generate_ap(1, resource_href=make_script(tmp_path, 'sleep 10')), generate_ssp(1))[0]
+
+    result, metrics = run_task_with_metrics(task, timeout=0.2)
+
+    assert result is False
+    assert metrics.exit_code is None
+    assert 0.2 <= metrics.wall_time < 5
+
+def test_observation_metrics_props():
+    task = extract_ap_tasks(ap, ssp)[0]
+    observations = tasks_results_to_observations([
+        ApTaskResult(task, True, metrics=TaskMetrics(1.5, 0.25, 1024, 0)),
+        ApTaskResult(task, True, metrics=TaskMetrics(0.5, 0.125))
+    ], 'file:///dev/null', '2022-12-01T00:00:00+00:00')['observations']
+
+    assert {p['name']: p['value'] for p in observations[0]['props'][2:]} == {
+        'assessment-plan-task-wall-time': '1.500000',
+        'assessment-plan-task-cpu-time': '0.250000',
+        'assessment-plan-task-max-rss': '1024',
+        'assessment-plan-task-exit-code': '0'
+    }
+    assert [p['name'] for p in observations[1]['props'][2:]] == ['assessment-plan-task-wall-time', 'assessment-plan-task-cpu-time']
+
+def test_process_ap_shards_merge_to_unsharded(tmp_path):
+    script = make_script(tmp_path, 'exit 1')
+    ap = generate_ap(12, resource_href=script)
+    ssp = generate_ssp(12)
+
+    def observed(ar: dict):
+        result, = ar['assessment-results']['results']
+        return [
+            ({p['name']: p['value'] for p in o['props']}['assessment-plan-task-uuid'], o['title'])
+            for o in result['observations']
+        ], len(result['findings'])
+
+    whole = make_context(ap, ssp, tmp_path)
+    stream_ar(whole)
+
+    partials = []
+    for idx in range(3):
+        context = make_context(ap, ssp, tmp_path, shard_index=idx, shard_count=3)._replace(ar_path=tmp_path.joinpath(f'shard-{idx}.yaml'))
+        stream_ar(context)
+        assert 0 < len(context.tasks_results) < 12
+        partials.append(load_document(context.ar_path))
+
+    assert observed(merge_ars(partials, ap)) == observed(load_document(whole.ar_path))
+
+def test_observation_and_finding_uuids_stable():
+    task = extract_ap_tasks(ap, ssp)[0]
+
+    def uuids(target=None):
+        observation, findings = task_result_to_observation_and_findings(ApTaskResult(task, False, target=target), 'file:///dev/null', '2022-12-01T00:00:00+00:00')
+        return observation['uuid'], findings[0]['uuid'], findings[0]['related-observations'][0]['observation-uuid']
+
+    observation_uuid, finding_uuid, related_uuid = uuids()
+    assert uuids() == (observation_uuid, finding_uuid, observation_uuid)
+    assert related_uuid == observation_uuid
+    assert len({observation_uuid, finding_uuid, uuids('staging')[0], uuids('production')[0]}) == 4
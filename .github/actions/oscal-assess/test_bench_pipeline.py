@@ -0,0 +1,36 @@
+import json
+
+from bench_pipeline import STAGES, Scale, StageResult, baselines, bench_pipeline, main, regressions
+
+def test_bench_pipeline():
+    scale = Scale(tasks=20, activities=2, resources=4, params=2)
+    results = bench_pipeline(scale, repeat=1)
+
+    assert [r.stage for r in results] == list(STAGES)
+    assert all(r.scale == scale and r.seconds > 0 and r.max_rss > 0 for r in results)
+
+def test_regressions():
+    scale = Scale(100, 10, 100, 3)
+    history = [{'stage': 'create_ar', **scale._asdict(), 'seconds': seconds} for seconds in (9.0, 1.0, 1.2, 1.1)]
+    baseline = baselines(history, runs=3)
+    assert baseline == {('create_ar', scale): 1.1}
+
+    results = [StageResult('create_ar', scale, 1.5), StageResult('create_ar', Scale(1, 1, 1, 1), 5.0)]
+    assert regressions(results, baseline, 0.5) == []
+    assert regressions(results, baseline, 0.25) == results[:1]
+    assert regressions(results, baseline, 0.25, min_seconds=1.0) == []
+
+def test_main_history(tmp_path, capsys):
+    history = tmp_path.joinpath('history.jsonl')
+    args = ['--tasks', '10', '--repeat', '1', '--history', str(history)]
+
+    assert main(args) == 0
+    records = [json.loads(line) for line in history.read_text().splitlines()]
+    assert [r['stage'] for r in records] == list(STAGES)
+    assert all(r['tasks'] == 10 for r in records)
+
+    # a baseline no run can match
+    history.write_text(''.join(json.dumps({**r, 'seconds': 1e-9}) + '\n' for r in records))
+    assert main([*args, '--max-regression', '0.5', '--min-seconds', '0']) == 1
+    assert 'Regression in load_yaml at 10 tasks' in capsys.readouterr().err
+    assert len(history.read_text().splitlines()) == 2 * len(STAGES)
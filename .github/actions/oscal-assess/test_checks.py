@@ -0,0 +1,108 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+from checks import CHECK_METHODS, CheckOptions, HttpPool, Target, check_http_content, parse_targets, register_check_method
+from content import extract_ap_tasks
+from synthetic import generate_ap, generate_ssp
+import checks
+
+PAGE = b'''<html><body><div class="content"><h1>WARNING</h1><p>
+    Synthetic value 1
+    for ac-1
+</p></div></body></html>'''
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        PageHandler.requests.append((self.path, self.client_address))
+        if self.path in ('/moved', '/loop'):
+            self.send_response(302)
+            self.send_header('Location', '/' if self.path == '/moved' else '/loop')
+        else:
+            self.send_response(200 if self.path == '/' else 404)
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    PageHandler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+def http_task(**props):
+    task = extract_ap_tasks(generate_ap(1), generate_ssp(1))[0]
+    return task._replace(props={'ar-check-method': 'http-content', 'ar-check-param': 'ac-1_prm_1', **props})
+
+def test_http_content(server, monkeypatch):
+    monkeypatch.setattr(checks, 'http_pool', HttpPool())
+
+    cached = {'ar-check-url': f'{server}/', 'ar-check-cache': 'true'}
+    assert check_http_content(http_task(**cached, **{'ar-check-selector': 'body div p'}), CheckOptions())
+    assert not check_http_content(http_task(**cached, **{'ar-check-selector': 'h1'}), CheckOptions())
+    assert not check_http_content(http_task(**cached, **{'ar-check-selector': 'table'}), CheckOptions())
+
+    # the page was fetched once and shared between the checks that allow it
+    assert len(PageHandler.requests) == 1
+
+    # other checks see the page as it is now
+    assert check_http_content(http_task(**{'ar-check-url': f'{server}/', 'ar-check-selector': 'body div p'}), CheckOptions())
+    assert check_http_content(http_task(**{'ar-check-url': f'{server}/', 'ar-check-selector': 'body div p'}), CheckOptions())
+    assert len(PageHandler.requests) == 3
+
+def test_http_pool_redirects(server):
+    pool = HttpPool()
+    assert pool.request(f'{server}/moved') == PAGE
+    assert [path for path, _ in PageHandler.requests] == ['/moved', '/']
+
+    with pytest.raises(Exception, match='redirected more than'):
+        pool.request(f'{server}/loop')
+    pool.close()
+
+def test_http_pool_keep_alive(server):
+    pool = HttpPool()
+    pool.request(f'{server}/')
+    pool.request(f'{server}/')
+
+    assert len({client for _, client in PageHandler.requests}) == 1
+
+    with pytest.raises(Exception):
+        pool.request(f'{server}/missing')
+    pool.close()
+
+def test_register_check_method():
+    @register_check_method('test-always-passes')
+    def always_passes(task, options):
+        return True
+
+    assert CHECK_METHODS['test-always-passes'] is always_passes
+    del CHECK_METHODS['test-always-passes']
+
+def test_parse_targets(tmp_path):
+    assert parse_targets('') == []
+    assert parse_targets('- http://127.0.0.1:10000\n- http://127.0.0.1:10001') == [
+        Target('http://127.0.0.1:10000', 'http://127.0.0.1:10000'),
+        Target('http://127.0.0.1:10001', 'http://127.0.0.1:10001')
+    ]
+
+    targets_file = tmp_path.joinpath('targets.yaml')
+    targets_file.write_text('- name: staging\n  url: http://staging\n  env:\n    PORT: 8080\n')
+    assert parse_targets(str(targets_file)) == [Target('staging', 'http://staging', {'PORT': '8080'})]
+
+    with pytest.raises(ValueError):
+        parse_targets('- a\n- a')
+
+def test_http_content_relative_to_target(server, monkeypatch):
+    monkeypatch.setattr(checks, 'http_pool', HttpPool())
+    task = http_task(**{'ar-check-url': '/', 'ar-check-selector': 'body div p'})
+
+    assert check_http_content(task, CheckOptions(target=Target('local', server)))
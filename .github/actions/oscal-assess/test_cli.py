@@ -0,0 +1,46 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from cli import SUBCOMMANDS, main
+
+def imported_modules(code: str) -> set:
+    '''Returns the modules a fresh interpreter has loaded after running code.'''
+    result = subprocess.run(
+        [sys.executable, '-c', f'{code}\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))'],
+        capture_output=True, text=True, check=True
+    )
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+def test_lazy_imports():
+    modules = imported_modules('import cli')
+    assert not modules & {'assess', 'jinja2', 'yaml'}
+
+    # only a run that renders the results template needs Jinja2
+    modules = imported_modules('import assess')
+    assert not modules & {'jinja2', 'fastjsonschema', 'sqlite3', 'shard', 'store', 'validate'}
+
+    # only a merge with --validate needs fastjsonschema
+    modules = imported_modules('import shard')
+    assert not modules & {'fastjsonschema', 'validate', 'jinja2'}
+
+    modules = imported_modules('import store')
+    assert not modules & {'jinja2', 'yaml', 'jmespath'}
+
+def test_usage(capsys):
+    assert main([]) == 2
+    assert main(['--help']) == 0
+    out = capsys.readouterr().out
+    assert all(name in out for name in SUBCOMMANDS)
+
+    assert main(['unknown']) == 2
+    assert "unknown subcommand 'unknown'" in capsys.readouterr().err
+
+@pytest.mark.parametrize('name', SUBCOMMANDS)
+def test_subcommand_help(name, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        main([name, '--help'])
+    assert exc_info.value.code == 0
+    assert f'usage: cli.py {name}' in capsys.readouterr().out
@@ -1,11 +1,12 @@
-import yaml
 import jmespath
 import pytest
 
-from content import extract_ssp_params, extract_ap_resource, extract_ap_task_link_uuid, extract_associated_control, extract_ap_tasks
+from loader import load_document
+from content import extract_ssp_params, extract_ap_resource, extract_ap_task_link_uuid, extract_associated_control, extract_associated_control_objective_selections, extract_ap_tasks, index_ap
+from synthetic import generate_ap, generate_ssp, synthetic_uuid
 
-ssp = yaml.safe_load(open("../../../.oscal/ssp.yaml", "r"))
-ap = yaml.safe_load(open("../../../.oscal/assessment-plan.yaml", "r"))
+ssp = load_document("../../../.oscal/ssp.yaml")
+ap = load_document("../../../.oscal/assessment-plan.yaml")
 
 def test_extract_ssp_params():
     params = extract_ssp_params(ssp)
@@ -33,6 +34,29 @@ def test_extract_ap_link_uuid():
 def test_extract_associated_control():
     assert extract_associated_control(ap, "d85636e6-0d9d-4c94-a924-5a612a119040") == 'ac-8'
 
+def test_extract_associated_control_unknown_activity():
+    assert extract_associated_control(ap, 'invalid-fake-uuid') is None
+    assert extract_associated_control_objective_selections(ap, 'invalid-fake-uuid') == []
+
+def test_index_ap():
+    index = index_ap(ap, ssp)
+
+    assert list(index.resources) == ['31291ea5-13d7-44c6-aac6-bc61d9975ec5']
+    assert list(index.activities) == ['d85636e6-0d9d-4c94-a924-5a612a119040']
+    assert 'ac-8_prm_1' in index.ssp_params['ac-8']
+
+    assert extract_associated_control(ap, 'd85636e6-0d9d-4c94-a924-5a612a119040', index) == 'ac-8'
+    assert extract_associated_control_objective_selections(ap, 'd85636e6-0d9d-4c94-a924-5a612a119040', index) == ['ac-8_obj.a.1']
+
+def test_extract_ap_tasks_synthetic():
+    tasks = extract_ap_tasks(generate_ap(50, activities=5, resources=10), generate_ssp(5, params=2))
+
+    assert len(tasks) == 50
+    assert tasks[12].resource.uuid == synthetic_uuid('resource', 2)
+    assert tasks[12].associated_control == 'ac-3'
+    assert tasks[12].associated_control_objective_selections == ['ac-3_obj.a.1']
+    assert len(tasks[12].params) == 2
+
 def test_extract_ap_tasks():
     tasks = extract_ap_tasks(ap, ssp)
 
@@ -56,3 +80,14 @@ def test_extract_ap_tasks():
 
     assert task.props['ar-check-method'] == 'system-shell-return-code'
     assert task.props['ar-check-result'] == '0'
+
+def test_extract_ap_tasks_shares_per_activity_and_resource():
+    # 6 tasks over 2 activities and 3 resources, all with the same props
+    tasks = extract_ap_tasks(generate_ap(6, activities=2, resources=3), generate_ssp(2))
+
+    assert tasks[0].resource is tasks[3].resource and tasks[0].resource is not tasks[1].resource
+    assert tasks[0].associated_activity_props is tasks[2].associated_activity_props
+    assert tasks[0].associated_control_objective_selections is tasks[2].associated_control_objective_selections
+    assert tasks[0].params is tasks[2].params and tasks[0].params is not tasks[1].params
+    assert all(t.props is tasks[0].props for t in tasks)
+    assert [t.associated_control for t in tasks] == ['ac-1', 'ac-2'] * 3
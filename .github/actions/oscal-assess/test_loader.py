@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import loader
+from loader import load_document
+
+def test_load_document_yaml_and_json(tmp_path):
+    ap = load_document("../../../.oscal/assessment-plan.yaml")
+    json_path = tmp_path.joinpath('assessment-plan.json')
+    json_path.write_text(json.dumps(ap, default=str))
+
+    assert load_document(json_path)['assessment-plan']['uuid'] == ap['assessment-plan']['uuid']
+
+def test_load_document_cache(tmp_path, monkeypatch):
+    cache_dir = tmp_path.joinpath('cache')
+    doc_path = tmp_path.joinpath('doc.yaml')
+    doc_path.write_text('a: 1\n')
+
+    assert load_document(doc_path, cache_dir) == {'a': 1}
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # a cache hit must not parse the source again
+    monkeypatch.setattr(loader, 'parse_document', lambda raw, doc_format: pytest.fail('parsed despite cache hit'))
+    assert load_document(doc_path, cache_dir) == {'a': 1}
+    monkeypatch.undo()
+
+    # changed content is a different entry
+    doc_path.write_text('a: 2\n')
+    assert load_document(doc_path, cache_dir) == {'a': 2}
+    assert len(list(cache_dir.iterdir())) == 2
+
+def test_load_document_corrupt_cache(tmp_path):
+    doc_path = tmp_path.joinpath('doc.yaml')
+    doc_path.write_text('a: 1\n')
+    load_document(doc_path, tmp_path)
+
+    entry_path = next(tmp_path.glob('*.pickle'))
+    entry_path.write_bytes(b'not a pickle')
+
+    assert load_document(doc_path, tmp_path) == {'a': 1}
+
+def test_load_document_interns_short_strings(tmp_path):
+    doc_path = tmp_path.joinpath('doc.yaml')
+    long_value = 'x' * (loader.INTERN_MAX_LENGTH + 1)
+    doc_path.write_text(f'- {{name: ar-check-method, value: "{long_value}"}}\n- {{name: ar-check-method, value: "{long_value}"}}\n')
+
+    for doc in (load_document(doc_path), load_document(doc_path, tmp_path.joinpath('cache')), load_document(doc_path, tmp_path.joinpath('cache'))):
+        first, second = doc
+        assert first['name'] is second['name']
+        assert next(iter(first)) is next(iter(second))
+        assert first['value'] == second['value'] and first['value'] is not second['value']
@@ -0,0 +1,45 @@
+import json
+
+from assess import ApTaskResult
+from content import extract_ap_tasks
+from metrics import TaskMetrics, write_metrics
+from synthetic import generate_ap, generate_ssp
+
+tasks = extract_ap_tasks(generate_ap(3), generate_ssp(3))
+tasks_results = [
+    ApTaskResult(tasks[0], True, metrics=TaskMetrics(1.5, 0.25, 1024, 0)),
+    ApTaskResult(tasks[1], False, target='a "quoted" target', metrics=TaskMetrics(0.5, 0.125)),
+    ApTaskResult(tasks[2], True, cache='hit', collected='2022-11-01T00:00:00+00:00')
+]
+
+def test_write_metrics_jsonl(tmp_path):
+    path = tmp_path.joinpath('metrics', 'run.jsonl')
+
+    run = write_metrics(path, tasks_results, 3.0)
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r['type'] for r in records] == ['task', 'task', 'task', 'run']
+    assert records[0]['task'] == tasks[0].uuid
+    assert records[0]['control'] == tasks[0].associated_control
+    assert (records[0]['wall_time'], records[0]['max_rss'], records[0]['exit_code']) == (1.5, 1024, 0)
+    assert (records[1]['result'], records[1]['max_rss']) == ('failed', None)
+    assert (records[2]['cache'], records[2]['wall_time']) == ('hit', None)
+    assert records[3] == {'type': 'run', **run._asdict()}
+    assert (run.tasks, run.failed, run.carried_forward) == (3, 1, 1)
+
+def test_write_metrics_prometheus(tmp_path):
+    path = tmp_path.joinpath('run.prom')
+
+    write_metrics(path, tasks_results, 3.0)
+
+    lines = path.read_text().splitlines()
+    samples = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+    first = f'{{task="{tasks[0].uuid}",control="{tasks[0].associated_control}"}}'
+    second = f'{{task="{tasks[1].uuid}",control="{tasks[1].associated_control}",target="a \\"quoted\\" target"}}'
+
+    assert samples[f'oscal_assess_task_wall_time_seconds{first}'] == '1.5'
+    assert samples[f'oscal_assess_task_max_rss_bytes{first}'] == '1024'
+    assert samples[f'oscal_assess_task_success{second}'] == '0'
+    assert f'oscal_assess_task_max_rss_bytes{second}' not in samples
+    assert samples['oscal_assess_run_carried_forward_tasks'] == '1'
+    assert '# TYPE oscal_assess_task_cpu_time_seconds gauge' in lines
@@ -0,0 +1,197 @@
+from copy import deepcopy
+from pathlib import Path
+
+import pytest
+from yaml import safe_dump
+
+from loader import load_document
+from resolver import iter_controls, main, resolve_profile, resolve_profile_file, without_metadata
+from synthetic import generate_catalog, generate_profile
+
+profile = load_document("../../../.oscal/profile.yaml")
+resolved_catalog = load_document("../../../.oscal/resolved-catalog.yaml")
+catalog_href = profile['profile']['imports'][0]['href']
+
+def control_ids(catalog: dict) -> list:
+    return [entry.control['id'] for entry in iter_controls(catalog['catalog'])]
+
+def params(catalog: dict) -> dict:
+    return {p['id']: p for e in iter_controls(catalog['catalog']) for p in e.control.get('params', [])}
+
+def resource(uuid: str, title: str) -> dict:
+    return {'uuid': uuid, 'title': title, 'rlinks': [{'href': f'https://example.com/{title}'}]}
+
+def low_baseline_source() -> dict:
+    '''
+    Returns a source catalog shaped like the LOW baseline the committed
+    profile imports, which is not available offline: the committed controls
+    with siblings and enhancements the profile does not select, another
+    group, and back-matter resources only the unselected controls refer to.
+    '''
+    source = deepcopy(resolved_catalog['catalog'])
+    del source['metadata']['links']
+    unselected = lambda control_id, uuid: {
+        'id': control_id, 'class': 'SP800-53', 'title': f'Unselected {control_id}',
+        'links': [{'href': f'#{uuid}', 'rel': 'reference'}],
+        'parts': [{'id': f'{control_id}_smt', 'name': 'statement', 'prose': 'Not selected.'}]
+    }
+    ac, ra = source['groups']
+    ac['controls'].insert(0, unselected('ac-1', '00000000-0000-4000-8000-000000000001'))
+    ra['controls'][0]['controls'] = [unselected('ra-5.2', '00000000-0000-4000-8000-000000000002'), unselected('ra-5.11', '00000000-0000-4000-8000-000000000002')]
+    source['groups'].insert(1, {'id': 'at', 'class': 'family', 'title': 'Awareness and Training', 'controls': [unselected('at-1', '00000000-0000-4000-8000-000000000003')]})
+    source['back-matter']['resources'] += [resource(f'00000000-0000-4000-8000-00000000000{n}', f'unreferenced-{n}') for n in (1, 2, 3)]
+    return {'catalog': source}
+
+def test_resolve_profile_matches_committed_catalog():
+    resolved = resolve_profile(profile, [low_baseline_source()])
+
+    assert without_metadata(resolved) == without_metadata(resolved_catalog)
+    assert resolved['catalog']['metadata']['links'][-1] == {'href': './profile.yaml', 'rel': 'source-profile'}
+
+def test_resolve_profile_expected_output():
+    source = {'catalog': {
+        'uuid': '3a1e4c2e-0000-4000-8000-000000000000',
+        'metadata': {'title': 'Source', 'last-modified': '2022-11-23T09:00:00Z', 'version': '1', 'oscal-version': '1.0.4'},
+        'groups': [{'id': 'ac', 'class': 'family', 'title': 'Access Control', 'controls': [
+            {
+                'id': 'ac-1', 'class': 'SP800-53', 'title': 'Policy and Procedures',
+                'params': [{'id': 'ac-1_prm_1', 'label': 'frequency', 'select': {'choice': ['monthly', 'yearly']}}],
+                'props': [{'name': 'label', 'value': 'AC-1'}],
+                'links': [{'href': '#11111111-0000-4000-8000-000000000000', 'rel': 'reference'}],
+                'parts': [
+                    {'id': 'ac-1_smt', 'name': 'statement', 'prose': 'Review {{ insert: param, ac-1_prm_1 }}.'},
+                    {'id': 'ac-1_gdn', 'name': 'guidance', 'prose': 'Guidance.'}
+                ],
+                'controls': [{
+                    'id': 'ac-1.1', 'class': 'SP800-53-enhancement', 'title': 'Automation',
+                    'parts': [{'id': 'ac-1.1_smt', 'name': 'statement', 'links': [{'href': '#22222222-0000-4000-8000-000000000000', 'rel': 'reference'}]}]
+                }]
+            },
+            {
+                'id': 'ac-2', 'class': 'SP800-53', 'title': 'Account Management',
+                'links': [{'href': '#33333333-0000-4000-8000-000000000000', 'rel': 'reference'}]
+            }
+        ]}],
+        'back-matter': {'resources': [
+            resource('11111111-0000-4000-8000-000000000000', 'policy'),
+            resource('22222222-0000-4000-8000-000000000000', 'automation'),
+            resource('33333333-0000-4000-8000-000000000000', 'accounts')
+        ]}
+    }}
+    tailoring = {'profile': {
+        'uuid': '4b2f5d3f-0000-4000-8000-000000000000',
+        'metadata': {'title': 'Tailored', 'last-modified': '2022-11-23T09:00:00Z', 'version': '1', 'oscal-version': '1.0.4'},
+        'imports': [{'href': 'source.yaml', 'include-all': {}, 'exclude-controls': [{'with-ids': ['ac-2']}]}],
+        'merge': {'as-is': True},
+        'modify': {
+            'set-parameters': [{'param-id': 'ac-1_prm_1', 'values': ['yearly']}],
+            'alters': [{
+                'control-id': 'ac-1',
+                'removes': [{'by-name': 'guidance'}],
+                'adds': [
+                    {'position': 'ending', 'props': [{'name': 'status', 'value': 'tailored'}]},
+                    {'position': 'after', 'by-id': 'ac-1_smt', 'parts': [{'id': 'ac-1_odp', 'name': 'item', 'prose': 'Yearly.'}]}
+                ]
+            }]
+        }
+    }}
+
+    assert without_metadata(resolve_profile(tailoring, [source])) == {
+        'groups': [{'id': 'ac', 'class': 'family', 'title': 'Access Control', 'controls': [{
+            'id': 'ac-1', 'class': 'SP800-53', 'title': 'Policy and Procedures',
+            'params': [{'id': 'ac-1_prm_1', 'label': 'frequency', 'values': ['yearly']}],
+            'props': [{'name': 'label', 'value': 'AC-1'}, {'name': 'status', 'value': 'tailored'}],
+            'links': [{'href': '#11111111-0000-4000-8000-000000000000', 'rel': 'reference'}],
+            'parts': [
+                {'id': 'ac-1_smt', 'name': 'statement', 'prose': 'Review {{ insert: param, ac-1_prm_1 }}.'},
+                {'id': 'ac-1_odp', 'name': 'item', 'prose': 'Yearly.'}
+            ],
+            'controls': [{
+                'id': 'ac-1.1', 'class': 'SP800-53-enhancement', 'title': 'Automation',
+                'parts': [{'id': 'ac-1.1_smt', 'name': 'statement', 'links': [{'href': '#22222222-0000-4000-8000-000000000000', 'rel': 'reference'}]}]
+            }]
+        }]}],
+        'back-matter': {'resources': [
+            resource('11111111-0000-4000-8000-000000000000', 'policy'),
+            resource('22222222-0000-4000-8000-000000000000', 'automation')
+        ]}
+    }
+
+def test_resolve_profile_selection():
+    catalog = generate_catalog(4, enhancements=2)
+    import_ = {'href': 'catalog.yaml', 'include-controls': [
+        {'with-ids': ['ac-1'], 'with-child-controls': 'yes'},
+        {'with-ids': ['ac-2.1']},
+        {'matching': [{'pattern': 'ac-4*'}]}
+    ], 'exclude-controls': [{'with-ids': ['ac-4.2']}]}
+    base = {'uuid': 'f2c4a0d8-1d6a-4b4d-9d1c-3a4f0a3c1a11', 'metadata': {'title': 'Selection'}}
+
+    as_is = resolve_profile({'profile': {**base, 'imports': [import_], 'merge': {'as-is': True}}}, [catalog])
+    group_controls = as_is['catalog']['groups'][0]['controls']
+    assert [c['id'] for c in group_controls] == ['ac-1', 'ac-2.1', 'ac-4']
+    assert [c['id'] for c in group_controls[0]['controls']] == ['ac-1.1', 'ac-1.2']
+    assert [c['id'] for c in group_controls[2]['controls']] == ['ac-4.1']
+
+    flat = resolve_profile({'profile': {**base, 'imports': [import_]}}, [catalog])
+    assert 'groups' not in flat['catalog']
+    assert [c['id'] for c in flat['catalog']['controls']] == ['ac-1', 'ac-1.1', 'ac-1.2', 'ac-2.1', 'ac-4', 'ac-4.1']
+
+def test_resolve_profile_modify():
+    catalog = generate_catalog(2)
+    synthetic_profile = generate_profile('catalog.yaml', ['ac-1', 'ac-2'])
+    synthetic_profile['profile']['modify']['alters'] = [
+        {
+            'control-id': 'ac-1',
+            'removes': [{'by-name': 'guidance'}],
+            'adds': [
+                {'position': 'ending', 'props': [{'name': 'status', 'value': 'tailored'}]},
+                {'position': 'after', 'by-id': 'ac-1_smt', 'parts': [{'id': 'ac-1_odp', 'name': 'item', 'prose': 'Added.'}]}
+            ]
+        }
+    ]
+
+    resolved = resolve_profile(synthetic_profile, [catalog])
+    ac_1 = resolved['catalog']['groups'][0]['controls'][0]
+
+    assert params(resolved)['ac-1_prm_1']['values'] == ['Profile value for ac-1']
+    assert [p['id'] for p in ac_1['parts']] == ['ac-1_smt', 'ac-1_odp']
+    assert ac_1['props'][-1] == {'name': 'status', 'value': 'tailored'}
+    # the source catalog is left untouched
+    assert 'values' not in params(catalog)['ac-1_prm_1']
+    assert len(catalog['catalog']['groups'][0]['controls'][0]['parts']) == 2
+
+def test_resolve_profile_rejects_profile_imports():
+    with pytest.raises(ValueError):
+        resolve_profile(generate_profile('other-profile.yaml'), [generate_profile('catalog.yaml')])
+
+def test_resolve_profile_file_cache(tmp_path, monkeypatch):
+    catalog_path = tmp_path.joinpath('catalog.yaml')
+    profile_path = tmp_path.joinpath('profile.yaml')
+    catalog_path.write_text(safe_dump(generate_catalog(3)))
+    profile_path.write_text(safe_dump(generate_profile('catalog.yaml', ['ac-1'])))
+    cache_dir = tmp_path.joinpath('cache')
+
+    first = resolve_profile_file(profile_path, cache_dir)
+    calls = []
+    monkeypatch.setattr('resolver.resolve_profile', lambda *args: calls.append(args))
+
+    assert resolve_profile_file(profile_path, cache_dir) == first
+    assert calls == []
+
+    # any change to an input resolves the profile again
+    catalog_path.write_text(safe_dump(generate_catalog(4)))
+    resolve_profile_file(profile_path, cache_dir)
+    assert len(calls) == 1
+
+def test_main_check(tmp_path):
+    source_path = tmp_path.joinpath('low-baseline.yaml')
+    source_path.write_text(safe_dump(low_baseline_source(), sort_keys=False))
+    source = f"{catalog_href}={source_path}"
+    assert main(['../../../.oscal/profile.yaml', '../../../.oscal/resolved-catalog.yaml', '--source', source, '--check']) == 0
+
+    output = tmp_path.joinpath('resolved-catalog.yaml')
+    output.write_text(safe_dump(generate_catalog(1)))
+    assert main(['../../../.oscal/profile.yaml', str(output), '--source', source, '--check']) == 1
+
+    assert main(['../../../.oscal/profile.yaml', str(output), '--source', source]) == 0
+    assert control_ids(load_document(output)) == ['ac-8', 'ra-5']
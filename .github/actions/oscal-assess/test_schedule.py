@@ -0,0 +1,138 @@
+from pathlib import Path
+
+import pytest
+
+from assess import process_ap, stream_ar
+from content import extract_ap_tasks
+from loader import load_document
+from schedule import TaskHistory, build_task_graph, dependency_groups, run_scheduled, task_priorities
+from synthetic import generate_ap, generate_ssp
+from test_assess import make_context
+
+def plan_with_props(tasks: int, props: dict, resource_href: str = 'assessments/ac_8.py') -> dict:
+    '''Returns a plan of tasks with the extra props, task index -> {name: value}.'''
+    ap = generate_ap(tasks, activities=1, resource_href=resource_href)
+    raw_tasks = ap['assessment-plan']['tasks']
+    for idx, extra in props.items():
+        for name, value in extra.items():
+            if name == 'depends-on':
+                value = ' '.join(raw_tasks[d]['uuid'] for d in value)
+            raw_tasks[idx]['props'].append({'name': name, 'value': value})
+    return ap
+
+def test_build_task_graph():
+    ap = plan_with_props(4, {
+        0: {'requires-fixture': 'app-running'},
+        1: {'depends-on': [3]},
+        3: {'provides-fixture': 'app-running'}
+    })
+    ap['assessment-plan']['tasks'][2]['dependencies'] = [{'task-uuid': ap['assessment-plan']['tasks'][1]['uuid']}]
+    tasks = extract_ap_tasks(ap, generate_ssp(1))
+
+    graph = build_task_graph(tasks)
+    assert graph.prerequisites == [(3,), (3,), (1,), ()]
+    assert graph.fixtures == {3}
+    assert graph.order == [3, 0, 1, 2]
+    assert len(set(dependency_groups(tasks, graph).values())) == 1
+
+def test_build_task_graph_errors():
+    ssp = generate_ssp(1)
+    with pytest.raises(ValueError, match='no task provides'):
+        build_task_graph(extract_ap_tasks(plan_with_props(2, {0: {'requires-fixture': 'app-running'}}), ssp))
+
+    ap = plan_with_props(2, {0: {'depends-on': [1]}})
+    ap['assessment-plan']['tasks'][0]['props'][-1]['value'] += ' not-a-task'
+    with pytest.raises(ValueError, match='not in the plan'):
+        build_task_graph(extract_ap_tasks(ap, ssp))
+
+    with pytest.raises(ValueError, match='depend on each other'):
+        build_task_graph(extract_ap_tasks(plan_with_props(3, {0: {'depends-on': [1]}, 1: {'depends-on': [0]}}), ssp))
+
+def test_task_priorities():
+    tasks = extract_ap_tasks(plan_with_props(4, {1: {'depends-on': [0]}}), generate_ssp(1))
+    graph = build_task_graph(tasks)
+
+    # without history, every task is as urgent as any other
+    assert len(set(task_priorities(tasks, graph))) == 1
+
+    history = {
+        tasks[0].uuid: TaskHistory(10, 0, 1.0),
+        tasks[1].uuid: TaskHistory(10, 8, 1.0),
+        tasks[2].uuid: TaskHistory(10, 5, 10.0),
+    }
+    priorities = task_priorities(tasks, graph, history)
+    # task 0 inherits the priority of task 1, which waits for it
+    assert priorities[0] == priorities[1] > priorities[3] > priorities[2]
+
+def test_run_scheduled_order():
+    started = []
+    reported = []
+    skipped = run_scheduled(
+        [(), (), (0,), ()], [1.0, 3.0, 5.0, 2.0],
+        run=lambda node: started.append(node) or True,
+        passed=bool, blocked=lambda node: False, workers=1,
+        on_result=lambda node, result: reported.append(node)
+    )
+    assert skipped == 0
+    assert started == [1, 3, 0, 2]
+    assert reported == [0, 1, 2, 3]
+
+def test_run_scheduled_failures():
+    prerequisites = [(), (0,), (1,), ()]
+    results = {}
+    skipped = run_scheduled(
+        prerequisites, [0.0] * 4, run=lambda node: node != 0, passed=bool,
+        blocked=lambda node: 'blocked', workers=1, on_result=results.__setitem__
+    )
+    assert skipped == 0
+    assert results == {0: False, 1: 'blocked', 2: 'blocked', 3: True}
+
+    results = {}
+    skipped = run_scheduled(
+        [(), (), ()], [3.0, 2.0, 1.0], run=lambda node: node != 1, passed=bool,
+        blocked=lambda node: 'blocked', workers=1, fail_fast=True, on_result=results.__setitem__
+    )
+    assert skipped == 1
+    assert results == {0: True, 1: False}
+
+def make_script(tmp_path: Path, name: str, body: str) -> str:
+    script = tmp_path.joinpath(name)
+    script.write_text(f'#!/bin/sh\n{body}\n')
+    script.chmod(0o755)
+    return str(script)
+
+def test_process_ap_fixture_runs_once(tmp_path):
+    log = tmp_path.joinpath('log')
+    ap = plan_with_props(4, {
+        0: {'provides-fixture': 'app-running'},
+        **{idx: {'requires-fixture': 'app-running'} for idx in (1, 2, 3)}
+    }, resource_href=make_script(tmp_path, 'check.sh', f'echo ran >> {log}'))
+    context = make_context(ap, generate_ssp(1), tmp_path, workers=4)
+
+    process_ap(context)
+
+    assert len(log.read_text().splitlines()) == 4
+    assert [tr.task.uuid for tr in context.tasks_results] == [t['uuid'] for t in ap['assessment-plan']['tasks']]
+
+def test_process_ap_failed_fixture_blocks_dependents(tmp_path):
+    ap = plan_with_props(3, {
+        0: {'provides-fixture': 'app-running'},
+        1: {'requires-fixture': 'app-running'}
+    }, resource_href=make_script(tmp_path, 'check.sh', 'exit 1'))
+    context = make_context(ap, generate_ssp(1), tmp_path)
+
+    process_ap(context)
+
+    assert [tr.result for tr in context.tasks_results] == [False, False, False]
+    # the blocked task was not run
+    assert [tr.metrics is None for tr in context.tasks_results] == [False, True, False]
+
+def test_stream_ar_fail_fast_writes_partial_results(tmp_path):
+    ap = generate_ap(4, activities=1, resource_href=make_script(tmp_path, 'check.sh', 'exit 1'))
+    context = make_context(ap, generate_ssp(1), tmp_path, stream_results=True, fail_fast=True)
+
+    stream_ar(context)
+
+    assert len(context.tasks_results) == 1
+    result = load_document(context.ar_path)['assessment-results']['results'][0]
+    assert len(result['observations']) == 1 and len(result['findings']) == 1
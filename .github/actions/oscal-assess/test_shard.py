@@ -0,0 +1,138 @@
+import json
+
+import pytest
+import yaml
+
+from assess import ApTaskResult
+from content import extract_ap_tasks
+from metrics import TaskMetrics, write_metrics
+from shard import load_task_durations, main, merge_ars, observation_task_uuid, shard_tasks
+from synthetic import generate_ap, generate_ssp
+
+def synthetic_tasks(count: int):
+    return extract_ap_tasks(generate_ap(count), generate_ssp(count))
+
+def test_shard_tasks_partition():
+    tasks = synthetic_tasks(50)
+    shards = [shard_tasks(tasks, idx, 4) for idx in range(4)]
+
+    assert sorted(t.uuid for s in shards for t in s) == sorted(t.uuid for t in tasks)
+    assert all(s for s in shards)
+    # plan order within a shard, and the same partition every time
+    assert all([tasks.index(t) for t in s] == sorted(tasks.index(t) for t in s) for s in shards)
+    assert shards == [shard_tasks(tasks, idx, 4) for idx in range(4)]
+    assert shard_tasks(tasks, 0, 1) == tasks
+
+    with pytest.raises(ValueError):
+        shard_tasks(tasks, 4, 4)
+
+def test_shard_tasks_balances_durations():
+    tasks = synthetic_tasks(20)
+    # one slow task, the rest quick, and one without a recorded duration
+    durations = {t.uuid: 1.0 for t in tasks[1:-1]}
+    durations[tasks[0].uuid] = 10.0
+    shards = [shard_tasks(tasks, idx, 2, durations) for idx in range(2)]
+
+    assert sorted(t.uuid for s in shards for t in s) == sorted(t.uuid for t in tasks)
+    slow_shard = next(s for s in shards if tasks[0] in s)
+    assert len(slow_shard) < len(tasks) // 2
+    loads = [sum(durations.get(t.uuid, 1.0) for t in s) for s in shards]
+    assert abs(loads[0] - loads[1]) <= 1.0
+
+def test_shard_tasks_keeps_groups_together():
+    tasks = synthetic_tasks(20)
+    # every third task depends on the one before it
+    groups = {t.uuid: tasks[idx - 1].uuid if idx % 3 == 2 else t.uuid for idx, t in enumerate(tasks)}
+    durations = {t.uuid: 1.0 for t in tasks}
+
+    for shard_durations in (None, durations):
+        shards = [shard_tasks(tasks, idx, 3, shard_durations, groups) for idx in range(3)]
+        assert sorted(t.uuid for s in shards for t in s) == sorted(t.uuid for t in tasks)
+        for s in shards:
+            uuids = {t.uuid for t in s}
+            assert all(groups[u] in uuids for u in uuids)
+
+def test_load_task_durations(tmp_path):
+    tasks = synthetic_tasks(2)
+    results = [
+        ApTaskResult(tasks[0], True, target='a', metrics=TaskMetrics(1.5)),
+        ApTaskResult(tasks[0], True, target='b', metrics=TaskMetrics(0.5)),
+        ApTaskResult(tasks[1], False),
+    ]
+    path = tmp_path.joinpath('metrics.jsonl')
+    write_metrics(path, results, 2.0)
+
+    assert load_task_durations(path) == {tasks[0].uuid: 2.0}
+
+def partial_ar(result_uuid: str, observations: list, findings: list = (), start: str = '2022-12-01T00:00:00+00:00') -> dict:
+    result = {
+        'uuid': result_uuid,
+        'title': 'Assessment Results',
+        'description': 'Partial',
+        'start': start,
+        'reviewed-controls': {'control-selections': [{'include-all': {}}]},
+        'observations': observations,
+    }
+    if findings:
+        result['findings'] = list(findings)
+    return {
+        'assessment-results': {
+            'uuid': '00000000-0000-4000-8000-000000000000',
+            'metadata': {'title': 'Results', 'last-modified': start, 'version': '0.0.1-alpha', 'oscal-version': '1.0.4'},
+            'import-ap': {'href': './assessment-plan.yaml'},
+            'results': [result]
+        }
+    }
+
+def observation(task_uuid: str) -> dict:
+    return {
+        'uuid': f'obs-{task_uuid}',
+        'props': [{'name': 'assessment-plan-task-uuid', 'ns': 'https://www.nist.gov/itl/csd/ssag/blossom', 'value': task_uuid}]
+    }
+
+def finding(task_uuid: str) -> dict:
+    return {'uuid': f'finding-{task_uuid}', 'related-observations': [{'observation-uuid': f'obs-{task_uuid}'}]}
+
+def test_merge_ars_plan_order():
+    ap = generate_ap(4)
+    uuids = [t['uuid'] for t in ap['assessment-plan']['tasks']]
+    ars = [
+        partial_ar('r', [observation(uuids[1]), observation(uuids[3])], [finding(uuids[3]), finding(uuids[1])], start='2022-12-01T00:00:05+00:00'),
+        partial_ar('r', [observation(uuids[0]), observation(uuids[2])], start='2022-12-01T00:00:01+00:00'),
+    ]
+
+    merged = merge_ars(ars, ap)['assessment-results']
+    result, = merged['results']
+    assert [observation_task_uuid(o) for o in result['observations']] == uuids
+    assert [f['uuid'] for f in result['findings']] == [f'finding-{uuids[1]}', f'finding-{uuids[3]}']
+    assert result['start'] == '2022-12-01T00:00:01+00:00'
+    assert merged['uuid'] != ars[0]['assessment-results']['uuid']
+
+def test_merge_ars_rejects_overlapping_shards():
+    ap = generate_ap(2)
+    uuids = [t['uuid'] for t in ap['assessment-plan']['tasks']]
+    ars = [partial_ar('r', [observation(uuids[0])]), partial_ar('r', [observation(uuids[0]), observation(uuids[1])])]
+
+    with pytest.raises(ValueError):
+        merge_ars(ars, ap)
+
+def test_merge_ars_drops_empty_lists():
+    result, = merge_ars([partial_ar('r', []), partial_ar('r', [])])['assessment-results']['results']
+    assert 'observations' not in result and 'findings' not in result
+
+def test_merge_cli(tmp_path):
+    ap = generate_ap(2)
+    uuids = [t['uuid'] for t in ap['assessment-plan']['tasks']]
+    paths = []
+    for idx, task_uuid in enumerate(uuids):
+        paths.append(tmp_path.joinpath(f'shard-{idx}.yaml'))
+        paths[-1].write_text(yaml.safe_dump(partial_ar('r', [observation(task_uuid)])))
+    plan_path = tmp_path.joinpath('assessment-plan.json')
+    plan_path.write_text(json.dumps(ap))
+
+    output = tmp_path.joinpath('assessment-results.json')
+    assert main(['-o', str(output), '--plan', str(plan_path), *map(str, reversed(paths))]) == 0
+
+    result, = json.loads(output.read_text())['assessment-results']['results']
+    assert [observation_task_uuid(o) for o in result['observations']] == uuids
+    assert 'findings' not in result
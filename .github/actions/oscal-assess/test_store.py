@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from assess import ApTaskResult, tasks_results_to_observations_and_findings
+from content import extract_ap_tasks
+from metrics import TaskMetrics
+from store import ResultStore, diff_main, results_from_ar, results_from_tasks_results
+from synthetic import generate_ap, generate_ssp
+
+ap = generate_ap(4, activities=2)
+ssp = generate_ssp(2)
+tasks = extract_ap_tasks(ap, ssp)
+
+def run_results(passed, wall_times=None, target=None):
+    return [
+        ApTaskResult(task, result, target=target, metrics=TaskMetrics(wall_times[idx]) if wall_times else None)
+        for idx, (task, result) in enumerate(zip(tasks, passed))
+    ]
+
+@pytest.fixture
+def store(tmp_path):
+    with ResultStore(tmp_path.joinpath('results.sqlite')) as store:
+        yield store
+
+def test_diff(store):
+    # tasks 0 and 2 are of the first control, 1 and 3 of the second
+    base = store.append_run(results_from_tasks_results(run_results([True, False, True], [0.1, 1.0, 0.2])), commit_sha='aaaa1111')
+    head = store.append_run(results_from_tasks_results(run_results([False, True, True, True], [0.1, 0.2, 0.9, 0.1])), commit_sha='bbbb2222')
+
+    diff = store.diff(store.run(base), store.run(head))
+    assert diff.failing_controls == [(tasks[0].associated_control, '')]
+    assert diff.fixed_controls == [(tasks[1].associated_control, '')]
+    assert [c.task for c in diff.failing_tasks] == [tasks[0].uuid]
+    assert [c.task for c in diff.fixed_tasks] == [tasks[1].uuid]
+    assert [c.task for c in diff.added_tasks] == [tasks[3].uuid]
+    assert diff.removed_tasks == []
+    assert [(c.task, c.base_wall_time, c.head_wall_time) for c in diff.slower_tasks] == [(tasks[2].uuid, 0.2, 0.9)]
+    assert [c.task for c in diff.faster_tasks] == [tasks[1].uuid]
+
+    reverse = store.diff(store.run(head), store.run(base))
+    assert [c.task for c in reverse.removed_tasks] == [tasks[3].uuid]
+
+def test_diff_by_target(store):
+    base = store.append_run(results_from_tasks_results(run_results([True] * 4, target='a') + run_results([True] * 4, target='b')))
+    head = store.append_run(results_from_tasks_results(run_results([True] * 4, target='a') + run_results([False, True, True, True], target='b')))
+
+    diff = store.diff(store.run(base), store.run(head))
+    assert diff.failing_controls == [(tasks[0].associated_control, 'b')]
+    assert [(c.task, c.target) for c in diff.failing_tasks] == [(tasks[0].uuid, 'b')]
+
+def test_append_run_counts_stored_results(store):
+    # overlapping shards ran the first task twice, the later result wins
+    results = results_from_tasks_results(run_results([False, True]) + run_results([True]))
+    run = store.run(store.append_run(results))
+
+    assert (run.tasks, run.failed) == (2, 0)
+
+def test_run_specs(store):
+    ids = [store.append_run([], commit_sha=sha) for sha in ('aaaa1111', 'bbbb2222', 'aaaa1111')]
+
+    assert store.run('latest').id == ids[2]
+    assert store.run('previous').id == ids[1]
+    assert store.run('latest~2').id == ids[0]
+    assert store.run(ids[1]).id == ids[1]
+    # the latest run of a commit
+    assert store.run('AAAA11').id == ids[2]
+    with pytest.raises(LookupError):
+        store.run('cccc')
+    assert [r.id for r in store.runs()] == list(reversed(ids))
+
+def test_results_from_ar_matches_tasks_results():
+    tasks_results = run_results([True, False, True, True], [0.5, 0.25, 1.0, 2.0], target='staging')
+    observations, findings = tasks_results_to_observations_and_findings(tasks_results, 'file:///dev/null', '2022-12-01T00:00:00+00:00')
+    ar = {'assessment-results': {'results': [{**observations, **findings}]}}
+
+    assert results_from_ar(ar, ap, ssp) == results_from_tasks_results(tasks_results)
+
+def test_diff_cli(tmp_path, capsys):
+    path = tmp_path.joinpath('results.sqlite')
+    with ResultStore(path) as store:
+        store.append_run(results_from_tasks_results(run_results([True, True])))
+        store.append_run(results_from_tasks_results(run_results([True, False])))
+
+    assert diff_main(['--store', str(path)]) == 0
+    assert f"Newly failing controls:\n  {tasks[1].associated_control}" in capsys.readouterr().out
+    assert diff_main(['--store', str(path), '--fail-on-regression']) == 1
+    capsys.readouterr()
+
+    assert diff_main(['--store', str(path), '--json', '1', '1']) == 0
+    assert json.loads(capsys.readouterr().out)['failing_tasks'] == []
+    assert diff_main(['--store', str(path), 'latest~5']) == 1
+
+def test_task_history(store):
+    store.append_run(results_from_tasks_results(run_results([True, False], [1.0, 2.0])))
+    store.append_run(results_from_tasks_results(run_results([False, False], [3.0, 4.0])))
+    store.append_run(results_from_tasks_results([ApTaskResult(tasks[0], True, cache='hit')]))
+
+    history = store.task_history()
+    assert history[tasks[0].uuid] == (2, 1, 2.0)
+    assert history[tasks[1].uuid] == (2, 2, 3.0)
+    assert store.task_history(runs=2)[tasks[1].uuid] == (1, 1, 4.0)
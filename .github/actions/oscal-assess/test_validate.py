@@ -0,0 +1,168 @@
+import json
+from urllib.error import URLError
+
+import pytest
+
+import validate
+from assess import ApTaskResult, create_ar, create_ar_renderer, stream_ar
+from content import extract_ap_tasks
+from loader import load_document
+from validate import SchemaUnavailableError, get_validator, main, prepare_schema, python_pattern, validate_document
+
+resolved_catalog = load_document("../../../.oscal/resolved-catalog.yaml")
+ap = load_document("../../../.oscal/assessment-plan.yaml")
+ssp = load_document("../../../.oscal/ssp.yaml")
+
+def model_schema(root: str, root_definition: dict) -> dict:
+    '''
+    A small schema shaped like the OSCAL ones: definitions with $id anchors
+    referenced by them, \\p{L} token patterns and an unknown format.
+    '''
+    return {
+        '$schema': 'http://json-schema.org/draft-07/schema#',
+        '$id': f'http://csrc.nist.gov/ns/oscal/1.0/oscal-{root}-schema.json',
+        'type': 'object',
+        'definitions': {
+            'root': {'$id': '#root', **root_definition},
+            'metadata': {
+                '$id': '#metadata',
+                'type': 'object',
+                'properties': {
+                    'title': {'type': 'string'},
+                    'last-modified': {'type': 'string', 'format': 'date-time'},
+                    'version': {'type': 'string'},
+                    'oscal-version': {'type': 'string', 'pattern': '^[0-9]+\\.[0-9]+\\.[0-9]+$'},
+                    'props': {'type': 'array', 'items': {'$ref': '#property'}}
+                },
+                'required': ['title', 'last-modified', 'version', 'oscal-version']
+            },
+            'property': {
+                '$id': '#property',
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string', 'pattern': '^(\\p{L}|_)(\\p{L}|\\p{N}|[.\\-_])*$'},
+                    'value': {'type': 'string', 'pattern': '^\\S(.*\\S)?$'},
+                    'ns': {'type': 'string', 'format': 'uri'},
+                    'class': {'type': 'string', 'format': 'token'}
+                },
+                'required': ['name', 'value']
+            },
+            'uuid': {'$id': '#uuid', 'type': 'string', 'pattern': '^[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[45][0-9A-Fa-f]{3}-[89ABab][0-9A-Fa-f]{3}-[0-9A-Fa-f]{12}$'}
+        },
+        'properties': {root: {'$ref': '#root'}},
+        'required': [root],
+        'additionalProperties': False
+    }
+
+@pytest.fixture
+def schema_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(validate, '_validators', {})
+    directory = tmp_path.joinpath('schemas')
+    directory.mkdir()
+    directory.joinpath('oscal_catalog_schema.json').write_text(json.dumps(model_schema('catalog', {
+        'type': 'object',
+        'properties': {'uuid': {'$ref': '#uuid'}, 'metadata': {'$ref': '#metadata'}, 'groups': {'type': 'array', 'minItems': 1}},
+        'required': ['uuid', 'metadata']
+    })))
+    directory.joinpath('oscal_assessment-results_schema.json').write_text(json.dumps(model_schema('assessment-results', {
+        'type': 'object',
+        'properties': {
+            'uuid': {'$ref': '#uuid'},
+            'metadata': {'$ref': '#metadata'},
+            'results': {
+                'type': 'array',
+                'minItems': 1,
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'uuid': {'$ref': '#uuid'},
+                        'start': {'type': 'string', 'format': 'date-time'},
+                        'observations': {'type': 'array', 'minItems': 1, 'items': {
+                            'type': 'object',
+                            'properties': {'uuid': {'$ref': '#uuid'}, 'props': {'type': 'array', 'items': {'$ref': '#property'}}}
+                        }},
+                        'findings': {'type': 'array', 'minItems': 1}
+                    },
+                    'required': ['uuid', 'start']
+                }
+            }
+        },
+        'required': ['uuid', 'metadata', 'results']
+    })))
+    return directory
+
+def test_python_pattern():
+    assert python_pattern('^(\\p{L}|_)(\\p{L}|\\p{N}|[.\\-_])*$') == '^([^\\W\\d_]|_)([^\\W\\d_]|\\d|[.\\-_])*$'
+    assert python_pattern('^[\\p{L}\\p{N}]+$') == '^[\\w\\w]+$'
+    assert python_pattern('^\\\\p{L}$') == '^\\\\p{L}$'
+
+def test_prepare_schema_rewrites_anchors(schema_dir):
+    schema = prepare_schema(json.loads(schema_dir.joinpath('oscal_catalog_schema.json').read_text()))
+    assert schema['properties']['catalog'] == {'$ref': '#/definitions/root'}
+    assert '$id' not in schema['definitions']['root']
+    assert 'format' not in schema['definitions']['property']['properties']['class']
+
+def test_validate_document(schema_dir):
+    # YAML timestamps are parsed into datetimes, they must validate as strings
+    assert validate_document(resolved_catalog, schema_dir=schema_dir) == []
+
+    invalid = {'catalog': {**resolved_catalog['catalog'], 'uuid': 'not-a-uuid'}}
+    errors = validate_document(invalid, schema_dir=schema_dir)
+    assert len(errors) == 1 and 'uuid' in errors[0]
+
+    assert validate_document({'catalogue': {}}, schema_dir=schema_dir) != []
+
+def test_compiled_validator_not_loaded_from_cache(schema_dir, tmp_path, monkeypatch):
+    # code in the cache directory, which may be restored from a shared
+    # cache, is never run
+    cache_dir = tmp_path.joinpath('cache')
+    cache_dir.joinpath('validators').mkdir(parents=True)
+    for name in ('oscal_catalog_1.0.4.py', 'oscal_catalog_1.0.4_0123456789abcdef.py'):
+        cache_dir.joinpath('validators', name).write_text('raise SystemExit("poisoned")\n')
+
+    assert validate_document(resolved_catalog, cache_dir, schema_dir) == []
+
+def test_schema_unavailable(tmp_path, monkeypatch, caplog):
+    def offline(*args, **kwargs):
+        raise URLError('no network')
+
+    monkeypatch.setattr(validate, 'urlopen', offline)
+    with pytest.raises(SchemaUnavailableError, match='--schema-dir'):
+        get_validator('catalog', '1.0.4', tmp_path.joinpath('cache'))
+
+    assert main(['../../../.oscal/resolved-catalog.yaml', '--cache-dir', str(tmp_path.joinpath('cache'))]) == 1
+    assert 'Cannot download the OSCAL schema https://' in caplog.text
+
+def test_main(schema_dir, tmp_path):
+    invalid = tmp_path.joinpath('invalid-catalog.json')
+    invalid.write_text(json.dumps({'catalog': {'uuid': 'f7b6594d-361c-4ba8-bfe6-4266861b3a87', 'metadata': {'title': 'No version'}}}))
+
+    assert main(['../../../.oscal/resolved-catalog.yaml', '--schema-dir', str(schema_dir)]) == 0
+    assert main(['../../../.oscal/resolved-catalog.yaml', str(invalid), '--schema-dir', str(schema_dir)]) == 1
+
+@pytest.mark.parametrize('ar_file,render', [('assessment-results.yaml', create_ar), ('assessment-results.json', stream_ar)])
+def test_ar_validated(schema_dir, tmp_path, ar_file, render, monkeypatch):
+    from test_assess import make_context
+
+    monkeypatch.setattr('assess.process_ap', lambda context, on_result=None, results_cache=None: None)
+    context = make_context(ap, ssp, tmp_path, validate_results=True, schema_dir=schema_dir)
+    context = context._replace(ar_path=tmp_path.joinpath(ar_file), ar_renderer=create_ar_renderer(), ar_template_file='assessment_result.yaml.j2')
+
+    # no observations at all, as in an empty shard, is valid
+    render(context)
+    assert 'observations' not in load_document(context.ar_path)['assessment-results']['results'][0]
+    context.ar_path.unlink()
+
+    # a blank task uuid prop value is not
+    tasks = extract_ap_tasks(ap, ssp)
+    context.tasks_results.append(ApTaskResult(tasks[0]._replace(uuid=' '), True))
+    if render is stream_ar:
+        monkeypatch.setattr('assess.process_ap', lambda context, on_result=None, results_cache=None: [on_result(tr) for tr in context.tasks_results])
+    with pytest.raises(RuntimeError):
+        render(context)
+    if render is create_ar:
+        assert not context.ar_path.exists()
+
+    context.tasks_results[:] = [ApTaskResult(t, True) for t in tasks]
+    render(context)
+    assert len(load_document(context.ar_path)['assessment-results']['results'][0]['observations']) == len(tasks)
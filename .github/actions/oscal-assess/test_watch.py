@@ -0,0 +1,107 @@
+from pathlib import Path
+import threading
+
+import pytest
+import yaml
+
+from incremental import ResultCache
+from loader import load_document
+from synthetic import generate_ap, generate_ssp
+from test_assess import make_context
+from watch import InotifyWatcher, PollingWatcher, reload_documents, run_once, task_scripts, watch, watch_path, watched_paths
+
+def write_plan(tmp_path: Path, scripts: int):
+    '''Writes a plan with one task per check script, and its SSP.'''
+    ap = generate_ap(scripts)
+    for idx, resource in enumerate(ap['assessment-plan']['back-matter']['resources']):
+        script = tmp_path.joinpath(f'check_{idx}.sh')
+        script.write_text('#!/bin/sh\nexit 0\n')
+        script.chmod(0o755)
+        resource['rlinks'][0]['href'] = str(script)
+    tmp_path.joinpath('assessment-plan.yaml').write_text(yaml.safe_dump(ap))
+    tmp_path.joinpath('ssp.yaml').write_text(yaml.safe_dump(generate_ssp(scripts)))
+
+def watch_context(tmp_path: Path):
+    context = make_context(load_document(tmp_path.joinpath('assessment-plan.yaml')), load_document(tmp_path.joinpath('ssp.yaml')), tmp_path)
+    return context._replace(stream_results=True)
+
+def test_run_once_reruns_only_changed_tasks(tmp_path):
+    write_plan(tmp_path, 3)
+    context = watch_context(tmp_path)
+    cache = ResultCache(None)
+
+    assert run_once(context, cache) == 3
+    assert run_once(context, cache) == 0
+
+    tmp_path.joinpath('check_1.sh').write_text('#!/bin/sh\nexit 1\n')
+    assert run_once(context, cache) == 1
+    assert [tr.result for tr in context.tasks_results] == [True, False, True]
+    assert [tr.cache for tr in context.tasks_results] == ['hit', 'miss', 'hit']
+    # failing tasks are always run again
+    assert run_once(context, cache) == 1
+
+    results = load_document(context.ar_path)['assessment-results']['results'][0]
+    assert len(results['observations']) == 3 and len(results['findings']) == 1
+
+def test_watch_reruns_all_tasks_when_a_helper_module_changes(tmp_path):
+    write_plan(tmp_path, 2)
+    context = watch_context(tmp_path)._replace(python_runner='in-process')
+    for script in task_scripts(context):
+        script.with_suffix('.py').write_text('import sys\nfrom helper import EXIT_CODE\nsys.exit(EXIT_CODE)\n')
+        script.unlink()
+    ap_path = tmp_path.joinpath('assessment-plan.yaml')
+    ap_path.write_text(ap_path.read_text().replace('.sh', '.py'))
+    helper = tmp_path.joinpath('helper.py')
+    helper.write_text('EXIT_CODE = 0\n')
+    context = watch_context(tmp_path)._replace(python_runner='in-process')
+    assert helper in watched_paths(context, task_scripts(context))
+
+    # changed after the first run, which watches before it starts
+    timer = threading.Timer(1, helper.write_text, ('EXIT_CODE = 1\n',))
+    timer.start()
+    watcher = PollingWatcher()
+    try:
+        context = watch(context, watcher, max_runs=2)
+    finally:
+        timer.cancel()
+        watcher.close()
+    assert [tr.result for tr in context.tasks_results] == [False, False]
+    assert 'hit' not in [tr.cache for tr in context.tasks_results]
+
+def test_reload_documents(tmp_path):
+    write_plan(tmp_path, 2)
+    context = watch_context(tmp_path)
+    cache = ResultCache(None)
+    run_once(context, cache)
+
+    ap = load_document(tmp_path.joinpath('assessment-plan.yaml'))
+    ap['assessment-plan']['tasks'][0]['props'].append({'name': 'note', 'value': 'changed'})
+    tmp_path.joinpath('assessment-plan.yaml').write_text(yaml.safe_dump(ap))
+
+    unchanged = reload_documents(context, {watch_path(tmp_path.joinpath('ssp.yaml'))})
+    assert unchanged.ap is context.ap
+
+    context = reload_documents(context, {watch_path(tmp_path.joinpath('assessment-plan.yaml'))})
+    assert run_once(context, cache) == 1
+
+@pytest.mark.parametrize('watcher_class', [InotifyWatcher, PollingWatcher])
+def test_watcher(tmp_path, watcher_class):
+    watched, other = tmp_path.joinpath('watched.yaml'), tmp_path.joinpath('other.yaml')
+    watched.write_text('a')
+    other.write_text('a')
+
+    watcher = watcher_class()
+    try:
+        watcher.watch([watched])
+        other.write_text('b')
+        assert watcher.wait(timeout=0.3) == set()
+
+        # saved by renaming a new file over the old one
+        replacement = tmp_path.joinpath('watched.yaml.tmp')
+        replacement.write_text('changed')
+        timer = threading.Timer(0.1, replacement.replace, (watched,))
+        timer.start()
+        assert watcher.wait(timeout=5) == {watch_path(watched)}
+        timer.join()
+    finally:
+        watcher.close()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+'''
+Validation of OSCAL documents against the OSCAL JSON schemas in one process.
+
+The schema for a document is picked from its root key and its declared
+oscal-version, and downloaded once from the OSCAL release into cache_dir (or
+read from schema_dir). Each schema is compiled with fastjsonschema once per
+process. The compiled code is not cached, since cache_dir may be restored
+from a shared cache and code loaded from it would be run as is.
+
+The OSCAL schemas are adapted for fastjsonschema before compiling: $ref to
+$id anchors are rewritten as JSON pointers, \\p{L} and \\p{N} in patterns,
+which Python's re does not support, are rewritten with equivalent classes,
+and format checks fastjsonschema does not know are dropped.
+
+    python cli.py validate ../../../.oscal/*.yaml --cache-dir ~/.cache/oscal-assess
+'''
+import argparse
+import json
+import logging
+from os import replace
+from pathlib import Path
+import sys
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from urllib.request import urlopen
+
+import fastjsonschema
+from fastjsonschema.draft07 import CodeGeneratorDraft07
+
+from loader import json_compatible, load_document
+
+logger = logging.getLogger('oscal_assess')
+
+DEFAULT_OSCAL_VERSION = '1.0.4'
+OSCAL_SCHEMA_URL = 'https://github.com/usnistgov/OSCAL/releases/download/v{version}/oscal_{model}_schema.json'
+# Document root key to the model name in OSCAL schema file names.
+OSCAL_MODELS = {
+    'catalog': 'catalog',
+    'profile': 'profile',
+    'component-definition': 'component',
+    'system-security-plan': 'ssp',
+    'assessment-plan': 'assessment-plan',
+    'assessment-results': 'assessment-results',
+    'plan-of-action-and-milestones': 'poam',
+}
+KNOWN_FORMATS = set(CodeGeneratorDraft07.FORMAT_REGEXS) | {'regex'}
+# Outside of a character class, and inside one, where only \w is possible
+# and also admits the underscore.
+UNICODE_CLASSES = {
+    r'\p{L}': (r'[^\W\d_]', r'\w'),
+    r'\p{N}': (r'\d', r'\w'),
+}
+
+Validator = Callable[[dict], dict]
+
+_validators: Dict[Tuple[str, str], Validator] = {}
+_validators_lock = Lock()
+
+class SchemaUnavailableError(RuntimeError):
+    '''Raised when an OSCAL schema is neither in schema_dir nor downloadable.'''
+
+def document_model(document: dict) -> Tuple[str, str]:
+    '''
+    Returns the schema model name and the OSCAL version of document.
+    '''
+    for root, model in OSCAL_MODELS.items():
+        if isinstance(document, dict) and root in document:
+            version = document[root].get('metadata', {}).get('oscal-version') or DEFAULT_OSCAL_VERSION
+            return model, str(version)
+    raise ValueError(f"Document is not an OSCAL model, root keys are not any of {sorted(OSCAL_MODELS)}")
+
+def python_pattern(pattern: str) -> str:
+    '''
+    Returns pattern with the Unicode property classes OSCAL uses replaced
+    with classes Python's re understands.
+    '''
+    result = []
+    in_class = False
+    idx = 0
+    while idx < len(pattern):
+        token = pattern[idx:idx + 5]
+        if token in UNICODE_CLASSES:
+            result.append(UNICODE_CLASSES[token][in_class])
+            idx += 5
+            continue
+        char = pattern[idx]
+        if char == '\\':
+            result.append(pattern[idx:idx + 2])
+            idx += 2
+            continue
+        if char == '[' and not in_class:
+            in_class = True
+        elif char == ']' and in_class:
+            in_class = False
+        result.append(char)
+        idx += 1
+    return ''.join(result)
+
+def prepare_schema(schema: dict) -> dict:
+    '''
+    Returns a copy of an OSCAL JSON schema that fastjsonschema can compile.
+    '''
+    anchors = {
+        definition['$id']: '#/definitions/' + name.replace('~', '~0').replace('/', '~1')
+        for name, definition in schema.get('definitions', {}).items()
+        if isinstance(definition, dict) and str(definition.get('$id', '')).startswith('#')
+    }
+
+    def prepare(node):
+        if isinstance(node, list):
+            return [prepare(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        prepared = {}
+        for key, value in node.items():
+            # Without any $id, all refs resolve within this one document and
+            # the compiled code's entry point is named validate.
+            if key == '$id':
+                continue
+            if key == '$ref' and isinstance(value, str):
+                prepared[key] = anchors.get(value, value)
+            elif key == 'pattern' and isinstance(value, str):
+                prepared[key] = python_pattern(value)
+            elif key == 'format' and isinstance(value, str) and value not in KNOWN_FORMATS:
+                continue
+            elif key in ('properties', 'definitions', 'patternProperties') and isinstance(value, dict):
+                # keys here are names, not keywords
+                prepared[key] = {name: prepare(sub) for name, sub in value.items()}
+            else:
+                prepared[key] = prepare(value)
+        return prepared
+
+    return prepare(schema)
+
+def schema_raw(model: str, version: str, cache_dir: Optional[Path] = None, schema_dir: Optional[Path] = None) -> bytes:
+    '''
+    Returns the OSCAL JSON schema for model and version, from schema_dir if
+    given, else from cache_dir, downloading it there first if missing.
+    '''
+    file_name = f'oscal_{model}_schema.json'
+    if schema_dir:
+        return Path(schema_dir).joinpath(file_name).read_bytes()
+
+    cached = Path(cache_dir).joinpath('schemas', version, file_name) if cache_dir else None
+    if cached and cached.exists():
+        return cached.read_bytes()
+
+    url = OSCAL_SCHEMA_URL.format(version=version, model=model)
+    logger.info(f"Downloading {url}")
+    try:
+        with urlopen(url, timeout=60) as response:
+            raw = response.read()
+    # URLError and HTTPError are OSErrors too.
+    except OSError as err:
+        raise SchemaUnavailableError(
+            f"Cannot download the OSCAL schema {url}: {err}. To validate without network access, "
+            f"put {file_name} in a directory and pass it as --schema-dir, or the schema_path action input (INPUT_SCHEMA_PATH)"
+        ) from None
+
+    if cached:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile('wb', dir=cached.parent, delete=False) as fh:
+            fh.write(raw)
+        replace(fh.name, cached)
+    return raw
+
+def compile_validator(model: str, version: str, cache_dir: Optional[Path] = None, schema_dir: Optional[Path] = None) -> Validator:
+    '''
+    Returns the validator for model and version, compiled from its schema.
+    '''
+    raw = schema_raw(model, version, cache_dir, schema_dir)
+    logger.debug(f"Compiling OSCAL {version} {model} schema")
+    return fastjsonschema.compile(prepare_schema(json.loads(raw)))
+
+def get_validator(model: str, version: str, cache_dir: Optional[Path] = None, schema_dir: Optional[Path] = None) -> Validator:
+    '''
+    Returns the validator for model and version, compiled once per process.
+    '''
+    with _validators_lock:
+        if (model, version) not in _validators:
+            _validators[(model, version)] = compile_validator(model, version, cache_dir, schema_dir)
+        return _validators[(model, version)]
+
+def validate_document(document: dict, cache_dir: Optional[Union[str, Path]] = None, schema_dir: Optional[Union[str, Path]] = None) -> List[str]:
+    '''
+    Validates a parsed OSCAL document against the schema of its model, and
+    returns the validation errors, none if it is valid. Raises
+    SchemaUnavailableError if the schema cannot be had.
+    '''
+    try:
+        model, version = document_model(document)
+    except ValueError as err:
+        return [str(err)]
+
+    validator = get_validator(model, version, Path(cache_dir) if cache_dir else None, Path(schema_dir) if schema_dir else None)
+    try:
+        validator(json_compatible(document))
+    except fastjsonschema.JsonSchemaValueException as err:
+        return [err.message]
+    return []
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='cli.py validate', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('documents', nargs='+', help='OSCAL documents to validate, YAML or JSON')
+    parser.add_argument('--cache-dir', help='directory to cache parsed documents and schemas in')
+    parser.add_argument('--schema-dir', help='directory with oscal_<model>_schema.json files to use instead of downloading them')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    # cli.py sets the level, DEBUG with RUNNER_DEBUG.
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    cache_dir = Path(args.cache_dir).expanduser() if args.cache_dir else None
+
+    invalid = 0
+    for path in args.documents:
+        try:
+            errors = validate_document(load_document(path, cache_dir), cache_dir, args.schema_dir)
+        except SchemaUnavailableError as err:
+            logger.error(str(err))
+            return 1
+        if errors:
+            invalid += 1
+            for error in errors:
+                logger.error(f"{path} is invalid: {error}")
+        else:
+            logger.info(f"{path} is valid")
+
+    return 1 if invalid else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
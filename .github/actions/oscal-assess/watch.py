@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+'''
+Watch mode for local development: a resident assessment process that keeps
+its context warm and re-assesses whenever the plan, the SSP, a task's check
+script or a Python module next to one, which check scripts may import,
+changes.
+
+The assessment plan and SSP are parsed once and only reloaded when they
+change, the results renderer and, with the 'in-process' runner (the default
+here), the preloaded check interpreter are reused. Each run carries forward
+the passing results of tasks whose plan entry, check script and SSP
+parameters are unchanged, the same key as incremental mode, so only changed
+and failing tasks are run again before the assessment results are rewritten.
+A change to a module next to the scripts runs every task again, in a new
+check interpreter.
+
+Files are watched with inotify on Linux and by polling their modification
+times elsewhere. Configure it with the same INPUT_* variables as a normal
+run, or the options below:
+
+    python cli.py watch --plan ../../../.oscal/assessment-plan.yaml --results /tmp/assessment-results.yaml
+'''
+import argparse
+import ctypes
+import ctypes.util
+import logging
+from os import close, environ, fsdecode, fsencode, read
+from pathlib import Path
+import select
+import struct
+import sys
+from time import monotonic, perf_counter, sleep
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from assess import create_ar, create_context, load_yaml, process_ap, stream_ar
+from content import extract_ap_tasks, extract_import_ssp
+from incremental import RESULTS_CACHE_FILE, ResultCache
+from metrics import write_metrics
+from pyrunner import restart_forkserver
+
+logger = logging.getLogger('oscal_assess')
+
+# Editors save by writing in place or by renaming a new file over the old
+# one, so the watched files' directories are watched for both.
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')
+# Changes this close together, as from one save, trigger a single run.
+DEFAULT_DEBOUNCE = 0.05
+DEFAULT_POLL_INTERVAL = 0.2
+
+class InotifyWatcher:
+    '''
+    Waits for changes to a set of files with Linux inotify, through libc as
+    there is no binding in the standard library.
+    '''
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.debounce = debounce
+        self.dirs: Dict[int, Path] = {}
+        self.files: Set[Path] = set()
+
+    def watch(self, paths: Iterable[Path]):
+        '''Sets the files to wait for changes to, from now on.'''
+        self.files = {watch_path(p) for p in paths}
+        watched = set(self.dirs.values())
+        for directory in {f.parent for f in self.files} - watched:
+            wd = self._add_watch(self.fd, fsencode(directory), INOTIFY_MASK)
+            if wd < 0:
+                logger.warning(f"Cannot watch {directory}: {ctypes.get_errno()}")
+                continue
+            self.dirs[wd] = directory
+
+    def read_changes(self) -> Set[Path]:
+        changed = set()
+        try:
+            data = read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset += INOTIFY_EVENT.size + length
+            if wd in self.dirs and name:
+                path = self.dirs[wd].joinpath(fsdecode(name))
+                if path in self.files:
+                    changed.add(path)
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        '''
+        Returns the watched files that changed, waiting until one does or
+        timeout seconds pass.
+        '''
+        deadline = None if timeout is None else monotonic() + timeout
+        changed: Set[Path] = set()
+        while not changed:
+            remaining = None if deadline is None else max(0.0, deadline - monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return changed
+            changed |= self.read_changes()
+        while select.select([self.fd], [], [], self.debounce)[0]:
+            changed |= self.read_changes()
+        return changed
+
+    def close(self):
+        close(self.fd)
+
+class PollingWatcher:
+    '''
+    Waits for changes to a set of files by comparing their modification time
+    and size every interval seconds.
+    '''
+    def __init__(self, interval: float = DEFAULT_POLL_INTERVAL):
+        self.interval = interval
+        self.signatures: Dict[Path, Optional[Tuple[int, int]]] = {}
+
+    @staticmethod
+    def signature(path: Path) -> Optional[Tuple[int, int]]:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def watch(self, paths: Iterable[Path]):
+        self.signatures = {p: self.signature(p) for p in map(watch_path, paths)}
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            current = {p: self.signature(p) for p in self.signatures}
+            changed = {p for p, s in current.items() if s != self.signatures[p]}
+            if changed:
+                self.signatures = current
+                return changed
+            if deadline is not None and monotonic() >= deadline:
+                return set()
+            sleep(self.interval)
+
+    def close(self):
+        pass
+
+def watch_path(path) -> Path:
+    '''
+    Returns path made absolute the way watchers compare it, the directory
+    resolved and the name kept, as events name the entry in the directory.
+    '''
+    path = Path(path)
+    return path.absolute().parent.resolve().joinpath(path.name)
+
+def create_watcher(poll: bool = False):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as err:
+            logger.warning(f"Falling back to polling for changes, inotify is not available: {err}")
+    return PollingWatcher()
+
+def task_scripts(context) -> List[Path]:
+    '''Returns every task's check script.'''
+    try:
+        tasks = extract_ap_tasks(context.ap, context.ssp)
+    except Exception as err:
+        logger.warning(f"Cannot list the plan's task scripts to watch: {err}")
+        tasks = []
+    return list(dict.fromkeys(Path(t.resource.file) for t in tasks if t.resource and t.resource.file))
+
+def watched_paths(context, scripts: List[Path]) -> List[Path]:
+    '''
+    Returns the plan, the SSP, the check scripts and the Python modules in
+    their directories, which the scripts may import.
+    '''
+    modules = [m for directory in dict.fromkeys(s.parent for s in scripts) for m in sorted(directory.glob('*.py'))]
+    return list(dict.fromkeys([Path(context.ap_path), Path(context.ssp_path), *scripts, *modules]))
+
+def reload_documents(context, changed: Set[Path]):
+    '''
+    Returns context with the plan and SSP parsed again if they are among the
+    changed files, the SSP also if the plan now imports another one.
+    '''
+    ap_path, ssp_path = Path(context.ap_path), Path(context.ssp_path)
+    ap = context.ap
+    if watch_path(ap_path) in changed:
+        ap = load_yaml(ap_path, context.cache_dir)
+        ssp_path = ap_path.parent.joinpath(extract_import_ssp(ap))
+    ssp = context.ssp
+    if watch_path(ssp_path) in changed or ssp_path != Path(context.ssp_path):
+        ssp = load_yaml(ssp_path, context.cache_dir)
+    return context._replace(ap=ap, ssp=ssp, ssp_path=ssp_path)
+
+def run_once(context, results_cache: ResultCache) -> int:
+    '''
+    Assesses once, carrying forward unchanged passing results from the
+    previous run with results_cache, rewrites the assessment results and
+    returns the number of tasks that were run.
+    '''
+    start = perf_counter()
+    context.tasks_results.clear()
+    if context.stream_results:
+        stream_ar(context, results_cache=results_cache)
+    else:
+        process_ap(context, results_cache=results_cache)
+        create_ar(context)
+    wall_time = perf_counter() - start
+    if context.metrics_path:
+        write_metrics(context.metrics_path, context.tasks_results, wall_time)
+
+    ran = sum(1 for tr in context.tasks_results if tr.cache != 'hit')
+    failed = [tr for tr in context.tasks_results if not tr.result]
+    for tr in failed:
+        logger.warning(f"Task '{tr.task.title}' failed" + (f" against {tr.target}" if tr.target else ''))
+    logger.info(f"Ran {ran} of {len(context.tasks_results)} task(s) in {wall_time * 1000:.0f} ms, {len(failed)} failed, results in {context.ar_path}")
+    return ran
+
+def watch(context, watcher, max_runs: Optional[int] = None):
+    '''
+    Assesses, then again on every change to the watched files, until
+    interrupted or after max_runs runs. Returns the latest context.
+    '''
+    results_cache = ResultCache(context.cache_dir.joinpath(RESULTS_CACHE_FILE) if context.incremental else None, context.target_fingerprint)
+    runs = 0
+    while True:
+        scripts = task_scripts(context)
+        # Watch before running, so changes made during the run are not missed.
+        watcher.watch(watched_paths(context, scripts))
+        try:
+            run_once(context, results_cache)
+        except Exception as err:
+            logger.error(f"Assessment failed, waiting for changes: {err}")
+        runs += 1
+        if max_runs is not None and runs >= max_runs:
+            return context
+
+        while True:
+            changed = watcher.wait()
+            logger.info(f"Changed: {', '.join(sorted(p.name for p in changed))}")
+            if changed - {watch_path(p) for p in (context.ap_path, context.ssp_path, *scripts)}:
+                # Result cache keys cover the scripts but not what they
+                # import, and the check interpreter may have it loaded.
+                logger.info('A module the checks may import changed, running every task again')
+                results_cache.clear()
+                restart_forkserver()
+            try:
+                context = reload_documents(context, changed)
+                break
+            except Exception as err:
+                # e.g. a half written document, wait for the next save
+                logger.error(f"Cannot reload changed documents, waiting for changes: {err}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='cli.py watch', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plan', help='assessment plan path, INPUT_ASSESSMENT_PLAN_PATH if not given')
+    parser.add_argument('--results', help='assessment results path, INPUT_ASSESSMENT_RESULTS_PATH if not given')
+    parser.add_argument('--poll', action='store_true', help='poll for changes instead of using inotify')
+    args = parser.parse_args(argv)
+
+    if args.plan:
+        environ['INPUT_ASSESSMENT_PLAN_PATH'] = args.plan
+    if args.results:
+        environ['INPUT_ASSESSMENT_RESULTS_PATH'] = args.results
+    # Checks are forked from a warm interpreter, unless configured otherwise.
+    environ.setdefault('INPUT_PYTHON_RUNNER', 'in-process')
+
+    context = create_context()
+    watcher = create_watcher(args.poll)
+    logger.info(f"Watching {context.ap_path}, {context.ssp_path}, the task scripts and the modules next to them, Ctrl-C to stop")
+    try:
+        watch(context, watcher)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
+
+if __name__ == '__main__':
+    from cli import configure_logging
+    configure_logging()
+    sys.exit(main())
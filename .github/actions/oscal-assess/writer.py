@@ -0,0 +1,193 @@
+'''
+Incremental writer for OSCAL Assessment Results documents. Observations and
+findings are written out as they are produced instead of being collected and
+rendered in one go, so memory use does not grow with the number of tasks.
+
+The YAML output is byte for byte what templates/assessment_result.yaml.j2
+renders for the same inputs, keep the two in sync.
+'''
+import json
+from os import PathLike
+from pathlib import Path
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+from typing import IO, Union
+from yaml import safe_dump
+
+AR_FORMATS = ('yaml', 'json')
+
+# Fixed values from templates/assessment_result.yaml.j2, and the uuid and
+# title of the single result of a run without explicit targets.
+AR_VERSION = '0.0.1-alpha'
+AR_OSCAL_VERSION = '1.0.4'
+AR_RESULT_UUID = 'c28da807-9964-4532-82be-42ea1887373c'
+AR_RESULT_TITLE = 'Assessment Results for Testing of SYSTEM'
+AR_RESULT_DESCRIPTION = (
+    'These assessment results in OSCAL format are generated automatically '
+    'from an assessment plan in OSCAL format and processed in GitHub Actions.\n'
+)
+
+YAML_HEADER = '''---
+assessment-results:
+  uuid: {ar_uuid}
+  metadata:
+    title: {ar_metadata_title}
+    last-modified: {ar_metadata_last_modified_timestamp}
+    version: {version}
+    oscal-version: {oscal_version}
+
+  import-ap:
+    href: {ar_import_ap_href}
+
+  local-definitions: {{}}
+
+  results:'''
+
+YAML_RESULT_HEADER = '''
+    - uuid: {result_uuid}
+      title: {result_title}
+      description: >
+        These assessment results in OSCAL format are generated automatically
+        from an assessment plan in OSCAL format and processed in GitHub Actions.
+      start: {ar_results_start_timestamp}
+      reviewed-controls:
+'''
+
+def format_for_path(path: Union[str, bytes, Path, PathLike]) -> str:
+    '''
+    Returns the output format implied by a results file name, JSON for
+    a .json suffix and YAML otherwise.
+    '''
+    return 'json' if Path(path).suffix.lower() == '.json' else 'yaml'
+
+def yaml_scalar(value: str) -> str:
+    '''
+    Returns value as a double-quoted YAML scalar, so that names with ': ',
+    ' #' or a leading '*', '&' or '[' read back as the same string. A JSON
+    string is a valid YAML double-quoted scalar.
+    '''
+    return json.dumps(value, ensure_ascii=False)
+
+def yaml_block(obj, width: int) -> str:
+    '''
+    Returns obj dumped as block style YAML with every non-blank line indented
+    by width spaces, the same as the template's to_yaml | indent filters.
+    '''
+    return ''.join(
+        ' ' * width + line if line.strip() else line
+        for line in safe_dump(obj, default_flow_style=False).splitlines(keepends=True)
+    )
+
+class ArWriter:
+    '''
+    Writes one assessment results document to fh. Call start once, then for
+    each result start_result, add_observation and add_finding in any
+    interleaving and finish_result, then finish. Findings come after all
+    observations of a result in the document, so they are spooled to a
+    temporary file until finish_result.
+    '''
+    def __init__(self, fh: IO[str], ar_format: str = 'yaml'):
+        if ar_format not in AR_FORMATS:
+            raise ValueError(f"Unsupported assessment results format '{ar_format}', expected one of {AR_FORMATS}")
+
+        self.fh = fh
+        self.ar_format = ar_format
+        self.results_count = 0
+        self.observations_count = 0
+        self.findings_count = 0
+        self.findings_spool = TemporaryFile('w+', encoding='utf-8')
+
+    def start(self, ar_uuid, ar_metadata_title: str, ar_metadata_last_modified_timestamp: str, ar_import_ap_href: str):
+        if self.ar_format == 'yaml':
+            self.fh.write(YAML_HEADER.format(
+                ar_uuid=ar_uuid,
+                ar_metadata_title=ar_metadata_title,
+                ar_metadata_last_modified_timestamp=ar_metadata_last_modified_timestamp,
+                version=AR_VERSION,
+                oscal_version=AR_OSCAL_VERSION,
+                ar_import_ap_href=ar_import_ap_href
+            ))
+        else:
+            # Everything up to the opening of the results array, the document
+            # is closed again in finish.
+            header = json.dumps({
+                'assessment-results': {
+                    'uuid': str(ar_uuid),
+                    'metadata': {
+                        'title': ar_metadata_title,
+                        'last-modified': ar_metadata_last_modified_timestamp,
+                        'version': AR_VERSION,
+                        'oscal-version': AR_OSCAL_VERSION
+                    },
+                    'import-ap': {'href': ar_import_ap_href},
+                    'local-definitions': {}
+                }
+            })
+            self.fh.write(header[:-len('}}')] + ', "results": [')
+
+    def start_result(self, ap_reviewed_controls: dict, ar_results_start_timestamp: str,
+            result_uuid: str = AR_RESULT_UUID, result_title: str = AR_RESULT_TITLE):
+        self.observations_count = 0
+        self.findings_count = 0
+        self.findings_spool.seek(0)
+        self.findings_spool.truncate()
+
+        if self.ar_format == 'yaml':
+            self.fh.write(YAML_RESULT_HEADER.format(
+                result_uuid=result_uuid,
+                result_title=yaml_scalar(result_title),
+                ar_results_start_timestamp=ar_results_start_timestamp
+            ))
+            self.fh.write(yaml_block(ap_reviewed_controls, 8) + '\n')
+        else:
+            header = json.dumps({
+                'uuid': result_uuid,
+                'title': result_title,
+                'description': AR_RESULT_DESCRIPTION,
+                'start': ar_results_start_timestamp,
+                'reviewed-controls': ap_reviewed_controls
+            })
+            self.fh.write((', ' if self.results_count else '') + header[:-len('}')])
+
+        self.results_count += 1
+
+    def add_observation(self, observation: dict):
+        if self.ar_format == 'yaml':
+            if self.observations_count == 0:
+                self.fh.write('      observations:\n')
+            self.fh.write(yaml_block([observation], 6))
+        else:
+            self.fh.write((', ' if self.observations_count else ', "observations": [') + json.dumps(observation))
+        self.observations_count += 1
+
+    def add_finding(self, finding: dict):
+        if self.ar_format == 'yaml':
+            self.findings_spool.write(yaml_block([finding], 6))
+        else:
+            self.findings_spool.write((', ' if self.findings_count else '') + json.dumps(finding))
+        self.findings_count += 1
+
+    def finish_result(self):
+        self.findings_spool.seek(0)
+
+        # In OSCAL AR instances, we cannot have an empty observations: [] or
+        # findings: [] so each key is only written if there is at least one.
+        if self.ar_format == 'yaml':
+            self.fh.write('\n')
+            if self.findings_count > 0:
+                self.fh.write('\n      findings:\n')
+                copyfileobj(self.findings_spool, self.fh)
+                self.fh.write('\n')
+        else:
+            if self.observations_count > 0:
+                self.fh.write(']')
+            if self.findings_count > 0:
+                self.fh.write(', "findings": [')
+                copyfileobj(self.findings_spool, self.fh)
+                self.fh.write(']')
+            self.fh.write('}')
+
+    def finish(self):
+        if self.ar_format == 'json':
+            self.fh.write(']}}\n')
+        self.findings_spool.close()
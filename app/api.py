@@ -4,6 +4,8 @@ from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
 
+from app.render_cache import ViewCache
+
 # the "app" directory
 base_path = Path(__file__).parent
 
@@ -21,10 +23,19 @@ if os.path.exists(views_path):
 else:
     raise Exception("Could not find Views directory. Expecting 'views/'.")
 
+# The warning pages are the same for every request, so they are rendered once
+# and served from memory. Set ENROLLER_RELOAD_VIEWS=1 while editing templates.
+view_cache = ViewCache(views, views_path, reload=os.getenv("ENROLLER_RELOAD_VIEWS", "0") == "1")
+static_views = ("warning/conforming.html", "warning/non_conforming.html")
+
+@enroller.on_event("startup")
+async def render_static_views():
+    view_cache.warm(*static_views)
+
 @enroller.get("/")
 async def read_root(request: Request):
-    return views.TemplateResponse("warning/conforming.html", { "request": request })
+    return view_cache.response(request, "warning/conforming.html")
 
 @enroller.get("/bad")
 async def read_root(request: Request):
-    return views.TemplateResponse("warning/non_conforming.html", { "request": request })
+    return view_cache.response(request, "warning/non_conforming.html")
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the enroller app, reporting requests/sec and p50/p99
+latency for each page.
+
+By default requests are made to the ASGI app in this process, without a
+server or sockets, which measures the app's own per-request cost. With --url
+requests go over keep-alive connections to a running server instead, e.g. one
+started with `ENROLLER_MODE=production ./run.sh`, which measures serving as a
+whole including the worker count.
+
+With --history, each path's result is appended to a JSON lines file and
+compared with the median of its previous runs in the same mode and
+concurrency, and with --max-regression a path whose requests/sec dropped by
+more than that fraction, measured twice, fails the benchmark. This suits
+shared CI runners better than absolute thresholds.
+
+    python -m app.bench --duration 5 --concurrency 16
+    python -m app.bench --url http://127.0.0.1:10000 --json bench.json
+    python -m app.bench --history ~/.cache/app-bench/history.jsonl --max-regression 0.5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import threading
+from datetime import datetime, timezone
+from http.client import HTTPConnection
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+PATHS = ("/", "/bad")
+# Previous runs of a path that its requests/sec is compared against.
+BASELINE_RUNS = 5
+
+class BenchResult(NamedTuple):
+    path: str
+    requests: int
+    errors: int
+    rps: float
+    p50_ms: float
+    p99_ms: float
+
+def summarize(path: str, latencies: List[float], errors: int, elapsed: float) -> BenchResult:
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p99 = cuts[49], cuts[98]
+    else:
+        p50 = p99 = latencies[0] if latencies else 0.0
+    return BenchResult(path, len(latencies), errors, len(latencies) / elapsed, p50 * 1000, p99 * 1000)
+
+async def asgi_get(app, path: str) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"accept-encoding", b"gzip")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+def bench_asgi(path: str, duration: float, concurrency: int) -> BenchResult:
+    from app.api import enroller
+
+    async def run():
+        latencies: List[float] = []
+        errors = 0
+        deadline = perf_counter() + duration
+
+        async def client():
+            nonlocal errors
+            while perf_counter() < deadline:
+                start = perf_counter()
+                status = await asgi_get(enroller, path)
+                if status == 200:
+                    latencies.append(perf_counter() - start)
+                else:
+                    errors += 1
+
+        start = perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return summarize(path, latencies, errors, perf_counter() - start)
+
+    return asyncio.run(run())
+
+def bench_server(url: str, path: str, duration: float, concurrency: int) -> BenchResult:
+    parts = urlsplit(url)
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = perf_counter() + duration
+
+    def client():
+        connection = HTTPConnection(parts.netloc, timeout=10)
+        local: List[float] = []
+        local_errors = 0
+        while perf_counter() < deadline:
+            start = perf_counter()
+            try:
+                connection.request("GET", path, headers={"Accept-Encoding": "gzip"})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, ValueError):
+                connection.close()
+                connection = HTTPConnection(parts.netloc, timeout=10)
+                ok = False
+            if ok:
+                local.append(perf_counter() - start)
+            else:
+                local_errors += 1
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(path, latencies, errors[0], perf_counter() - start)
+
+def load_history(path: Path) -> List[dict]:
+    if not path.exists():
+        return []
+    with open(path) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+def append_history(path: Path, results: List[BenchResult], mode: str, concurrency: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    started = datetime.now(timezone.utc).isoformat()
+    with open(path, "a") as fh:
+        for r in results:
+            fh.write(json.dumps({"started": started, "mode": mode, "concurrency": concurrency, **r._asdict()}) + "\n")
+
+def baselines(history: List[dict], runs: int = BASELINE_RUNS) -> Dict[Tuple[str, int, str], float]:
+    """Returns the median requests/sec of each (mode, concurrency, path) over its latest runs in history."""
+    rps: Dict[Tuple[str, int, str], List[float]] = {}
+    for record in history:
+        rps.setdefault((record["mode"], record["concurrency"], record["path"]), []).append(record["rps"])
+    return {key: statistics.median(values[-runs:]) for key, values in rps.items()}
+
+def regressed(result: BenchResult, baseline: Optional[float], max_regression: float) -> bool:
+    return baseline is not None and result.rps < baseline * (1 - max_regression)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="base url of a running server, the ASGI app is called in process if not given")
+    parser.add_argument("--paths", nargs="+", default=list(PATHS))
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds to load each path for")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--json", help="file to also write the results to as JSON")
+    parser.add_argument("--min-rps", type=float, help="fail if any path serves fewer requests per second")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if any path's p99 latency is higher")
+    parser.add_argument("--history", help="JSON lines file to compare with and append this run to")
+    parser.add_argument("--max-regression", type=float, help="fail if a path's requests/sec is below its baseline by more than this fraction")
+    args = parser.parse_args(argv)
+
+    mode = "server" if args.url else "asgi"
+    history_path = Path(args.history).expanduser() if args.history else None
+    baseline = baselines(load_history(history_path)) if history_path else {}
+
+    def bench(path: str) -> BenchResult:
+        if args.url:
+            return bench_server(args.url, path, args.duration, args.concurrency)
+        return bench_asgi(path, args.duration, args.concurrency)
+
+    results = []
+    for path in args.paths:
+        result = bench(path)
+        base = baseline.get((mode, args.concurrency, path))
+        if args.max_regression is not None and regressed(result, base, args.max_regression):
+            # Shared runners are noisy, a regression has to show twice.
+            print(f"{path:<8} {result.rps:>10.1f} req/s  below baseline {base:.1f} req/s, measuring again")
+            result = max(result, bench(path), key=lambda r: r.rps)
+        results.append(result)
+        change = f"  baseline {base:.1f} req/s ({(result.rps - base) / base:+.0%})" if base else ""
+        print(f"{path:<8} {result.rps:>10.1f} req/s  p50 {result.p50_ms:.3f} ms  p99 {result.p99_ms:.3f} ms  {result.requests} ok  {result.errors} errors{change}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"mode": mode, "results": [r._asdict() for r in results]}, fh, indent=2)
+
+    failed = [r.path for r in results if r.errors
+              or (args.min_rps is not None and r.rps < args.min_rps)
+              or (args.max_p99_ms is not None and r.p99_ms > args.max_p99_ms)
+              or (args.max_regression is not None and regressed(r, baseline.get((mode, args.concurrency, r.path)), args.max_regression))]
+    if history_path:
+        append_history(history_path, results, mode, args.concurrency)
+
+    if failed:
+        print(f"Regression in {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import gzip
+from email.utils import formatdate, parsedate_to_datetime
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Dict, NamedTuple
+
+from fastapi import Request, Response
+from fastapi.templating import Jinja2Templates
+
+try:
+    # brotli is optional, without it only gzip variants are served
+    import brotli
+except ImportError:
+    brotli = None
+
+CACHE_CONTROL = "no-cache"
+MEDIA_TYPE = "text/html"
+
+class RenderedView(NamedTuple):
+    # encoding ("identity", "gzip" or "br") to body
+    bodies: Dict[str, bytes]
+    # strong ETag of the identity body, variants append their encoding
+    etag: str
+    last_modified: str
+    last_modified_ts: int
+    # views_stamp at render time, for reload in dev mode
+    stamp: int
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into a mapping of coding to q value."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of etag against an If-None-Match header, as RFC 9110 asks."""
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+class ViewCache:
+    """
+    Renders views that do not depend on the request once and serves the
+    bytes, with a strong ETag and Last-Modified so clients can revalidate
+    with a 304, and gzip (plus brotli when installed) variants compressed
+    once up front.
+
+    With reload on, every request checks the modification times of the
+    views directory and re-renders a view when any template has changed,
+    so edits to a page or the layout it extends show up in development.
+    """
+
+    def __init__(self, templates: Jinja2Templates, views_path: Path, reload: bool = False):
+        self.templates = templates
+        self.views_path = Path(views_path)
+        self.reload = reload
+        self.rendered: Dict[str, RenderedView] = {}
+        self.lock = Lock()
+
+    def views_stamp(self) -> int:
+        return max((p.stat().st_mtime_ns for p in self.views_path.rglob("*") if p.is_file()), default=0)
+
+    def render(self, name: str, stamp: int) -> RenderedView:
+        body = self.templates.get_template(name).render().encode("utf-8")
+        bodies = {
+            "identity": body,
+            # mtime=0 so the same page always compresses to the same bytes
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body, mode=brotli.MODE_TEXT)
+
+        last_modified_ts = stamp // 1_000_000_000
+        return RenderedView(
+            bodies=bodies,
+            etag='"%s"' % sha256(body).hexdigest()[:32],
+            last_modified=formatdate(last_modified_ts, usegmt=True),
+            last_modified_ts=last_modified_ts,
+            stamp=stamp,
+        )
+
+    def get(self, name: str) -> RenderedView:
+        """Return the rendered view, rendering it on first use or after a change in reload mode."""
+        view = self.rendered.get(name)
+        stamp = self.views_stamp() if self.reload or view is None else view.stamp
+        if view is not None and view.stamp == stamp:
+            return view
+
+        with self.lock:
+            view = self.rendered.get(name)
+            if view is None or view.stamp != stamp:
+                view = self.rendered[name] = self.render(name, stamp)
+            return view
+
+    def warm(self, *names: str):
+        for name in names:
+            self.get(name)
+
+    def response(self, request: Request, name: str) -> Response:
+        view = self.get(name)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next(
+            (coding for coding in ("br", "gzip") if coding in view.bodies and accepted.get(coding, 0) > 0),
+            "identity",
+        )
+        etag = view.etag if encoding == "identity" else f'{view.etag[:-1]}-{encoding}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": view.last_modified,
+            "Cache-Control": CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+
+        if not_modified(request, etag, view.last_modified_ts):
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=view.bodies[encoding], media_type=MEDIA_TYPE, headers=headers)
+
+def not_modified(request: Request, etag: str, last_modified_ts: int) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= last_modified_ts
+        except (TypeError, ValueError):
+            return False
+
+    return False
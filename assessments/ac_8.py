@@ -2,23 +2,19 @@
 # Consumed by the oscal-workflow harness
 
 import os
-import textwrap
-from urllib import request
 
-from bs4 import BeautifulSoup
+from checklib import normalize_text, page_text
 
 # The system use notification text
 expected_use_notification = os.getenv('SSP_PARAM_AC_8_PRM_1')
 if expected_use_notification is None:
     raise Exception('ac-8_prm_1 must be defined in the SSP')
 
-# running via docker-compose.yaml
-response = request.urlopen('http://127.0.0.1:10000')
+# running via docker-compose.yaml, unless assessing another target
+target_url = os.getenv('ASSESSMENT_TARGET_URL', 'http://127.0.0.1:10000')
 
-soup = BeautifulSoup(response, 'html.parser')
+# The element that the system use notification text lives in, waiting for
+# the app to come up if it is still starting
+use_notification = page_text(target_url, 'body div p')
 
-# Drill into the element that the system use notification text lives
-raw_use_notification = soup.body.div.p.text
-clean_use_notification = textwrap.dedent(raw_use_notification).strip().replace('\n', ' ')
-
-assert clean_use_notification == expected_use_notification
+assert use_notification is not None and normalize_text(use_notification) == normalize_text(expected_use_notification)
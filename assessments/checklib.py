@@ -0,0 +1,230 @@
+# Helpers for assessment scripts that check the content of a page
+
+import codecs
+import http.client
+from html.parser import HTMLParser
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+try:
+    # lxml's pull parser is a lot faster, but is optional
+    from lxml import etree
+except ImportError:
+    etree = None
+
+CHUNK_SIZE = 16 * 1024
+# Errors while the app container is still starting, retried until ready.
+NOT_READY_ERRORS = (OSError, http.client.HTTPException)
+NOT_READY_STATUSES = (502, 503, 504)
+# Elements that never have content or an end tag.
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+}
+
+class PageError(Exception):
+    """The page could not be fetched, and retrying would not help."""
+
+class Selector:
+    """
+    A small subset of CSS selectors: compound selectors of a tag name, #id
+    and .class parts, joined by descendant (space) or child (>) combinators,
+    e.g. 'body div.content > p'.
+    """
+    STEP = re.compile(r'^(?P<tag>[a-zA-Z][\w-]*|\*)?(?P<rest>(?:[#.][\w-]+)*)$')
+
+    def __init__(self, selector: str):
+        self.steps: List[Tuple[str, Optional[str], Optional[str], frozenset]] = []
+        combinator = ' '
+        for token in selector.replace('>', ' > ').split():
+            if token == '>':
+                combinator = '>'
+                continue
+            match = self.STEP.match(token)
+            if not match:
+                raise ValueError(f"Unsupported selector '{token}' in '{selector}'")
+            rest = re.findall(r'[#.][\w-]+', match.group('rest'))
+            ids = [part[1:] for part in rest if part[0] == '#']
+            classes = frozenset(part[1:] for part in rest if part[0] == '.')
+            tag = match.group('tag')
+            self.steps.append((combinator, None if tag in (None, '*') else tag.lower(), ids[0] if ids else None, classes))
+            combinator = ' '
+        if not self.steps:
+            raise ValueError('Empty selector')
+
+    @staticmethod
+    def step_matches(step, element: Tuple[str, dict]) -> bool:
+        _, tag, element_id, classes = step
+        name, attrs = element
+        return ((tag is None or tag == name)
+                and (element_id is None or attrs.get('id') == element_id)
+                and classes <= set((attrs.get('class') or '').split()))
+
+    def matches(self, path: List[Tuple[str, dict]]) -> bool:
+        """
+        Whether the last element of path, the (tag, attributes) of an element
+        and all its ancestors from the root, matches the selector.
+        """
+        def match_from(step_idx: int, path_idx: int) -> bool:
+            if not self.step_matches(self.steps[step_idx], path[path_idx]):
+                return False
+            if step_idx == 0:
+                return True
+            if self.steps[step_idx][0] == '>':
+                return path_idx > 0 and match_from(step_idx - 1, path_idx - 1)
+            return any(match_from(step_idx - 1, idx) for idx in range(path_idx - 1, -1, -1))
+
+        return bool(path) and match_from(len(self.steps) - 1, len(path) - 1)
+
+class _StreamingTextParser(HTMLParser):
+    """
+    Collects the text of the first element matching a selector, fed the page
+    a chunk at a time, and marks itself done once that element is closed.
+    """
+    def __init__(self, selector: Selector):
+        super().__init__(convert_charrefs=True)
+        self.selector = selector
+        self.path: List[Tuple[str, dict]] = []
+        # depth of the matched element in path, None until it matches
+        self.match_depth: Optional[int] = None
+        self.text: List[str] = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        element = (tag, {name: value or '' for name, value in attrs})
+        if tag in VOID_ELEMENTS:
+            if self.match_depth is None and self.selector.matches(self.path + [element]):
+                self.done = True
+            return
+        self.path.append(element)
+        if self.match_depth is None and self.selector.matches(self.path):
+            self.match_depth = len(self.path)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.done or tag in VOID_ELEMENTS:
+            return
+        # Close up to the matching open element, like browsers do with
+        # unclosed elements, and ignore stray end tags.
+        for depth in range(len(self.path), 0, -1):
+            if self.path[depth - 1][0] == tag:
+                if self.match_depth is not None and depth <= self.match_depth:
+                    self.done = True
+                del self.path[depth - 1:]
+                return
+
+    def handle_data(self, data):
+        if self.match_depth is not None and not self.done:
+            self.text.append(data)
+
+def _stream_text_stdlib(chunks, selector: Selector) -> Optional[str]:
+    parser = _StreamingTextParser(selector)
+    # incremental, a character may be split across chunks
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        if parser.done:
+            break
+    else:
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+    return ''.join(parser.text) if parser.match_depth is not None else None
+
+def _stream_text_lxml(chunks, selector: Selector) -> Optional[str]:
+    # libxml2 assumes Latin-1 for pages without a charset, the app serves UTF-8
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding='utf-8')
+    matched = None
+
+    def element_path(element) -> List[Tuple[str, dict]]:
+        return [(e.tag, dict(e.attrib)) for e in reversed([element, *element.iterancestors()])]
+
+    def drain():
+        nonlocal matched
+        for event, element in parser.read_events():
+            if not isinstance(element.tag, str):
+                continue
+            if event == 'start' and matched is None and selector.matches(element_path(element)):
+                matched = element
+            elif event == 'end' and element is matched:
+                return ''.join(element.itertext())
+        return None
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        text = drain()
+        if text is not None:
+            return text
+    parser.close()
+    text = drain()
+    if text is None and matched is not None:
+        text = ''.join(matched.itertext())
+    return text
+
+def fetch_chunks(url: str, connect_timeout: float = 2.0, read_timeout: float = 10.0,
+        ready_timeout: float = 30.0, poll_interval: float = 0.5, sleep: Callable[[float], None] = time.sleep):
+    """
+    Requests url and yields its body a chunk at a time. Connecting may take
+    at most connect_timeout seconds and each read at most read_timeout. While
+    the server refuses connections, times out or answers 502, 503 or 504, as
+    when the app container is still starting, the request is retried every
+    poll_interval seconds for up to ready_timeout seconds.
+    """
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    deadline = time.monotonic() + ready_timeout
+
+    while True:
+        connection = connection_class(parts.netloc, timeout=connect_timeout)
+        try:
+            connection.connect()
+            connection.sock.settimeout(read_timeout)
+            connection.request('GET', target, headers={'Accept': 'text/html'})
+            response = connection.getresponse()
+            if response.status in NOT_READY_STATUSES:
+                raise ConnectionError(f"GET {url} returned HTTP {response.status}")
+            break
+        except NOT_READY_ERRORS as err:
+            connection.close()
+            if time.monotonic() + poll_interval > deadline:
+                raise TimeoutError(f"{url} was not ready within {ready_timeout}s: {err}") from err
+            sleep(poll_interval)
+
+    if response.status >= 400:
+        connection.close()
+        raise PageError(f"GET {url} returned HTTP {response.status}")
+
+    try:
+        while True:
+            chunk = response.read1(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        connection.close()
+
+def page_text(url: str, selector: str, **fetch_options) -> Optional[str]:
+    """
+    Returns the text of the first element of the page at url that matches
+    selector, None if none does. The page is parsed as it downloads and the
+    download stops once the element is complete. fetch_options are passed
+    to fetch_chunks.
+    """
+    stream_text = _stream_text_lxml if etree is not None else _stream_text_stdlib
+    chunks = fetch_chunks(url, **fetch_options)
+    try:
+        return stream_text(chunks, Selector(selector))
+    finally:
+        chunks.close()
+
+def normalize_text(text: str) -> str:
+    """Collapses all runs of whitespace to single spaces and strips the ends."""
+    return ' '.join(text.split())
@@ -1,6 +1,20 @@
 #!/bin/sh
+# Starts the enroller app on port 10000.
+#
+# ENROLLER_MODE=development (default) installs requirements on every start and
+# serves from one process, for a source tree mounted into a stock image.
+# ENROLLER_MODE=production expects dependencies baked into the image (see
+# Dockerfile) and serves from WEB_CONCURRENCY worker processes, one per CPU
+# by default, see app/serve.py. uvloop and httptools are used when installed.
+
+ENROLLER_MODE=${ENROLLER_MODE:-development}
+PORT=${PORT:-10000}
+
+if [ "$ENROLLER_MODE" = "production" ]; then
+  exec python -m app.serve --host 0.0.0.0 --port "$PORT"
+fi
 
 pip --version
 pip install -r requirements.txt
 
-uvicorn app.api:enroller --proxy-headers --host 0.0.0.0 --port 10000
+exec uvicorn app.api:enroller --proxy-headers --host 0.0.0.0 --port "$PORT"
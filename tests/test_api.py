@@ -1,9 +1,63 @@
+import os
+import time
+
+from fastapi.templating import Jinja2Templates
 from fastapi.testclient import TestClient
 
-from app.api import enroller
+from app.api import enroller, views
+from app.render_cache import ViewCache
 
 client = TestClient(enroller)
 
 def test_read_landing():
     response = client.get("/")
     assert response.status_code == 200
+
+def test_read_bad():
+    response = client.get("/bad")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/html; charset=utf-8"
+
+def test_cached_view_matches_template_render():
+    expected = views.get_template("warning/conforming.html").render()
+    response = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.text == expected
+
+def test_cached_view_revalidates_with_etag():
+    response = client.get("/", headers={"Accept-Encoding": "identity"})
+    etag = response.headers["etag"]
+
+    revalidated = client.get("/", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+    other = client.get("/bad", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert other.status_code == 200
+
+def test_cached_view_revalidates_with_last_modified():
+    response = client.get("/")
+    revalidated = client.get("/", headers={"If-Modified-Since": response.headers["last-modified"]})
+    assert revalidated.status_code == 304
+
+def test_cached_view_gzip():
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.text == views.get_template("warning/conforming.html").render()
+
+def test_view_cache_reloads_changed_templates(tmp_path):
+    tmp_path.joinpath("page.html").write_text("{% extends 'layout.html' %}{% block body %}v1{% endblock %}")
+    layout = tmp_path.joinpath("layout.html")
+    layout.write_text("<p>{% block body %}{% endblock %}</p>")
+    cache = ViewCache(Jinja2Templates(directory=tmp_path), tmp_path, reload=True)
+    assert cache.get("page.html").bodies["identity"] == b"<p>v1</p>"
+
+    layout.write_text("<div>{% block body %}{% endblock %}</div>")
+    os.utime(layout, ns=(time.time_ns() + 1_000_000_000,) * 2)
+    assert cache.get("page.html").bodies["identity"] == b"<div>v1</div>"
+
+    cache.reload = False
+    layout.write_text("<span>{% block body %}{% endblock %}</span>")
+    assert cache.get("page.html").bodies["identity"] == b"<div>v1</div>"
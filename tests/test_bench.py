@@ -0,0 +1,35 @@
+import json
+
+from app.bench import BenchResult, baselines, main, regressed
+
+def test_bench_asgi(tmp_path):
+    output = tmp_path.joinpath("bench.json")
+    assert main(["--duration", "0.2", "--concurrency", "2", "--json", str(output)]) == 0
+
+    results = json.loads(output.read_text())["results"]
+    assert [r["path"] for r in results] == ["/", "/bad"]
+    assert all(r["requests"] > 0 and r["errors"] == 0 and r["p99_ms"] >= r["p50_ms"] for r in results)
+
+def test_regressed():
+    history = [{"mode": "asgi", "concurrency": 16, "path": "/", "rps": rps} for rps in (100.0, 900.0, 1000.0, 1100.0)]
+    baseline = baselines(history, runs=3)
+    assert baseline == {("asgi", 16, "/"): 1000.0}
+
+    result = BenchResult("/", 600, 0, 600.0, 1.0, 2.0)
+    assert not regressed(result, baseline[("asgi", 16, "/")], 0.5)
+    assert regressed(result, baseline[("asgi", 16, "/")], 0.25)
+    assert not regressed(result, None, 0.25)
+
+def test_bench_history(tmp_path, capsys):
+    history = tmp_path.joinpath("history.jsonl")
+    args = ["--duration", "0.1", "--concurrency", "2", "--paths", "/", "--history", str(history)]
+
+    assert main(args) == 0
+    records = [json.loads(line) for line in history.read_text().splitlines()]
+    assert [(r["mode"], r["concurrency"], r["path"]) for r in records] == [("asgi", 2, "/")]
+
+    # a baseline no run can match fails, after measuring again
+    history.write_text(json.dumps({**records[0], "rps": 1e12}) + "\n")
+    assert main([*args, "--max-regression", "0.5"]) == 1
+    assert "measuring again" in capsys.readouterr().out
+    assert len(history.read_text().splitlines()) == 2
@@ -0,0 +1,122 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+
+from assessments import checklib
+from assessments.checklib import PageError, Selector, normalize_text, page_text
+
+PAGE = b"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Enroller</title></head>
+<body>
+  <div class="banner"><img src="logo.png"><br>
+    <p>
+      You are accessing a U.S. Government
+      information system &amp; all use is monitored.
+    </p>
+  </div>
+  <div id="footer"><p class="small">Footer</p></div>
+</body>
+</html>
+"""
+
+@pytest.fixture(params=["lxml", "stdlib"])
+def parser(request, monkeypatch):
+    if request.param == "lxml":
+        if checklib.etree is None:
+            pytest.skip("lxml is not installed")
+    else:
+        monkeypatch.setattr(checklib, "etree", None)
+    return request.param
+
+@pytest.fixture
+def server():
+    state = {"unavailable": 0, "requests": 0, "status": 200, "body": PAGE}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"] += 1
+            if state["unavailable"]:
+                state["unavailable"] -= 1
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(state["status"])
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(state["body"])))
+            self.end_headers()
+            self.wfile.write(state["body"])
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    state["url"] = f"http://127.0.0.1:{httpd.server_address[1]}/"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+def element_path(*elements):
+    return [(tag, attrs) for tag, attrs in elements]
+
+def test_selector_matches():
+    path = element_path(("html", {}), ("body", {}), ("div", {"id": "footer", "class": "a b"}), ("p", {}))
+    assert Selector("body div p").matches(path)
+    assert Selector("div#footer > p").matches(path)
+    assert Selector("html .b p").matches(path)
+    assert Selector("* > p").matches(path)
+    assert not Selector("body > p").matches(path)
+    assert not Selector("div.c p").matches(path)
+    assert not Selector("body div").matches(path)
+
+    with pytest.raises(ValueError):
+        Selector("div[hidden]")
+
+def test_page_text(server, parser):
+    text = page_text(server["url"], "body div p")
+    assert normalize_text(text) == "You are accessing a U.S. Government information system & all use is monitored."
+    assert page_text(server["url"], "div#footer > p.small") == "Footer"
+    assert page_text(server["url"], "body > p") is None
+
+def test_page_text_multibyte_chunks(parser, monkeypatch):
+    page = "<html><body><div><p>Zugriff über ein System</p></div></body></html>".encode()
+    # split the two byte ü across chunks
+    split = page.index("ü".encode()) + 1
+    monkeypatch.setattr(checklib, "fetch_chunks", lambda url, **options: (chunk for chunk in (page[:split], page[split:])))
+    assert page_text("http://unused", "div p") == "Zugriff über ein System"
+
+def test_page_text_stops_after_element(parser, monkeypatch):
+    read = []
+
+    def chunks(url, **options):
+        yield b"<html><body><div><p>Notice</p>"
+        read.append(1)
+        while True:
+            yield b"<div>" + b"filler " * 1000 + b"</div>"
+            read.append(1)
+
+    monkeypatch.setattr(checklib, "fetch_chunks", chunks)
+    assert page_text("http://unused", "div p") == "Notice"
+    assert len(read) <= 1
+
+def test_fetch_waits_until_ready(server):
+    server["unavailable"] = 2
+    sleeps = []
+    assert page_text(server["url"], "body div p", poll_interval=0.01, sleep=sleeps.append) is not None
+    assert server["requests"] == 3
+    assert sleeps == [0.01, 0.01]
+
+def test_fetch_not_ready_times_out(server):
+    server["unavailable"] = 1000
+    with pytest.raises(TimeoutError):
+        page_text(server["url"], "body div p", ready_timeout=0.05, poll_interval=0.01)
+
+def test_fetch_error_status(server):
+    server["status"] = 404
+    with pytest.raises(PageError):
+        page_text(server["url"], "body div p")
+    assert server["requests"] == 1